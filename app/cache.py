@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache de produtos por SKU (um por processo). 0 itens desliga o cache.
+TAMANHO_CACHE_SKU = int(os.getenv("NEXUS_CACHE_SKU_TAMANHO", "10000"))
+TTL_CACHE_SKU = float(os.getenv("NEXUS_CACHE_SKU_TTL", "30")) # segundos
+
+
+class CacheLRU:
+    """
+    Cache em memória com limite de itens (descarta o usado há mais tempo) e
+    validade (TTL). Thread-safe: os handlers sync rodam no threadpool.
+
+    O TTL limita por quanto tempo outro processo (ou uma escrita direta no
+    banco) pode deixar um item desatualizado; escritas feitas por este
+    processo chamam remover() e valem na hora.
+    """
+
+    def __init__(self, tamanho_max: int, ttl: float):
+        self.tamanho_max = tamanho_max
+        self.ttl = ttl
+        self._itens = OrderedDict() # chave -> (expira_em, valor), do mais antigo ao mais recente
+        self._lock = threading.Lock()
+        # Sobe a cada remoção: uma leitura do banco que começou antes de uma
+        # escrita não pode guardar o valor antigo depois da invalidação
+        self._geracao = 0
+        self.acertos = 0
+        self.faltas = 0
+        self.despejos = 0
+
+    def geracao(self) -> int:
+        """Capture antes de ler do banco e repasse ao guardar()."""
+        return self._geracao
+
+    def obter(self, chave):
+        """Valor guardado ou None (ausente ou expirado)."""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._itens[chave]
+                self.faltas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item[1]
+
+    def guardar(self, chave, valor, geracao: int = None):
+        if self.tamanho_max <= 0:
+            return
+        with self._lock:
+            if geracao is not None and geracao != self._geracao:
+                return # Houve escrita durante a leitura: o valor pode estar velho
+            self._itens[chave] = (time.monotonic() + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_max:
+                self._itens.popitem(last=False)
+                self.despejos += 1
+
+    def remover(self, chaves):
+        with self._lock:
+            self._geracao += 1
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "tamanho_max": self.tamanho_max,
+                "ttl": self.ttl,
+                "itens": len(self._itens),
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "despejos": self.despejos,
+                "taxa_acerto": round(self.acertos / consultas, 4) if consultas else None,
+            }
@@ -0,0 +1,25 @@
+import unicodedata
+
+# Filtro de categoria igual nos dois backends: "Eletrônicos", "eletronicos" e
+# "ELETRÔNICOS" são a mesma categoria. O Mongo guarda a forma normalizada em
+# 'categoria_busca'; o SQLite troca a categoria pedida pelos nomes gravados
+# que batem com ela (nomes_da_categoria) e segue usando o índice de categoria.
+
+
+def normalizar_categoria(categoria: str) -> str:
+    """
+    Forma canônica da categoria para busca: sem acentos e em minúsculas.
+    "Eletrônicos", "eletronicos" e "ELETRÔNICOS" viram "eletronicos".
+    """
+    sem_acento = unicodedata.normalize("NFKD", categoria or "")
+    sem_acento = "".join(c for c in sem_acento if not unicodedata.combining(c))
+    return sem_acento.casefold().strip()
+
+
+def nomes_da_categoria(categoria: str, gravadas) -> list:
+    """
+    Nomes em `gravadas` (as categorias como estão no banco) equivalentes à
+    pedida. Sem nenhum, a própria categoria pedida (o filtro não casa nada).
+    """
+    alvo = normalizar_categoria(categoria)
+    return [nome for nome in gravadas if normalizar_categoria(nome) == alvo] or [categoria]
@@ -1,11 +1,50 @@
 import os
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient, monitoring
 from dotenv import load_dotenv
+from app.metricas import metricas
 
 load_dotenv()
 
 MONGO_URL = os.getenv("MONGO_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
+# sync (padrão): rotas "def" com o MongoClient no threadpool do Starlette.
+# async: as rotas do dia a dia viram "async def" sobre o AsyncMongoClient.
+MODO_ASYNC = os.getenv("NEXUS_MODO", "sync").lower() == "async"
 
-client = MongoClient(MONGO_URL)
+class MonitorComandos(monitoring.CommandListener):
+    """
+    Tempo de cada comando enviado ao MongoDB (find, aggregate, getMore...)
+    medido pelo próprio driver, para /metrics. Roda na thread ou task que fez
+    a chamada, então o tempo também soma na requisição em andamento.
+    """
+
+    def started(self, evento):
+        pass
+
+    def succeeded(self, evento):
+        metricas.registrar_banco(evento.command_name, evento.duration_micros / 1e6)
+
+    def failed(self, evento):
+        metricas.registrar_banco(evento.command_name, evento.duration_micros / 1e6)
+
+monitor_comandos = MonitorComandos()
+
+client = MongoClient(MONGO_URL, event_listeners=[monitor_comandos])
 db = client[DATABASE_NAME]
+
+# Cliente async: aberto e fechado pelo lifespan do router (conectar_async/fechar_async)
+cliente_async = None
+
+async def conectar_async():
+    global cliente_async
+    cliente_async = AsyncMongoClient(MONGO_URL, event_listeners=[monitor_comandos])
+    await cliente_async.aconnect()
+
+async def fechar_async():
+    global cliente_async
+    if cliente_async is not None:
+        await cliente_async.close()
+        cliente_async = None
+
+def db_async():
+    return cliente_async[DATABASE_NAME]
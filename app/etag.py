@@ -0,0 +1,51 @@
+from fastapi import Response
+
+# As leituras carregam a versão do catálogo como ETag. Toda escrita incrementa
+# a versão, então um ETag igual ao atual garante que nada mudou desde a cópia
+# do cliente e a resposta pode ser um 304 sem corpo. O GET por SKU usa a
+# versão do próprio produto (etag_do_produto).
+
+
+def etag_da_versao(versao: int) -> str:
+    return f'"v{versao}"'
+
+
+def etag_do_produto(versao: int) -> str:
+    """
+    ETag do GET por SKU: a `versao` do próprio produto, não a do catálogo.
+    Só muda quando o produto muda, e o mesmo valor serve de If-Match no PUT/DELETE.
+    """
+    return f'"{versao}"'
+
+
+def cliente_atualizado(if_none_match: str, etag: str) -> bool:
+    """True quando o If-None-Match enviado já contém o ETag atual."""
+    if not if_none_match:
+        return False
+    candidatos = [c.strip() for c in if_none_match.split(",")]
+    # Comparação fraca (RFC 9110): o prefixo W/ não importa no If-None-Match
+    return "*" in candidatos or any(c.removeprefix("W/") == etag for c in candidatos)
+
+
+def cabecalhos_etag(etag: str) -> dict:
+    # no-cache: o cliente pode guardar, mas revalida (If-None-Match) antes de usar
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def resposta_304(etag: str) -> Response:
+    return Response(status_code=304, headers=cabecalhos_etag(etag))
+
+
+# Escritas condicionais: o cliente manda no If-Match o ETag do GET por SKU
+# (ou o campo `versao` do produto que leu: "3", 3 ou W/"3"). A escrita só
+# acontece se o produto ainda estiver nessa versão; senão responde 412 e
+# ninguém perde a alteração do outro.
+
+def versao_do_if_match(if_match: str):
+    """Versão esperada pelo cliente, ou None sem If-Match (ou com "*"). ValueError se inválida."""
+    if not if_match or if_match.strip() == "*":
+        return None
+    valor = if_match.strip().removeprefix("W/").strip('"')
+    if not valor.isdigit():
+        raise ValueError("If-Match deve ser a versão do produto (ex: \"3\")")
+    return int(valor)
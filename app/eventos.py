@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import threading
+from contextlib import suppress
+
+# Sem aviso de escrita deste processo, o hub ainda lê o feed a cada intervalo:
+# pega escritas de outros workers (e do Mongo sem change streams)
+INTERVALO_EVENTOS = float(os.getenv("NEXUS_EVENTOS_INTERVALO", "1.0")) # segundos
+# Comentário SSE quando não há eventos: mantém a conexão viva atrás de proxies
+PING_EVENTOS = 15 # segundos
+# Lotes esperando por conexão. Quem não acompanha é desconectado e, ao
+# reconectar (o EventSource faz isso sozinho), retoma pelo Last-Event-ID
+FILA_POR_CONEXAO = 256
+LIMITE_LEITURA = 1000 # mudanças por leitura do feed
+RECONEXAO_MS = 3000
+
+MEDIA_TYPE_SSE = "text/event-stream"
+CABECALHOS_SSE = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Hubs ativos no processo (um por app), acordados depois de cada escrita
+_hubs = set()
+
+
+def avisar_escrita():
+    """Chamada depois de toda escrita no catálogo, de qualquer thread."""
+    for hub in list(_hubs):
+        hub.avisar()
+
+
+def revisao_de_retomada(last_event_id: str = None, since: int = None):
+    """De onde retomar: o Last-Event-ID da reconexão vale mais que o ?since=; sem nenhum, None (agora)."""
+    if last_event_id:
+        if not last_event_id.strip().isdigit():
+            raise ValueError("Last-Event-ID deve ser uma revisão (número)")
+        return int(last_event_id)
+    return since
+
+
+def formatar_evento(evento: str, dados, id_evento: int = None) -> str:
+    linhas = [] if id_evento is None else [f"id: {id_evento}"]
+    linhas += [f"event: {evento}", "data: " + json.dumps(dados, ensure_ascii=False, default=str)]
+    return "\n".join(linhas) + "\n\n"
+
+
+def eventos_da_pagina(pagina: dict) -> list:
+    """
+    Página do feed (formato do /produtos/changes) em eventos "produto" e
+    "removido", em ordem de revisão. O id é a revisão da qual o cliente pode
+    retomar sem perder nada: a do item, limitada à revisão segura da página
+    (no Mongo, itens recentes podem ainda ter revisões menores por aparecer).
+    """
+    itens = [("produto", p) for p in pagina["alterados"]] + [("removido", r) for r in pagina["removidos"]]
+    itens.sort(key=lambda item: item[1]["revisao"])
+    return [formatar_evento(evento, dados, min(dados["revisao"], pagina["revisao"])) for evento, dados in itens]
+
+
+class HubEventos:
+    """
+    Difusão do feed de mudanças para as conexões de GET /eventos (SSE).
+
+    Uma tarefa só lê o feed, acordada por avisar_escrita() (ou pelo change
+    stream do Mongo) e, na falta de aviso, a cada INTERVALO_EVENTOS; o mesmo
+    lote vai para todas as conexões: N clientes abertos custam uma leitura
+    por mudança, não N. Os eventos podem chegar repetidos (ex: na emenda
+    entre o que o cliente perdeu e o ao vivo); aplicar pelo sku é idempotente.
+    """
+
+    def __init__(self, ler_mudancas, ler_revisao, vigiar=None, intervalo: float = INTERVALO_EVENTOS):
+        self.ler_mudancas = ler_mudancas # async (desde, limite) -> página do feed; ValueError: revisão desconhecida
+        self.ler_revisao = ler_revisao # async () -> revisão atual do catálogo
+        self.vigiar = vigiar # Opcional: vigiar(avisar, parar) numa thread, ex: change stream
+        self.intervalo = intervalo
+        self.revisao = None # Até onde o feed já foi repassado (None: ninguém ouvindo)
+        self._repassadas = set() # Revisões acima de self.revisao já repassadas (o Mongo relê as recentes)
+        self._filas = set()
+        self._lock = None
+        self._aviso = None
+        self._loop = None
+        self._tarefa = None
+        self._vigia = None
+        self._parar = threading.Event()
+
+    async def iniciar(self):
+        """Chamado no lifespan: a tarefa nasce fora do contexto de qualquer requisição."""
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._aviso = asyncio.Event()
+        self._parar.clear()
+        self._tarefa = asyncio.create_task(self._repassar())
+        _hubs.add(self)
+
+    async def parar(self):
+        _hubs.discard(self)
+        self._parar.set()
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._tarefa
+            self._tarefa = None
+        for fila in list(self._filas):
+            self._encerrar(fila)
+
+    def avisar(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._aviso.set)
+
+    def estatisticas(self) -> dict:
+        return {"conexoes": len(self._filas), "revisao": self.revisao}
+
+    # --- DIFUSÃO ---
+
+    async def _repassar(self):
+        while True:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._aviso.wait(), self.intervalo)
+            self._aviso.clear()
+            async with self._lock:
+                if not self._filas:
+                    self.revisao = None # A próxima conexão recomeça do ponto atual
+                    continue
+                try:
+                    await self._ler()
+                except Exception: # Banco fora do ar: as conexões ficam no ping e o próximo ciclo tenta de novo
+                    pass
+
+    async def _ler(self):
+        while True:
+            try:
+                pagina = await self.ler_mudancas(self.revisao, LIMITE_LEITURA)
+            except ValueError as erro: # Banco recriado: a réplica dos clientes não vale mais
+                for fila in list(self._filas):
+                    self._encerrar(fila, [formatar_evento("ressincronizar", {"motivo": str(erro)})])
+                self.revisao = None
+                return
+
+            novos = {
+                "revisao": pagina["revisao"],
+                "alterados": [p for p in pagina["alterados"] if p["revisao"] not in self._repassadas],
+                "removidos": [r for r in pagina["removidos"] if r["revisao"] not in self._repassadas],
+            }
+            eventos = eventos_da_pagina(novos)
+            if eventos:
+                for fila in list(self._filas):
+                    self._entregar(fila, eventos)
+            self._repassadas.update(item["revisao"] for item in novos["alterados"] + novos["removidos"])
+            self.revisao = max(self.revisao, pagina["revisao"])
+            self._repassadas = {r for r in self._repassadas if r > self.revisao}
+            if not pagina["tem_mais"]:
+                return
+
+    def _entregar(self, fila: asyncio.Queue, eventos: list):
+        try:
+            fila.put_nowait(eventos)
+        except asyncio.QueueFull:
+            self._encerrar(fila)
+
+    def _encerrar(self, fila: asyncio.Queue, ultimos: list = None):
+        """Fecha a conexão: esvazia a fila e deixa só os `ultimos` eventos e o aviso de fim (None)."""
+        self._filas.discard(fila)
+        while not fila.empty():
+            fila.get_nowait()
+        if ultimos:
+            fila.put_nowait(ultimos)
+        fila.put_nowait(None)
+
+    # --- CONEXÕES ---
+
+    async def assinar(self, desde: int = None):
+        """
+        Gerador do corpo SSE de uma conexão. Com `desde` (Last-Event-ID ou
+        ?since=), repassa antes o que o cliente perdeu; sem, começa do agora.
+        O primeiro evento, "conectado", traz a revisão de partida.
+        """
+        fila = asyncio.Queue(FILA_POR_CONEXAO)
+        self._filas.add(fila) # Antes de ler a revisão: nada escrito daqui em diante se perde
+        if self.vigiar is not None and self._vigia is None:
+            self._vigia = threading.Thread(target=self.vigiar, args=(self.avisar, self._parar), daemon=True)
+            self._vigia.start()
+        try:
+            async with self._lock:
+                if self.revisao is None:
+                    self.revisao = await self.ler_revisao()
+                    self._repassadas.clear()
+                atual = self.revisao
+            desde = atual if desde is None else desde
+            yield f"retry: {RECONEXAO_MS}\n\n"
+            if desde > atual: # Revisão que o banco não conhece (ex: banco recriado)
+                yield formatar_evento("ressincronizar", {"motivo": "Revisão desconhecida: sincronize de novo com since=0"})
+                return
+            yield formatar_evento("conectado", {"revisao": desde}, desde)
+
+            # O que o cliente perdeu, página a página, até alcançar o ponto do hub
+            while desde < atual:
+                try:
+                    pagina = await self.ler_mudancas(desde, LIMITE_LEITURA)
+                except ValueError as erro:
+                    yield formatar_evento("ressincronizar", {"motivo": str(erro)})
+                    return
+                for evento in eventos_da_pagina(pagina):
+                    yield evento
+                if not pagina["tem_mais"] or pagina["revisao"] <= desde:
+                    break
+                desde = pagina["revisao"]
+
+            while True:
+                try:
+                    eventos = await asyncio.wait_for(fila.get(), PING_EVENTOS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if eventos is None:
+                    return
+                for evento in eventos:
+                    yield evento
+        finally:
+            self._filas.discard(fila)
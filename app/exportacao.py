@@ -0,0 +1,35 @@
+import csv
+import io
+import json
+
+FORMATOS_EXPORTACAO = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+COLUNAS_EXPORTACAO = ["sku", "nome", "categoria", "preco", "estoque", "url_imagem"]
+
+
+def formatar_lote(produtos: list, formato: str, cabecalho: bool = False) -> str:
+    """Serializa um lote de produtos (dicts) como NDJSON ou CSV."""
+    if formato == "ndjson":
+        return "".join(json.dumps(p, ensure_ascii=False) + "\n" for p in produtos)
+
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=COLUNAS_EXPORTACAO, extrasaction="ignore")
+    if cabecalho:
+        escritor.writeheader()
+    escritor.writerows(produtos)
+    return buffer.getvalue()
+
+
+def transmitir(lotes, formato: str):
+    """
+    Converte um gerador de lotes em pedaços de texto para o StreamingResponse.
+    Só um lote fica em memória por vez, então o consumo não depende do catálogo.
+    """
+    if formato == "csv":
+        # O cabeçalho sai mesmo quando o resultado é vazio
+        yield formatar_lote([], formato, cabecalho=True)
+    for lote in lotes:
+        yield formatar_lote(lote, formato)
@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+from pydantic import ValidationError
+
+FORMATOS = ("csv", "jsonl")
+MODOS_IMPORTACAO = ("inserir", "upsert")
+
+# Erros por linha de gravação, iguais nos dois backends. Dentro de um lote
+# vale a primeira linha de cada SKU; as seguintes viram ERRO_SKU_REPETIDO
+ERRO_SKU_REPETIDO = "SKU repetido no arquivo"
+ERRO_SKU_EXISTENTE = "SKU já existe."
+
+# Evita que um arquivo todo inválido gere uma resposta gigante
+MAX_ERROS_RELATORIO = 1000
+
+
+def detectar_formato(nome_arquivo: str, formato: str = None) -> str:
+    """Usa o formato informado ou, na falta dele, a extensão do arquivo."""
+    if formato:
+        formato = formato.lower()
+    else:
+        extensao = (nome_arquivo or "").rsplit(".", 1)[-1].lower()
+        formato = "jsonl" if extensao in ("jsonl", "ndjson") else extensao
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato não suportado. Use um de: {', '.join(FORMATOS)}")
+    return formato
+
+
+def _limpar_csv(linha: dict) -> dict:
+    """Campos vazios do CSV viram 'ausentes' (valem os defaults do schema)."""
+    registro = {k.strip(): v for k, v in linha.items() if k and v not in (None, "")}
+    # 'especificacoes' vem como texto JSON dentro da célula
+    if isinstance(registro.get("especificacoes"), str):
+        registro["especificacoes"] = json.loads(registro["especificacoes"])
+    return registro
+
+
+def ler_registros(arquivo, formato: str):
+    """
+    Lê o arquivo enviado linha a linha, sem carregá-lo inteiro na memória.
+    Gera tuplas (numero_da_linha, registro, erro). No CSV o registro é um dict;
+    no JSONL é o texto da linha, validado direto pelo Pydantic (sem json.loads).
+    Quando a linha não pôde ser interpretada, registro é None.
+    """
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    try:
+        if formato == "csv":
+            leitor = csv.DictReader(texto)
+            for linha in leitor:
+                try:
+                    yield leitor.line_num, _limpar_csv(linha), None
+                except ValueError as erro:
+                    yield leitor.line_num, None, f"JSON inválido em especificacoes: {erro}"
+        else:
+            for numero, linha in enumerate(texto, start=1):
+                if linha.strip():
+                    yield numero, linha, None
+    finally:
+        # Não deixa o wrapper fechar o arquivo original do upload
+        texto.detach()
+
+
+def _sku_do_registro(registro):
+    """Melhor esforço para identificar o SKU de uma linha inválida no relatório."""
+    if isinstance(registro, str):
+        try:
+            registro = json.loads(registro)
+        except ValueError:
+            return None
+    return registro.get("sku") if isinstance(registro, dict) else None
+
+
+def ler_lotes(arquivo, formato: str, modelo, tamanho_lote: int):
+    """
+    Agrupa os registros em lotes validados pelo modelo Pydantic.
+    Gera (validos, erros): validos é uma lista de (linha, produto) e erros
+    uma lista de dicionários prontos para o relatório.
+    """
+    validos, erros = [], []
+    for numero, registro, erro in ler_registros(arquivo, formato):
+        if registro is not None:
+            try:
+                if isinstance(registro, str):
+                    validos.append((numero, modelo.model_validate_json(registro)))
+                else:
+                    validos.append((numero, modelo(**registro)))
+            except ValidationError as erro_validacao:
+                erro = "; ".join(
+                    f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" if e["loc"] else e["msg"]
+                    for e in erro_validacao.errors()
+                )
+        if erro:
+            erros.append({"linha": numero, "sku": _sku_do_registro(registro), "erro": erro})
+
+        if len(validos) + len(erros) >= tamanho_lote:
+            yield validos, erros
+            validos, erros = [], []
+    if validos or erros:
+        yield validos, erros
+
+
+class RelatorioImportacao:
+    """Acumula os contadores e os erros (limitados) de uma importação."""
+
+    def __init__(self):
+        self.processados = 0
+        self.inseridos = 0
+        self.atualizados = 0
+        self.total_erros = 0
+        self.erros = []
+
+    def registrar_erros(self, erros: list):
+        self.total_erros += len(erros)
+        espaco = MAX_ERROS_RELATORIO - len(self.erros)
+        if espaco > 0:
+            self.erros.extend(erros[:espaco])
+
+    def como_dict(self):
+        return {
+            "processados": self.processados,
+            "inseridos": self.inseridos,
+            "atualizados": self.atualizados,
+            "total_erros": self.total_erros,
+            "erros": self.erros,
+        }
@@ -0,0 +1,73 @@
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# Índices esperados na coleção 'produtos': nome -> (chaves, opções)
+INDICES = {
+    # Busca por SKU (GET/PUT/DELETE) e garantia de que não há duplicidade
+    "sku_unico": ([("sku", ASCENDING)], {"unique": True}),
+    # Filtro de categoria + faixa/ordenação por preço (sku desempata o cursor)
+    "categoria_preco": ([("categoria_busca", ASCENDING), ("preco", ASCENDING), ("sku", ASCENDING)], {}),
+    # Filtro de categoria na ordenação "recentes"
+    "categoria_recentes": ([("categoria_busca", ASCENDING), ("_id", DESCENDING)], {}),
+    # Ordenações sem filtro de categoria
+    "preco_sku": ([("preco", ASCENDING), ("sku", ASCENDING)], {}),
+    "nome_sku": ([("nome", ASCENDING), ("sku", ASCENDING)], {}),
+    # Feed de mudanças (/produtos/changes): tudo depois de uma revisão, em ordem
+    "revisao": ([("revisao", ASCENDING)], {}),
+    # Busca textual (/produtos/busca). Stemming em português e sem diferenciar acentos.
+    "busca_texto": (
+        [("sku", TEXT), ("nome", TEXT), ("categoria", TEXT)],
+        {"default_language": "portuguese", "weights": {"sku": 10, "nome": 5, "categoria": 2}},
+    ),
+}
+
+
+def garantir_indices(colecao):
+    """Cria os índices que faltam. create_index não faz nada se o índice já existe."""
+    for nome, (chaves, opcoes) in INDICES.items():
+        colecao.create_index(chaves, name=nome, **opcoes)
+
+
+def verificar_indices(colecao):
+    """Retorna a lista de índices esperados que não existem na coleção."""
+    existentes = colecao.index_information()
+    return [nome for nome in INDICES if nome not in existentes]
+
+
+def plano_vencedor(colecao, filtro: dict, ordem=None):
+    """
+    Resume o plano escolhido pelo MongoDB para um filtro: lista de estágios
+    (ex: ['LIMIT', 'FETCH', 'IXSCAN']) e o índice usado, se houver.
+    """
+    cursor = colecao.find(filtro)
+    if ordem:
+        cursor = cursor.sort(ordem)
+    plano = cursor.explain()["queryPlanner"]["winningPlan"]
+    # Em versões novas o plano vem dentro de "queryPlan"
+    plano = plano.get("queryPlan", plano)
+
+    estagios, indice = [], None
+    while plano:
+        estagios.append(plano.get("stage"))
+        indice = plano.get("indexName", indice)
+        plano = plano.get("inputStage")
+    return {"estagios": estagios, "indice": indice}
+
+
+if __name__ == "__main__":
+    # python -m app.indices -> cria/verifica os índices e mostra os planos de consulta
+    from app.services import collection, preparar_colecao, normalizar_categoria
+
+    preparar_colecao()
+    faltando = verificar_indices(collection)
+    print("Índices faltando:", faltando or "nenhum")
+
+    exemplos = {
+        "sku": ({"sku": "NB-DELL-G15"}, None),
+        "categoria": ({"categoria_busca": normalizar_categoria("Eletrônicos")}, None),
+        "categoria + preço": (
+            {"categoria_busca": normalizar_categoria("Gamer"), "preco": {"$gte": 2000, "$lte": 5000}},
+            [("preco", ASCENDING), ("sku", ASCENDING)],
+        ),
+    }
+    for descricao, (filtro, ordem) in exemplos.items():
+        print(f"{descricao}: {plano_vencedor(collection, filtro, ordem)}")
@@ -0,0 +1,43 @@
+import os
+
+# Estoque igual ou abaixo deste valor conta como "estoque baixo" no /analytics/kpis
+ESTOQUE_BAIXO = int(os.getenv("NEXUS_ESTOQUE_BAIXO", "5")) # unidades
+
+
+def montar_kpis(categorias, limite: int) -> dict:
+    """
+    Indicadores do Dashboard a partir das somas por categoria (uma linha por
+    categoria com qtd_produtos, soma_preco, total_estoque, valor_estoque,
+    estoque_baixo e sem_estoque). Os totais saem dessas linhas, então o banco
+    só agrega uma vez.
+    """
+    categorias = [c for c in categorias if c["qtd_produtos"] > 0]
+    por_categoria = [
+        {
+            "categoria": c["categoria"],
+            "qtd_produtos": c["qtd_produtos"],
+            "valor_estoque": round(c["valor_estoque"], 2),
+            "ticket_medio": round(c["soma_preco"] / c["qtd_produtos"], 2),
+            "total_estoque": c["total_estoque"],
+            "estoque_baixo": c["estoque_baixo"],
+            "sem_estoque": c["sem_estoque"],
+        }
+        for c in categorias
+    ]
+    por_categoria.sort(key=lambda c: c["valor_estoque"], reverse=True)
+
+    qtd_produtos = sum(c["qtd_produtos"] for c in por_categoria)
+    soma_preco = sum(c["soma_preco"] for c in categorias)
+    return {
+        "total_produtos": qtd_produtos,
+        "valor_estoque": round(sum(c["valor_estoque"] for c in categorias), 2),
+        "ticket_medio": round(soma_preco / qtd_produtos, 2) if qtd_produtos else 0.0,
+        "total_estoque": sum(c["total_estoque"] for c in por_categoria),
+        "qtd_categorias": len(por_categoria),
+        "estoque_baixo": {
+            "limite": limite,
+            "qtd_produtos": sum(c["estoque_baixo"] for c in por_categoria),
+            "sem_estoque": sum(c["sem_estoque"] for c in por_categoria),
+        },
+        "categorias": por_categoria,
+    }
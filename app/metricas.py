@@ -0,0 +1,163 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Limites dos histogramas em segundos (o +Inf é implícito)
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MEDIA_TYPE_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+# nome -> (tipo, descrição) das métricas publicadas em /metrics
+DESCRICOES = {
+    "nexus_http_requests_total": ("counter", "Requisições atendidas por rota e status."),
+    "nexus_http_request_errors_total": ("counter", "Requisições que terminaram em erro (status >= 500)."),
+    "nexus_http_request_duration_seconds": ("histogram", "Tempo total da requisição (banco + regra + serialização)."),
+    "nexus_http_request_db_seconds": ("histogram", "Tempo no banco dentro da requisição."),
+    "nexus_db_operation_duration_seconds": ("histogram", "Tempo de cada chamada ao banco por operação."),
+}
+
+
+class MedicaoBanco:
+    """Tempo e chamadas ao banco somados durante uma requisição."""
+
+    __slots__ = ("segundos", "chamadas")
+
+    def __init__(self):
+        self.segundos = 0.0
+        self.chamadas = 0
+
+
+# Medição da requisição em andamento. O middleware cria uma por requisição; o
+# threadpool do Starlette e as tasks do asyncio copiam o contexto, então os
+# handlers "def" e "async def" enxergam a mesma.
+medicao_atual: ContextVar = ContextVar("medicao_banco", default=None)
+
+
+class Metricas:
+    """
+    Contadores e histogramas em memória (um registro por processo), exportados
+    no formato texto do Prometheus. Thread-safe: os handlers sync rodam no threadpool.
+    """
+
+    def __init__(self, buckets=BUCKETS_SEGUNDOS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._contadores = {} # (nome, rótulos) -> valor
+        self._histogramas = {} # (nome, rótulos) -> [contagem por bucket..., +Inf, soma]
+
+    def contar(self, nome: str, rotulos: tuple, valor: float = 1):
+        with self._lock:
+            self._contadores[(nome, rotulos)] = self._contadores.get((nome, rotulos), 0) + valor
+
+    def observar(self, nome: str, rotulos: tuple, segundos: float):
+        with self._lock:
+            serie = self._histogramas.get((nome, rotulos))
+            if serie is None:
+                serie = self._histogramas[(nome, rotulos)] = [0] * (len(self.buckets) + 1) + [0.0]
+            serie[bisect_left(self.buckets, segundos)] += 1
+            serie[-1] += segundos
+
+    def registrar_banco(self, operacao: str, segundos: float, medicao: MedicaoBanco = None):
+        """
+        Uma chamada ao banco: vai para o histograma da operação e para a
+        requisição em andamento (a do contexto, ou `medicao` quando a chamada
+        roda numa thread sem o contexto da requisição, como a do aiosqlite).
+        """
+        self.observar("nexus_db_operation_duration_seconds", (("operation", operacao),), segundos)
+        medicao = medicao or medicao_atual.get()
+        if medicao is not None:
+            medicao.segundos += segundos
+            medicao.chamadas += 1
+
+    def registrar_requisicao(self, metodo: str, rota: str, status: int, segundos: float, medicao: MedicaoBanco):
+        rotulos = (("method", metodo), ("route", rota))
+        self.contar("nexus_http_requests_total", rotulos + (("status", str(status)),))
+        if status >= 500:
+            self.contar("nexus_http_request_errors_total", rotulos)
+        self.observar("nexus_http_request_duration_seconds", rotulos, segundos)
+        self.observar("nexus_http_request_db_seconds", rotulos, medicao.segundos)
+
+    def texto(self) -> str:
+        """Todas as séries no formato de exposição do Prometheus (text 0.0.4)."""
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {chave: list(serie) for chave, serie in self._histogramas.items()}
+
+        por_nome = {}
+        for (nome, rotulos), valor in sorted(contadores.items()):
+            por_nome.setdefault(nome, []).append(f"{nome}{formatar_rotulos(rotulos)} {valor}")
+        for (nome, rotulos), serie in sorted(histogramas.items()):
+            linhas = por_nome.setdefault(nome, [])
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + ("+Inf",), serie):
+                acumulado += contagem
+                linhas.append(f"{nome}_bucket{formatar_rotulos(rotulos + (('le', str(limite)),))} {acumulado}")
+            linhas.append(f"{nome}_sum{formatar_rotulos(rotulos)} {serie[-1]}")
+            linhas.append(f"{nome}_count{formatar_rotulos(rotulos)} {acumulado}")
+
+        saida = []
+        for nome, linhas in por_nome.items():
+            tipo, descricao = DESCRICOES[nome]
+            saida += [f"# HELP {nome} {descricao}", f"# TYPE {nome} {tipo}", *linhas]
+        return "\n".join(saida) + "\n"
+
+    def limpar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+
+def escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatar_rotulos(rotulos: tuple) -> str:
+    if not rotulos:
+        return ""
+    return "{" + ",".join(f'{chave}="{escapar(valor)}"' for chave, valor in rotulos) + "}"
+
+
+# Registro do processo: o middleware, o SQLite (main.py) e o listener do
+# Mongo (app/database.py) escrevem aqui; GET /metrics lê
+metricas = Metricas()
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI: conta requisições e erros e mede a latência por rota
+    (o molde, ex: "/produtos/{sku}", não o caminho com valores). O tempo vai
+    até o último pedaço do corpo, então respostas em streaming contam inteiras.
+
+    ASGI puro em vez de BaseHTTPMiddleware: não cria task extra por
+    requisição e a medição do banco chega aos handlers pelo contexto.
+    """
+
+    def __init__(self, app, registro: Metricas = None):
+        self.app = app
+        self.registro = registro or metricas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        medicao = MedicaoBanco()
+        token = medicao_atual.set(medicao)
+        status = 500 # Exceção antes do início da resposta
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            segundos = time.perf_counter() - inicio
+            medicao_atual.reset(token)
+            # O roteador grava a rota encontrada no próprio scope
+            rota = getattr(scope.get("route"), "path", None) or "nao_encontrada"
+            self.registro.registrar_requisicao(scope["method"], rota, status, segundos, medicao)
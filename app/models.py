@@ -32,6 +32,12 @@ class ProdutoSchema(BaseModel):
             return IMAGEM_PADRAO
         return v
         
+# Produto como sai nas leituras: com a revisão da última escrita (feed de mudanças)
+class ProdutoLido(ProdutoSchema):
+    revisao: int = 0
+    atualizado_em: Optional[str] = None
+    versao: int = 1 # Vai no If-Match das escritas condicionais
+
 # Modelo para atualização (quando editamos um produto)
 class ProdutoUpdate(BaseModel):
     nome: Optional[str] = None
@@ -41,5 +47,45 @@ class ProdutoUpdate(BaseModel):
     url_imagem: Optional[str] = None
     especificacoes: Optional[Dict[str, Any]] = None
 
+# Limite de itens aceitos em uma única requisição de atualização em massa
+MAX_ITENS_LOTE = 10000
+
+# Item da atualização em massa: o SKU identifica o produto e o resto é parcial
+class ProdutoUpdateLote(ProdutoUpdate):
+    sku: str
+
+def juntar_por_sku(atualizacoes: List[ProdutoUpdateLote]) -> Dict[str, Dict[str, Any]]:
+    """
+    {sku: campos} do lote, na ordem em que cada SKU aparece. SKU repetido vira
+    uma atualização só (o campo do item mais recente vence), então os
+    contadores falam de produtos e não de itens. Campos nulos ficam de fora.
+    """
+    por_sku = {}
+    for item in atualizacoes:
+        campos = item.dict(exclude_none=True)
+        campos.pop("sku", None)
+        por_sku.setdefault(item.sku, {}).update(campos)
+    return por_sku
+
+class ResultadoLoteResponse(BaseModel):
+    encontrados: int # SKUs que existem no banco
+    modificados: int # Produtos que realmente mudaram
+    nao_encontrados: List[str]
+
+# Reserva de estoque (POST /produtos/{sku}/estoque/reservar e /estoque/reservas)
+class QuantidadeReserva(BaseModel):
+    quantidade: int = Field(..., gt=0, le=1_000_000)
+
+class ItemReserva(QuantidadeReserva):
+    sku: str
+
+class PedidoReserva(BaseModel):
+    # Tudo ou nada: se um item não tiver estoque, nenhum é reservado
+    itens: List[ItemReserva] = Field(..., min_length=1)
+
 class ListaProdutosResponse(BaseModel):
-    produtos: List[ProdutoSchema]
\ No newline at end of file
+    produtos: List[ProdutoLido]
+    total: Optional[int] = None # Só vem preenchido quando o cliente pede (?total=...)
+    pagina: int = 1
+    limite: int = 10
+    proximo_cursor: Optional[str] = None # Token para buscar a próxima página
\ No newline at end of file
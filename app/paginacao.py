@@ -0,0 +1,46 @@
+import base64
+import json
+
+# Chaves de ordenação aceitas pelas listagens (mesmas opções da Vitrine)
+ORDENACOES = ("recentes", "menor_preco", "maior_preco", "nome")
+
+
+def codificar_cursor(valores: list) -> str:
+    """
+    Transforma a chave do último item da página (ex: [preco, sku]) em um
+    token opaco para a URL. O cliente só precisa devolvê-lo na próxima chamada.
+    """
+    bruto = json.dumps(valores, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+
+def _numero(valor) -> bool:
+    # bool é subclasse de int, mas true/false não é preço
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def decodificar_cursor(token: str, ordenar: str, tipo_id: type = int) -> list:
+    """
+    Operação inversa de codificar_cursor, conferindo a chave contra a ordenação
+    em uso: [id] em "recentes" (rowid int no SQLite, `tipo_id`=str para o
+    ObjectId do Mongo) e [valor, sku] nas demais. Um cursor de outra ordenação
+    (ou adulterado) lança ValueError, como qualquer token inválido.
+    """
+    try:
+        # Devolve o padding "=" removido na codificação
+        bruto = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        valores = json.loads(bruto)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(valores, list):
+        raise ValueError("Cursor inválido")
+
+    if ordenar == "recentes":
+        valido = len(valores) == 1 and isinstance(valores[0], tipo_id) and not isinstance(valores[0], bool)
+    elif len(valores) == 2 and isinstance(valores[1], str):
+        valido = isinstance(valores[0], str) if ordenar == "nome" else _numero(valores[0])
+    else:
+        valido = False
+    if not valido:
+        raise ValueError("Cursor inválido")
+    return valores
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+import xlsxwriter
+
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Colunas da tabela: (cabeçalho, largura, formato da coluna)
+COLUNAS_INVENTARIO = [
+    ("SKU", 18, "texto"),
+    ("Produto", 40, "texto"),
+    ("Categoria", 20, "texto"),
+    ("Preço Unitário", 18, "moeda"),
+    ("Estoque", 12, "centro"),
+    ("Total", 18, "moeda"),
+]
+LINHA_CABECALHO = 8
+
+# Relatórios já gerados ficam em disco, um por versão do catálogo
+PASTA_CACHE_RELATORIOS = os.getenv("NEXUS_CACHE_RELATORIOS_DIR", os.path.join(tempfile.gettempdir(), "nexus_relatorios"))
+MAX_RELATORIOS = int(os.getenv("NEXUS_CACHE_RELATORIOS_MAX", "8")) # arquivos
+
+
+def nome_relatorio() -> str:
+    return f"Report_{datetime.now().strftime('%Y%m%d')}.xlsx"
+
+
+def gerar_inventario(linhas, kpis: dict, pasta: str = None) -> str:
+    """
+    Monta o "Relatório Executivo de Inventário" num arquivo temporário e
+    devolve o caminho (quem chama decide: publicar no cache ou apagar).
+
+    - linhas: iterável de tuplas (sku, nome, categoria, preco, estoque, total),
+      já na ordem do relatório. É consumido uma vez, direto do cursor do banco.
+    - kpis: {"total_skus", "total_itens", "patrimonio"} calculados no banco,
+      porque no modo constant_memory as linhas de cima não podem ser escritas
+      depois da tabela.
+
+    constant_memory: cada linha vai para o disco quando a seguinte começa,
+    então a memória não cresce com o catálogo. As células da tabela usam o
+    formato da coluna (set_column) e saem com um write_row por produto.
+    """
+    descritor, caminho = tempfile.mkstemp(suffix=".tmp", prefix="inventario_", dir=pasta)
+    os.close(descritor)
+
+    # strings_to_*: texto do catálogo sai sempre como texto. Além de pular as
+    # regex de URL/fórmula por célula, um nome "=HYPERLINK(...)" não vira fórmula.
+    wb = xlsxwriter.Workbook(caminho, {
+        "constant_memory": True, "strings_to_urls": False, "strings_to_formulas": False
+    })
+    try:
+        ws = wb.add_worksheet("Relatório Executivo")
+        ws.hide_gridlines(2)
+
+        # =========================
+        # DESIGN SYSTEM
+        # =========================
+        azul_escuro = "#0B1F3A"
+        azul = "#1F4E79"
+        verde = "#16A34A"
+
+        fmt_title = wb.add_format({
+            "bold": True, "font_size": 22, "font_name": "Segoe UI", "font_color": "white",
+            "bg_color": azul_escuro, "align": "left", "valign": "vcenter"
+        })
+        fmt_sub = wb.add_format({"font_size": 10, "font_color": "#CBD5E1", "bg_color": azul_escuro})
+        fmt_header = wb.add_format({
+            "bold": True, "bg_color": azul, "font_color": "white", "align": "center", "valign": "vcenter", "border": 1
+        })
+        fmt_kpi_label = wb.add_format({"font_size": 9, "font_color": "#64748B"})
+        fmt_kpi_val = wb.add_format({"bold": True, "font_size": 14})
+        fmt_kpi_money = wb.add_format({"bold": True, "font_size": 14, "font_color": verde, "num_format": "R$ #,##0.00"})
+        formatos_coluna = {
+            "texto": wb.add_format({"align": "left", "border": 1}),
+            "moeda": wb.add_format({"num_format": "R$ #,##0.00", "align": "right", "border": 1}),
+            "centro": wb.add_format({"align": "center", "border": 1}),
+        }
+
+        # Larguras e formatos por coluna: as linhas de dados herdam o formato
+        for col, (_, largura, formato) in enumerate(COLUNAS_INVENTARIO):
+            ws.set_column(col, col, largura, formatos_coluna[formato])
+
+        # =========================
+        # HEADER
+        # =========================
+        ws.set_row(0, 35)
+        ws.set_row(1, 10)
+        ws.set_row(2, 18)
+        ws.merge_range("A1:F2", "RELATÓRIO EXECUTIVO DE INVENTÁRIO", fmt_title)
+        ws.merge_range("A3:F3", f"Gerado em {datetime.now().strftime('%d/%m/%Y às %H:%M')}", fmt_sub)
+
+        # =========================
+        # KPIs (vindos do banco)
+        # =========================
+        #ws.write("A5", "PATRIMÔNIO TOTAL", fmt_kpi_label)
+        #ws.write("A6", kpis["patrimonio"], fmt_kpi_money)
+        ws.write("C5", "TOTAL DE ITENS", fmt_kpi_label)
+        ws.write("E5", "SKUs ATIVOS", fmt_kpi_label)
+        ws.write("C6", kpis["total_itens"], fmt_kpi_val)
+        ws.write("E6", kpis["total_skus"], fmt_kpi_val)
+
+        # =========================
+        # TABELA
+        # =========================
+        ws.write_row(LINHA_CABECALHO, 0, [c[0] for c in COLUNAS_INVENTARIO], fmt_header)
+
+        total_linhas = 0
+        for linha in linhas:
+            total_linhas += 1
+            ws.write_row(LINHA_CABECALHO + total_linhas, 0, linha)
+
+        # Total geral
+        total_row = LINHA_CABECALHO + total_linhas + 2
+        ws.write(total_row, 4, "TOTAL GERAL:", fmt_header)
+        ws.write_formula(
+            total_row, 5,
+            f"=SUM(F{LINHA_CABECALHO + 2}:F{LINHA_CABECALHO + 1 + total_linhas})",
+            formatos_coluna["moeda"], kpis["patrimonio"]
+        )
+        wb.close()
+    except Exception:
+        wb.fileclosed = True # Não tenta fechar de novo no __del__
+        os.remove(caminho)
+        raise
+    return caminho
+
+
+def chave_relatorio(origem: str, versao: int, kpis: dict) -> str:
+    """
+    Chave do relatório: banco de origem + versão do catálogo + KPIs. Os KPIs
+    entram como impressão digital do conteúdo, para um banco recriado (versão
+    de volta ao início) não reaproveitar o arquivo de outro catálogo.
+    """
+    assinatura = f"{origem}|{versao}|{kpis['total_skus']}|{kpis['total_itens']}|{round(kpis['patrimonio'], 2)}"
+    return "inventario_" + hashlib.sha1(assinatura.encode()).hexdigest()[:16]
+
+
+class CacheRelatorios:
+    """
+    Relatórios gerados guardados em disco por chave, até `max_arquivos`
+    (sai o usado há mais tempo). Só é gerado de novo quando a chave muda,
+    ou seja, quando o catálogo muda.
+    """
+
+    def __init__(self, pasta: str, max_arquivos: int):
+        self.pasta = pasta
+        self.max_arquivos = max_arquivos
+        self._lock = threading.Lock()
+        self._gerando = {} # chave -> Lock: pedidos simultâneos da mesma chave geram uma vez só
+        self.acertos = 0
+        self.geracoes = 0
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.pasta, f"{chave}.xlsx")
+
+    def obter_ou_gerar(self, chave: str, gerar) -> str:
+        """
+        Caminho do relatório da chave. Na falta, chama gerar(pasta) (que devolve
+        um arquivo temporário dentro de `pasta`) e o publica com os.replace.
+        """
+        os.makedirs(self.pasta, exist_ok=True)
+        with self._lock:
+            trava = self._gerando.setdefault(chave, threading.Lock())
+        with trava:
+            destino = self._caminho(chave)
+            if os.path.exists(destino):
+                os.utime(destino) # Marca como usado agora (ordem de descarte)
+                self.acertos += 1
+                return destino
+            os.replace(gerar(self.pasta), destino)
+            self.geracoes += 1
+        self._descartar_excesso(manter=destino)
+        return destino
+
+    def _descartar_excesso(self, manter: str):
+        arquivos = [
+            os.path.join(self.pasta, nome) for nome in os.listdir(self.pasta) if nome.endswith(".xlsx")
+        ]
+        arquivos.sort(key=lambda caminho: os.path.getmtime(caminho), reverse=True)
+        for caminho in arquivos[self.max_arquivos:]:
+            if caminho == manter:
+                continue
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass # Outro processo já apagou
+            with self._lock:
+                self._gerando.pop(os.path.basename(caminho)[:-5], None)
+
+    def limpar(self):
+        """Apaga todos os relatórios guardados."""
+        if os.path.isdir(self.pasta):
+            for nome in os.listdir(self.pasta):
+                if nome.endswith(".xlsx"):
+                    os.remove(os.path.join(self.pasta, nome))
+
+    def estatisticas(self) -> dict:
+        arquivos = [nome for nome in os.listdir(self.pasta) if nome.endswith(".xlsx")] if os.path.isdir(self.pasta) else []
+        return {
+            "pasta": self.pasta,
+            "max_arquivos": self.max_arquivos,
+            "arquivos": len(arquivos),
+            "acertos": self.acertos,
+            "geracoes": self.geracoes,
+        }
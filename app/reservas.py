@@ -0,0 +1,55 @@
+import uuid
+
+# Ciclo de vida de uma reserva de estoque: nasce "pendente" (estoque já
+# baixado) e termina "confirmada" (venda fechada, o estoque fica baixado) ou
+# "liberada" (pedido desistido, o estoque volta). Só sai de "pendente" uma vez.
+PENDENTE, CONFIRMADA, LIBERADA = "pendente", "confirmada", "liberada"
+
+
+class EstoqueInsuficiente(Exception):
+    """Algum item do pedido não tem estoque (ou não existe): nada foi reservado."""
+
+    def __init__(self, faltas: list):
+        super().__init__("Estoque insuficiente para o pedido; nada foi reservado.")
+        self.faltas = faltas # [{"sku", "pedido", "disponivel"}]; disponivel None = SKU inexistente
+
+
+class ReservaFinalizada(Exception):
+    """Confirmar/liberar uma reserva que já saiu de "pendente"."""
+
+    def __init__(self, status: str):
+        super().__init__(f"Reserva já {status}.")
+        self.status = status
+
+
+def nova_reserva() -> str:
+    return uuid.uuid4().hex
+
+
+def juntar_itens(itens) -> dict:
+    """
+    {sku: quantidade} do pedido, somando SKUs repetidos e em ordem de SKU
+    (quem baixa item a item sempre trava os produtos na mesma ordem).
+    """
+    pedido = {}
+    for item in itens:
+        pedido[item.sku] = pedido.get(item.sku, 0) + item.quantidade
+    return dict(sorted(pedido.items()))
+
+
+def faltas_do_pedido(pedido: dict, disponiveis: dict) -> list:
+    """Itens que não cabem no estoque atual ({sku: estoque} lido no caminho de erro)."""
+    return [
+        {"sku": sku, "pedido": quantidade, "disponivel": disponiveis.get(sku)}
+        for sku, quantidade in pedido.items()
+        if disponiveis.get(sku) is None or disponiveis[sku] < quantidade
+    ]
+
+
+def resposta_reserva(reserva: str, status: str, pedido: dict, estoques: dict = None) -> dict:
+    """Corpo das respostas de reserva; com `estoques`, cada item leva o estoque que ficou depois da escrita."""
+    itens = [{"sku": sku, "quantidade": quantidade} for sku, quantidade in pedido.items()]
+    if estoques is not None:
+        for item in itens:
+            item["estoque"] = estoques.get(item["sku"])
+    return {"reserva": reserva, "status": status, "itens": itens}
@@ -1,76 +1,582 @@
-from fastapi import APIRouter, HTTPException, Query
-from app.models import ProdutoSchema, ProdutoUpdate, ListaProdutosResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, File, Header, HTTPException, Query, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from pymongo.errors import DuplicateKeyError
+from app.exportacao import FORMATOS_EXPORTACAO, transmitir
+from app.importacao import MODOS_IMPORTACAO, RelatorioImportacao, detectar_formato, ler_lotes
+from typing import List, Optional
+from app.kpis import ESTOQUE_BAIXO
+from app.metricas import MEDIA_TYPE_PROMETHEUS, metricas
+from app.eventos import CABECALHOS_SSE, MEDIA_TYPE_SSE, HubEventos, revisao_de_retomada
+from app.etag import cabecalhos_etag, cliente_atualizado, etag_da_versao, etag_do_produto, resposta_304, versao_do_if_match
+from app.models import (
+    ProdutoSchema, ProdutoLido, ProdutoUpdate, ListaProdutosResponse, ProdutoUpdateLote, ResultadoLoteResponse, MAX_ITENS_LOTE,
+    PedidoReserva, QuantidadeReserva
+)
+from app.paginacao import ORDENACOES
+from app.reservas import CONFIRMADA, LIBERADA, EstoqueInsuficiente, ReservaFinalizada, juntar_itens
+from app.relatorios import (
+    MAX_RELATORIOS, MEDIA_TYPE_XLSX, PASTA_CACHE_RELATORIOS, CacheRelatorios, chave_relatorio, gerar_inventario, nome_relatorio
+)
+from app import services_async
+from app.database import DATABASE_NAME, MODO_ASYNC, MONGO_URL, conectar_async, fechar_async
 # Importamos as novas funções do service
 from app.services import (
     criar_produto, 
     listar_produtos_avancado, 
-    buscar_por_sku, 
+    TIPOS_TOTAL, 
+    VersaoDesatualizada,
+    dados_de_atualizacao,
     analise_de_catalogo,
+    receita_por_produto,
+    kpis_do_catalogo,
+    reconstruir_resumo,
+    verificar_resumo,
     atualizar_produto_logica,
-    deletar_produto_logica
+    atualizar_em_lote,
+    deletar_produto_logica,
+    finalizar_reserva,
+    obter_reserva,
+    reservar_estoque,
+    exportar_produtos,
+    buscar_texto,
+    importar_lote,
+    kpis_inventario,
+    linhas_inventario,
+    listar_mudancas,
+    preparar_colecao,
+    revisao_catalogo,
+    vigiar_mudancas,
+    produto_e_versao,
+    versao_catalogo,
+    cache_sku
 )
 
-router = APIRouter()
+# Na subida da API: índices e campos normalizados prontos antes da 1ª requisição
+@asynccontextmanager
+async def lifespan(app):
+    faltando = preparar_colecao()
+    if faltando:
+        raise RuntimeError(f"Índices ausentes na coleção produtos: {faltando}")
+    if MODO_ASYNC:
+        await conectar_async()
+    await hub_eventos.iniciar()
+    yield
+    await hub_eventos.parar()
+    if MODO_ASYNC:
+        await fechar_async()
+
+router = APIRouter(lifespan=lifespan)
+
+# As rotas do dia a dia têm duas versões: "def" (NEXUS_MODO=sync) e
+# "async def" sobre app.services_async (NEXUS_MODO=async). Só uma é registrada.
+# Importação, exportação e lotes continuam "def": são longas e rodam no threadpool.
 
 # --- POST: Criar ---
-@router.post("/produtos/", response_model=ProdutoSchema, status_code=201)
 def adicionar_produto(produto: ProdutoSchema):
-    # Verifica se SKU já existe para evitar duplicidade
-    if buscar_por_sku(produto.sku):
+    # Duplicidade: quem recusa é o índice único do SKU, sem consulta antes
+    try:
+        return criar_produto(produto)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="SKU já cadastrado.")
-    return criar_produto(produto)
+
+async def adicionar_produto_async(produto: ProdutoSchema):
+    try:
+        return await services_async.criar_produto(produto)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="SKU já cadastrado.")
+
+router.post("/produtos/", response_model=ProdutoLido, status_code=201)(
+    adicionar_produto_async if MODO_ASYNC else adicionar_produto
+)
+
+# --- POST: Importação em massa ---
+@router.post("/produtos/bulk-import")
+def importar_produtos(
+    arquivo: UploadFile = File(..., description="Arquivo .csv ou .jsonl com um produto por linha"),
+    formato: str = Query(None, description="csv ou jsonl (padrão: pela extensão do arquivo)"),
+    modo: str = Query("inserir", description="inserir (SKU existente vira erro) ou upsert"),
+    tamanho_lote: int = Query(10000, ge=1, le=50000, description="Linhas por ida ao banco")
+):
+    """
+    Importa um catálogo inteiro: lê o arquivo em lotes, valida com ProdutoSchema
+    e grava cada lote com uma única operação em massa (sem buscar SKU por SKU).
+    """
+    if modo not in MODOS_IMPORTACAO:
+        raise HTTPException(status_code=400, detail="Modo inválido")
+    try:
+        formato = detectar_formato(arquivo.filename, formato)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+
+    relatorio = RelatorioImportacao()
+    for validos, erros in ler_lotes(arquivo.file, formato, ProdutoSchema, tamanho_lote):
+        relatorio.processados += len(validos) + len(erros)
+        inseridos, atualizados, falhas = importar_lote([p for _, p in validos], modo)
+        relatorio.inseridos += inseridos
+        relatorio.atualizados += atualizados
+        for posicao, mensagem in falhas:
+            linha, produto = validos[posicao]
+            erros.append({"linha": linha, "sku": produto.sku, "erro": mensagem})
+        relatorio.registrar_erros(sorted(erros, key=lambda e: e["linha"]))
+    return relatorio.como_dict()
 
 # --- GET: Listar com Filtros ---
-@router.get("/produtos/", response_model=ListaProdutosResponse)
+def validar_listagem(ordenar: str, total: str):
+    if ordenar not in ORDENACOES:
+        raise HTTPException(status_code=400, detail="Ordenação inválida")
+    if total and total not in TIPOS_TOTAL:
+        raise HTTPException(status_code=400, detail="Tipo de total inválido")
+
 def get_produtos(
+    response: Response,
     # Query(...) define parâmetros opcionais na URL
     categoria: str = Query(None, description="Filtrar por nome da categoria"),
     min_preco: float = Query(None, description="Preço mínimo"),
     max_preco: float = Query(None, description="Preço máximo"),
     pagina: int = Query(1, ge=1, description="Número da página"),
-    limite: int = Query(10, le=100, description="Itens por página (Max 100)")
+    limite: int = Query(10, le=100, description="Itens por página (Max 100)"),
+    ordenar: str = Query("recentes", description=f"Uma de: {', '.join(ORDENACOES)}"),
+    cursor: str = Query(None, description="Token 'proximo_cursor' da página anterior (ignora 'pagina')"),
+    total: str = Query(None, description=f"Incluir total de itens: {', '.join(TIPOS_TOTAL)}"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Retorna lista de produtos com paginação e filtros.
+    Exemplo: /produtos/?categoria=Gamer&min_preco=2000&max_preco=5000
+    Para páginas profundas prefira o cursor: /produtos/?cursor=<proximo_cursor>
+    Com If-None-Match igual ao ETag atual responde 304 sem consultar os produtos.
+    """
+    validar_listagem(ordenar, total)
+    # Versão lida antes dos dados: na dúvida o ETag fica velho, nunca adiantado
+    etag = etag_da_versao(versao_catalogo())
+    if cliente_atualizado(if_none_match, etag):
+        return resposta_304(etag)
+    try:
+        resultado = listar_produtos_avancado(categoria, min_preco, max_preco, pagina, limite, ordenar, cursor, total)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+    response.headers.update(cabecalhos_etag(etag))
+    return resultado
+
+async def get_produtos_async(
+    response: Response,
+    categoria: str = Query(None, description="Filtrar por nome da categoria"),
+    min_preco: float = Query(None, description="Preço mínimo"),
+    max_preco: float = Query(None, description="Preço máximo"),
+    pagina: int = Query(1, ge=1, description="Número da página"),
+    limite: int = Query(10, le=100, description="Itens por página (Max 100)"),
+    ordenar: str = Query("recentes", description=f"Uma de: {', '.join(ORDENACOES)}"),
+    cursor: str = Query(None, description="Token 'proximo_cursor' da página anterior (ignora 'pagina')"),
+    total: str = Query(None, description=f"Incluir total de itens: {', '.join(TIPOS_TOTAL)}"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Retorna lista de produtos com paginação e filtros.
     Exemplo: /produtos/?categoria=Gamer&min_preco=2000&max_preco=5000
+    Para páginas profundas prefira o cursor: /produtos/?cursor=<proximo_cursor>
+    Com If-None-Match igual ao ETag atual responde 304 sem consultar os produtos.
+    """
+    validar_listagem(ordenar, total)
+    etag = etag_da_versao(await services_async.versao_catalogo())
+    if cliente_atualizado(if_none_match, etag):
+        return resposta_304(etag)
+    try:
+        resultado = await services_async.listar_produtos_avancado(
+            categoria, min_preco, max_preco, pagina, limite, ordenar, cursor, total
+        )
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+    response.headers.update(cabecalhos_etag(etag))
+    return resultado
+
+router.get("/produtos/", response_model=ListaProdutosResponse)(get_produtos_async if MODO_ASYNC else get_produtos)
+
+# --- GET: Exportar catálogo (streaming) ---
+@router.get("/produtos/export")
+def exportar_catalogo(
+    formato: str = Query("ndjson", description="ndjson ou csv"),
+    categoria: str = Query(None, description="Filtrar por nome da categoria"),
+    min_preco: float = Query(None, description="Preço mínimo"),
+    max_preco: float = Query(None, description="Preço máximo"),
+    ordenar: str = Query("recentes", description=f"Uma de: {', '.join(ORDENACOES)}"),
+    tamanho_lote: int = Query(1000, ge=1, le=10000, description="Documentos por lote")
+):
+    """Exporta o catálogo filtrado em NDJSON ou CSV, em streaming a partir do cursor."""
+    if formato not in FORMATOS_EXPORTACAO:
+        raise HTTPException(status_code=400, detail="Formato inválido")
+    if ordenar not in ORDENACOES:
+        raise HTTPException(status_code=400, detail="Ordenação inválida")
+
+    lotes = exportar_produtos(categoria, min_preco, max_preco, ordenar, tamanho_lote)
+    return StreamingResponse(
+        transmitir(lotes, formato),
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers={"Content-Disposition": f'attachment; filename="produtos.{formato}"'}
+    )
+
+# --- GET: Relatório Excel ---
+cache_relatorios = CacheRelatorios(PASTA_CACHE_RELATORIOS, MAX_RELATORIOS)
+
+@router.get("/relatorios/inventario.xlsx")
+def relatorio_inventario(if_none_match: Optional[str] = Header(None)):
+    """
+    Relatório Executivo de Inventário em Excel, gerado a partir do cursor do
+    Mongo em modo constant_memory (memória constante, qualquer tamanho de catálogo).
+    Só é gerado quando o catálogo muda; senão sai do cache em disco.
+    Com If-None-Match igual ao ETag atual responde 304.
+    """
+    versao = versao_catalogo()
+    etag = etag_da_versao(versao)
+    if cliente_atualizado(if_none_match, etag):
+        return resposta_304(etag)
+    kpis = kpis_inventario()
+    caminho = cache_relatorios.obter_ou_gerar(
+        chave_relatorio(f"{MONGO_URL}/{DATABASE_NAME}", versao, kpis),
+        lambda pasta: gerar_inventario(linhas_inventario(), kpis, pasta)
+    )
+    return FileResponse(caminho, media_type=MEDIA_TYPE_XLSX, filename=nome_relatorio(), headers=cabecalhos_etag(etag))
+
+@router.get("/relatorios/cache")
+def estatisticas_cache_relatorios():
+    """Relatórios guardados em disco, acertos e gerações (deste processo)."""
+    return cache_relatorios.estatisticas()
+
+# --- GET: Busca textual ---
+def busca_produtos(
+    q: str = Query(..., min_length=1, description="Termos de busca"),
+    categoria: str = Query(None, description="Filtrar por nome da categoria"),
+    limite: int = Query(20, ge=1, le=100, description="Máximo de resultados")
+):
+    """Busca por nome, SKU ou categoria, ordenada por relevância."""
+    return {"produtos": buscar_texto(q, categoria, limite)}
+
+async def busca_produtos_async(
+    q: str = Query(..., min_length=1, description="Termos de busca"),
+    categoria: str = Query(None, description="Filtrar por nome da categoria"),
+    limite: int = Query(20, ge=1, le=100, description="Máximo de resultados")
+):
+    """Busca por nome, SKU ou categoria, ordenada por relevância."""
+    return {"produtos": await services_async.buscar_texto(q, categoria, limite)}
+
+router.get("/produtos/busca")(busca_produtos_async if MODO_ASYNC else busca_produtos)
+
+# --- GET: Feed de mudanças ---
+def get_mudancas(
+    since: int = Query(0, ge=0, description="Última revisão que o cliente já tem (0 = catálogo inteiro)"),
+    limite: int = Query(1000, ge=1, le=10000, description="Máximo de mudanças por página")
+):
     """
-    return listar_produtos_avancado(categoria, min_preco, max_preco, pagina, limite)
+    Produtos criados/alterados e removidos depois da revisão `since`.
+    O cliente aplica as remoções, depois os alterados, e guarda `revisao` para
+    a próxima chamada. Com tem_mais=true, chame de novo com since=revisao.
+    """
+    try:
+        return listar_mudancas(since, limite)
+    except ValueError as erro:
+        raise HTTPException(status_code=410, detail=str(erro))
+
+async def get_mudancas_async(
+    since: int = Query(0, ge=0, description="Última revisão que o cliente já tem (0 = catálogo inteiro)"),
+    limite: int = Query(1000, ge=1, le=10000, description="Máximo de mudanças por página")
+):
+    """
+    Produtos criados/alterados e removidos depois da revisão `since`.
+    O cliente aplica as remoções, depois os alterados, e guarda `revisao` para
+    a próxima chamada. Com tem_mais=true, chame de novo com since=revisao.
+    """
+    try:
+        return await services_async.listar_mudancas(since, limite)
+    except ValueError as erro:
+        raise HTTPException(status_code=410, detail=str(erro))
+
+router.get("/produtos/changes", response_model=dict)(get_mudancas_async if MODO_ASYNC else get_mudancas)
+
+# --- GET: Eventos (SSE) ---
+# O hub lê o mesmo feed do /produtos/changes, uma vez por mudança para todas
+# as conexões. Acorda com as escritas deste processo (incrementar_versao), com
+# o change stream quando o Mongo tem (replica set) e, senão, no intervalo.
+async def ler_mudancas_eventos(desde: int, limite: int):
+    if MODO_ASYNC:
+        return await services_async.listar_mudancas(desde, limite)
+    return await asyncio.to_thread(listar_mudancas, desde, limite)
+
+async def ler_revisao_eventos():
+    if MODO_ASYNC:
+        return await services_async.revisao_catalogo()
+    return await asyncio.to_thread(revisao_catalogo)
+
+hub_eventos = HubEventos(ler_mudancas_eventos, ler_revisao_eventos, vigiar=vigiar_mudancas)
+
+@router.get("/eventos")
+async def transmitir_eventos(
+    since: Optional[int] = Query(None, ge=0, description="Revisão da qual retomar (padrão: só o que vier depois de conectar)"),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Mudanças do catálogo em tempo real (Server-Sent Events): "produto" a cada
+    criação/alteração e "removido" a cada remoção, com id = revisão do feed.
+    Ao reconectar, o EventSource manda o Last-Event-ID e recebe o que perdeu.
+    """
+    try:
+        desde = revisao_de_retomada(last_event_id, since)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+    return StreamingResponse(hub_eventos.assinar(desde), media_type=MEDIA_TYPE_SSE, headers=CABECALHOS_SSE)
+
+@router.get("/eventos/estatisticas")
+def estatisticas_eventos():
+    return hub_eventos.estatisticas()
 
 # --- GET: Buscar UM produto ---
-@router.get("/produtos/{sku}", response_model=ProdutoSchema)
-def get_produto_unico(sku: str):
-    produto = buscar_por_sku(sku)
-    if not produto:
+def resposta_produto(guardado, response: Response, if_none_match: Optional[str]):
+    if not guardado:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
+    produto, versao = guardado
+    etag = etag_do_produto(versao)
+    if cliente_atualizado(if_none_match, etag):
+        return resposta_304(etag)
+    response.headers.update(cabecalhos_etag(etag))
     return produto
 
+def get_produto_unico(sku: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    # Produtos quentes saem do cache em memória, sem ida ao banco
+    return resposta_produto(produto_e_versao(sku), response, if_none_match)
+
+async def get_produto_unico_async(sku: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    return resposta_produto(await services_async.produto_e_versao(sku), response, if_none_match)
+
+router.get("/produtos/{sku}", response_model=ProdutoLido)(get_produto_unico_async if MODO_ASYNC else get_produto_unico)
+
 # --- PUT: Atualizar ---
-@router.put("/produtos/{sku}", response_model=ProdutoSchema)
-def update_produto(sku: str, dados: ProdutoUpdate):
+# Escritas condicionais: If-Match com a `versao` lida do produto. A checagem
+# vai no filtro da própria escrita (uma ida ao banco); versão velha -> 412.
+def versao_esperada(if_match: Optional[str], dados: ProdutoUpdate = None):
+    if dados is not None and not dados_de_atualizacao(dados):
+        raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
+    try:
+        return versao_do_if_match(if_match)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+
+def resultado_da_escrita(resultado):
+    if not resultado:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+    return resultado
+
+def update_produto(sku: str, dados: ProdutoUpdate, if_match: Optional[str] = Header(None)):
     """
     Atualiza dados de um produto existente.
     Envie apenas os campos que deseja alterar.
     """
-    # Primeiro verifica se existe
-    if not buscar_por_sku(sku):
-        raise HTTPException(status_code=404, detail="Produto não encontrado")
-        
-    resultado = atualizar_produto_logica(sku, dados)
-    return resultado
+    versao = versao_esperada(if_match, dados)
+    try:
+        return resultado_da_escrita(atualizar_produto_logica(sku, dados, versao))
+    except VersaoDesatualizada as erro:
+        raise HTTPException(status_code=412, detail=str(erro))
+
+async def update_produto_async(sku: str, dados: ProdutoUpdate, if_match: Optional[str] = Header(None)):
+    """
+    Atualiza dados de um produto existente.
+    Envie apenas os campos que deseja alterar.
+    """
+    versao = versao_esperada(if_match, dados)
+    try:
+        return resultado_da_escrita(await services_async.atualizar_produto_logica(sku, dados, versao))
+    except VersaoDesatualizada as erro:
+        raise HTTPException(status_code=412, detail=str(erro))
+
+router.put("/produtos/{sku}", response_model=ProdutoLido)(update_produto_async if MODO_ASYNC else update_produto)
+
+# --- PATCH: Atualização em massa ---
+@router.patch("/produtos/bulk", response_model=ResultadoLoteResponse)
+def update_produtos_em_lote(atualizacoes: List[ProdutoUpdateLote]):
+    """
+    Atualiza vários produtos (ex: repreço ou sincronização de estoque) com
+    um único bulk_write. Cada item traz o SKU e apenas os campos a alterar.
+    """
+    if len(atualizacoes) > MAX_ITENS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_ITENS_LOTE} itens por lote")
+    encontrados, modificados, nao_encontrados = atualizar_em_lote(atualizacoes)
+    return {"encontrados": encontrados, "modificados": modificados, "nao_encontrados": nao_encontrados}
 
 # --- DELETE: Remover ---
-@router.delete("/produtos/{sku}", status_code=204)
-def delete_produto(sku: str):
+def delete_produto(sku: str, if_match: Optional[str] = Header(None)):
     """
     Remove um produto. Status 204 significa 'No Content' (sucesso sem corpo de resposta).
     """
-    sucesso = deletar_produto_logica(sku)
-    if not sucesso:
-        raise HTTPException(status_code=404, detail="Produto não encontrado")
+    versao = versao_esperada(if_match)
+    try:
+        resultado_da_escrita(deletar_produto_logica(sku, versao))
+    except VersaoDesatualizada as erro:
+        raise HTTPException(status_code=412, detail=str(erro))
     return # Retorna vazio (204)
 
+async def delete_produto_async(sku: str, if_match: Optional[str] = Header(None)):
+    """
+    Remove um produto. Status 204 significa 'No Content' (sucesso sem corpo de resposta).
+    """
+    versao = versao_esperada(if_match)
+    try:
+        resultado_da_escrita(await services_async.deletar_produto_logica(sku, versao))
+    except VersaoDesatualizada as erro:
+        raise HTTPException(status_code=412, detail=str(erro))
+
+router.delete("/produtos/{sku}", status_code=204)(delete_produto_async if MODO_ASYNC else delete_produto)
+
+# --- POST: Reserva de estoque ---
+# Baixa atômica ($inc condicionado a estoque >= quantidade), tudo ou nada por
+# pedido. Sem estoque: 409 com o que faltou; SKU inexistente: 404.
+def estoque_recusado(erro: EstoqueInsuficiente):
+    inexistentes = [f["sku"] for f in erro.faltas if f["disponivel"] is None]
+    if inexistentes:
+        raise HTTPException(status_code=404, detail=f"Produto não encontrado: {', '.join(inexistentes)}")
+    raise HTTPException(status_code=409, detail={"mensagem": str(erro), "faltas": erro.faltas})
+
+def pedido_da_requisicao(pedido: PedidoReserva) -> dict:
+    if len(pedido.itens) > MAX_ITENS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_ITENS_LOTE} itens por pedido")
+    return juntar_itens(pedido.itens)
+
+def reserva_encontrada(resultado):
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Reserva não encontrada")
+    return resultado
+
+def reservar_pedido(pedido: dict):
+    try:
+        return reservar_estoque(pedido)
+    except EstoqueInsuficiente as erro:
+        estoque_recusado(erro)
+
+async def reservar_pedido_async(pedido: dict):
+    try:
+        return await services_async.reservar_estoque(pedido)
+    except EstoqueInsuficiente as erro:
+        estoque_recusado(erro)
+
+def finalizar(reserva: str, status: str):
+    try:
+        return reserva_encontrada(finalizar_reserva(reserva, status))
+    except ReservaFinalizada as erro:
+        raise HTTPException(status_code=409, detail=str(erro))
+
+async def finalizar_async(reserva: str, status: str):
+    try:
+        return reserva_encontrada(await services_async.finalizar_reserva(reserva, status))
+    except ReservaFinalizada as erro:
+        raise HTTPException(status_code=409, detail=str(erro))
+
+def reservar_estoque_produto(sku: str, quantidade: QuantidadeReserva):
+    """Reserva (baixa) estoque de um produto. Sem estoque suficiente: 409 e nada muda."""
+    return reservar_pedido({sku: quantidade.quantidade})
+
+async def reservar_estoque_produto_async(sku: str, quantidade: QuantidadeReserva):
+    """Reserva (baixa) estoque de um produto. Sem estoque suficiente: 409 e nada muda."""
+    return await reservar_pedido_async({sku: quantidade.quantidade})
+
+router.post("/produtos/{sku}/estoque/reservar", status_code=201)(
+    reservar_estoque_produto_async if MODO_ASYNC else reservar_estoque_produto
+)
+
+def reservar_varios(pedido: PedidoReserva):
+    """Reserva os itens de um pedido de uma vez: ou todos têm estoque e são baixados, ou nenhum é."""
+    return reservar_pedido(pedido_da_requisicao(pedido))
+
+async def reservar_varios_async(pedido: PedidoReserva):
+    """Reserva os itens de um pedido de uma vez: ou todos têm estoque e são baixados, ou nenhum é."""
+    return await reservar_pedido_async(pedido_da_requisicao(pedido))
+
+router.post("/estoque/reservas", status_code=201)(reservar_varios_async if MODO_ASYNC else reservar_varios)
+
+def get_reserva(reserva: str):
+    return reserva_encontrada(obter_reserva(reserva))
+
+async def get_reserva_async(reserva: str):
+    return reserva_encontrada(await services_async.obter_reserva(reserva))
+
+router.get("/estoque/reservas/{reserva}")(get_reserva_async if MODO_ASYNC else get_reserva)
+
+def confirmar_reserva(reserva: str):
+    return finalizar(reserva, CONFIRMADA)
+
+async def confirmar_reserva_async(reserva: str):
+    return await finalizar_async(reserva, CONFIRMADA)
+
+router.post("/estoque/reservas/{reserva}/confirmar")(confirmar_reserva_async if MODO_ASYNC else confirmar_reserva)
+
+def liberar_reserva(reserva: str):
+    return finalizar(reserva, LIBERADA)
+
+async def liberar_reserva_async(reserva: str):
+    return await finalizar_async(reserva, LIBERADA)
+
+router.post("/estoque/reservas/{reserva}/liberar")(liberar_reserva_async if MODO_ASYNC else liberar_reserva)
+
 # --- GET: Analytics ---
-@router.get("/analytics/geral")
 def get_analise():
     """Retorna estatísticas de estoque e preços por categoria."""
-    return analise_de_catalogo()
\ No newline at end of file
+    return analise_de_catalogo()
+
+async def get_analise_async():
+    """Retorna estatísticas de estoque e preços por categoria."""
+    return await services_async.analise_de_catalogo()
+
+router.get("/analytics/geral")(get_analise_async if MODO_ASYNC else get_analise)
+
+def get_receita(
+    top: int = Query(10, ge=1, le=100, description="Quantos produtos mostrar; o resto vira 'Outros'"),
+    categoria: str = Query(None, description="Detalhar uma categoria")
+):
+    """Maiores produtos por valor em estoque (preço x estoque) e o agregado do restante."""
+    return receita_por_produto(top, categoria)
+
+async def get_receita_async(
+    top: int = Query(10, ge=1, le=100, description="Quantos produtos mostrar; o resto vira 'Outros'"),
+    categoria: str = Query(None, description="Detalhar uma categoria")
+):
+    """Maiores produtos por valor em estoque (preço x estoque) e o agregado do restante."""
+    return await services_async.receita_por_produto(top, categoria)
+
+router.get("/analytics/receita")(get_receita_async if MODO_ASYNC else get_receita)
+
+def get_kpis(
+    estoque_baixo: int = Query(ESTOQUE_BAIXO, ge=0, description="Estoque até este valor conta como baixo")
+):
+    """Totais do catálogo (produtos, valor em estoque, ticket médio, categorias), por categoria e estoque baixo."""
+    return kpis_do_catalogo(estoque_baixo)
+
+async def get_kpis_async(
+    estoque_baixo: int = Query(ESTOQUE_BAIXO, ge=0, description="Estoque até este valor conta como baixo")
+):
+    """Totais do catálogo (produtos, valor em estoque, ticket médio, categorias), por categoria e estoque baixo."""
+    return await services_async.kpis_do_catalogo(estoque_baixo)
+
+router.get("/analytics/kpis", response_model=dict)(get_kpis_async if MODO_ASYNC else get_kpis)
+
+@router.post("/analytics/resumo/reconstruir")
+def reconstruir_resumo_categorias():
+    """Recalcula o resumo por categoria do zero (ex: após carga direta no banco)."""
+    return {"categorias": reconstruir_resumo()}
+
+@router.get("/analytics/resumo/verificar")
+def verificar_resumo_categorias():
+    """Confere o resumo materializado contra a agregação completa do catálogo."""
+    divergencias = verificar_resumo()
+    return {"consistente": not divergencias, "divergencias": divergencias}
+
+# --- GET: Métricas ---
+# O tempo no banco vem do listener de comandos do driver (app/database.py).
+# Contagem e latência por rota dependem do middleware no app que inclui este
+# router: app.add_middleware(MiddlewareMetricas) (app/metricas.py).
+@router.get("/metrics")
+def exportar_metricas():
+    """Requisições, erros e latência por rota e tempo no banco, no formato do Prometheus."""
+    return Response(metricas.texto(), media_type=MEDIA_TYPE_PROMETHEUS)
+
+# --- GET: Cache ---
+@router.get("/cache/sku")
+def estatisticas_cache_sku():
+    """Acertos, faltas e despejos do cache de produtos por SKU (deste processo)."""
+    return cache_sku.estatisticas()
@@ -1,42 +1,314 @@
+import time
+from datetime import datetime, timezone
+from app.cache import TAMANHO_CACHE_SKU, TTL_CACHE_SKU, CacheLRU
+from app.categorias import normalizar_categoria
 from app.database import db
-from app.models import ProdutoSchema, ProdutoUpdate
+from app.eventos import avisar_escrita
+from app.importacao import ERRO_SKU_EXISTENTE, ERRO_SKU_REPETIDO
+from app.indices import garantir_indices, verificar_indices
+from app.kpis import ESTOQUE_BAIXO, montar_kpis
+from app.models import ProdutoSchema, ProdutoUpdate, juntar_por_sku
+from app.paginacao import codificar_cursor, decodificar_cursor
+from app.reservas import (
+    CONFIRMADA, PENDENTE, EstoqueInsuficiente, ReservaFinalizada, faltas_do_pedido, nova_reserva, resposta_reserva
+)
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from pymongo import ReturnDocument # Usado para retornar o objeto já atualizado
 
 # Referência à coleção 'produtos' dentro do banco
 collection = db.produtos
 
+# Campos internos que não saem na API
+PROJECAO_PUBLICA = {"_id": 0, "categoria_busca": 0}
+
+# Resumo materializado por categoria: um documento por categoria (_id = nome),
+# atualizado com $inc a cada escrita em produtos
+resumo = db.resumo_categorias
+CAMPOS_RESUMO = ("qtd_produtos", "soma_preco", "total_estoque", "valor_estoque")
+# Só o que o resumo precisa saber de um produto
+PROJECAO_RESUMO = {"_id": 0, "sku": 1, "categoria": 1, "preco": 1, "estoque": 1}
+
+# Contadores do catálogo em {_id: "catalogo", versao: n, revisao: m}:
+# - versao: ETag das leituras, +1 depois de cada escrita
+# - revisao: reservada antes de gravar e carimbada no produto (feed de mudanças)
+contadores = db.contadores
+FILTRO_VERSAO = {"_id": "catalogo"}
+
+# Lápides dos produtos removidos ({_id: sku, revisao, removido_em}) para o feed
+removidos = db.produtos_removidos
+
+# Reservas de estoque ({_id, itens: [{sku, quantidade}], status, criada_em, finalizada_em}).
+# O estoque é baixado na reserva; ver app/reservas.py para o ciclo de vida.
+reservas = db.reservas
+
+# Escritas concorrentes não gravam na ordem das revisões: uma revisão menor
+# pode ficar visível depois de uma maior. O feed só avança o cursor do
+# cliente até antes dos itens gravados nos últimos JANELA_ESTAVEL segundos.
+JANELA_ESTAVEL = 2.0
+
+# Cache de leitura por SKU: sku -> (produto, versao). As escritas deste
+# processo removem a entrada logo depois de gravar.
+cache_sku = CacheLRU(TAMANHO_CACHE_SKU, TTL_CACHE_SKU)
+
+
+class VersaoDesatualizada(Exception):
+    """Escrita condicional (If-Match) num produto que já está em outra versão."""
+
+    def __init__(self, atual: int):
+        super().__init__(f"O produto mudou desde a leitura (versão atual: {atual}). Leia de novo e reaplique.")
+        self.atual = atual
+
+
+def preparar_colecao():
+    """
+    Roda na subida da API: preenche 'categoria_busca' em documentos antigos
+    e garante os índices. Retorna os índices que ainda estiverem faltando.
+    """
+    pendentes = collection.find({"categoria_busca": {"$exists": False}}, {"_id": 1, "categoria": 1})
+    lote = []
+    for doc in pendentes:
+        lote.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"categoria_busca": normalizar_categoria(doc.get("categoria"))}}))
+        if len(lote) == 1000:
+            collection.bulk_write(lote, ordered=False)
+            lote = []
+    if lote:
+        collection.bulk_write(lote, ordered=False)
+
+    # Produtos de antes do feed de mudanças ganham uma revisão cada
+    sem_revisao = [doc["_id"] for doc in collection.find({"revisao": {"$exists": False}}, {"_id": 1})]
+    if sem_revisao:
+        primeira = reservar_revisoes(len(sem_revisao))
+        agora = agora_iso()
+        for inicio in range(0, len(sem_revisao), 1000):
+            collection.bulk_write([
+                UpdateOne({"_id": _id}, {"$set": {"revisao": primeira + inicio + i, "atualizado_em": agora}})
+                for i, _id in enumerate(sem_revisao[inicio:inicio + 1000])
+            ], ordered=False)
+    removidos.create_index("revisao", name="revisao")
+    # Versão de cada produto para as escritas condicionais (If-Match)
+    collection.update_many({"versao": {"$exists": False}}, {"$set": {"versao": 1}})
+
+    # Primeira subida com catálogo já populado: monta o resumo do zero
+    if resumo.estimated_document_count() == 0 and collection.estimated_document_count() > 0:
+        reconstruir_resumo()
+
+    garantir_indices(collection)
+    return verificar_indices(collection)
+
+def operacoes_resumo(entradas=(), saidas=()):
+    """
+    Operações $inc do resumo para os produtos que entraram (entradas) e
+    saíram (saidas) de cada categoria, agrupadas por categoria.
+    Uma atualização é a saída da versão antiga + a entrada da nova.
+    """
+    deltas = {}
+    for documentos, sinal in ((entradas, 1), (saidas, -1)):
+        for doc in documentos:
+            preco, estoque = doc.get("preco") or 0, doc.get("estoque") or 0
+            delta = deltas.setdefault(doc.get("categoria"), dict.fromkeys(CAMPOS_RESUMO, 0))
+            delta["qtd_produtos"] += sinal
+            delta["soma_preco"] += sinal * preco
+            delta["total_estoque"] += sinal * estoque
+            delta["valor_estoque"] += sinal * preco * estoque
+
+    return [
+        UpdateOne({"_id": categoria}, {"$inc": delta}, upsert=True)
+        for categoria, delta in deltas.items() if any(delta.values())
+    ]
+
+def atualizar_resumo(entradas=(), saidas=()):
+    """Aplica as operações de operacoes_resumo com um único bulk_write."""
+    operacoes = operacoes_resumo(entradas, saidas)
+    if operacoes:
+        resumo.bulk_write(operacoes, ordered=False)
+
+def mudou_para_resumo(antes: dict, depois: dict) -> bool:
+    return any(antes.get(c) != depois.get(c) for c in ("categoria", "preco", "estoque"))
+
+def versao_catalogo() -> int:
+    doc = contadores.find_one(FILTRO_VERSAO)
+    return doc.get("versao", 0) if doc else 0
+
+def incrementar_versao():
+    """Chamada depois de toda escrita em produtos: invalida os ETags já entregues e avisa o /eventos."""
+    contadores.update_one(FILTRO_VERSAO, {"$inc": {"versao": 1}}, upsert=True)
+    avisar_escrita()
+
+def revisao_catalogo() -> int:
+    """Última revisão reservada: ponto de partida do hub do /eventos."""
+    doc = contadores.find_one(FILTRO_VERSAO)
+    return doc.get("revisao", 0) if doc else 0
+
+def vigiar_mudancas(avisar, parar):
+    """
+    Change stream da coleção produtos (roda numa thread do hub do /eventos):
+    chama avisar() a cada escrita, inclusive de outros processos, sem esperar
+    o intervalo. Só existe em replica set ou cluster; num mongod standalone o
+    watch falha e o hub fica só com o intervalo.
+    """
+    try:
+        # Só o aviso interessa: o conteúdo vem do feed de mudanças
+        with collection.watch([{"$project": {"_id": 1}}], max_await_time_ms=1000) as stream:
+            while not parar.is_set() and stream.alive:
+                if stream.try_next() is not None:
+                    avisar()
+    except PyMongoError:
+        pass
+
+def agora_iso() -> str:
+    # Mesmo formato do backend SQLite (ISO 8601 em UTC, com milissegundos)
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+def reservar_revisoes(quantidade: int = 1) -> int:
+    """Reserva `quantidade` revisões seguidas com um $inc e devolve a primeira."""
+    contador = contadores.find_one_and_update(
+        FILTRO_VERSAO, {"$inc": {"revisao": quantidade}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return contador["revisao"] - quantidade + 1
+
+def lapide(sku: str, revisao: int):
+    return UpdateOne({"_id": sku}, {"$set": {"revisao": revisao, "removido_em": agora_iso()}}, upsert=True)
+
 
 def criar_produto(produto: ProdutoSchema):
-    """Insere um novo produto no banco."""
+    """
+    Insere um novo produto no banco. SKU repetido: o índice único recusa e
+    sobe DuplicateKeyError (sem consultar antes se o SKU existe).
+    """
     # Transforma o objeto Pydantic em um dicionário Python padrão
     produto_dict = produto.dict()
+    # Campo normalizado para o filtro de categoria usar índice
+    produto_dict["categoria_busca"] = normalizar_categoria(produto.categoria)
+    produto_dict.update(revisao=reservar_revisoes(), atualizado_em=agora_iso(), versao=1)
     
     # Insere no MongoDB
     collection.insert_one(produto_dict)
+    atualizar_resumo(entradas=[produto_dict])
+    incrementar_versao()
     
     # Retorna o dicionário para confirmar a criação na API
     return produto_dict
 
-def listar_produtos_avancado(
-    categoria: str = None, 
-    min_preco: float = None, 
-    max_preco: float = None, 
-    pagina: int = 1, 
-    limite: int = 10
-):
+def importar_lote(produtos: list, modo: str = "inserir"):
     """
-    Lista produtos com filtros dinâmicos e paginação.
-    Isso é essencial para performance em e-commerces reais.
+    Grava um lote de ProdutoSchema em uma única ida ao banco.
+    - inserir: insert_many(ordered=False); SKUs já cadastrados viram erro e o resto entra
+    - upsert: bulk_write de ReplaceOne(upsert=True) por SKU
+    Como no SQLite, vale a primeira linha de cada SKU do lote; as outras são
+    recusadas (ERRO_SKU_REPETIDO) sem ir ao banco.
+    Retorna (inseridos, atualizados, erros), com erros = [(posicao_no_lote, mensagem)].
     """
-    
-    # 1. Construção da Query (Filtro)
+    documentos, posicoes, repetidos, vistos = [], [], [], set()
+    for posicao, produto in enumerate(produtos):
+        if produto.sku in vistos:
+            repetidos.append((posicao, ERRO_SKU_REPETIDO))
+            continue
+        vistos.add(produto.sku)
+        doc = produto.dict()
+        doc["categoria_busca"] = normalizar_categoria(produto.categoria)
+        documentos.append(doc)
+        posicoes.append(posicao)
+    if not documentos:
+        return 0, 0, repetidos
+    # Uma reserva para o lote inteiro; cada documento leva a sua revisão
+    primeira, agora = reservar_revisoes(len(documentos)), agora_iso()
+    for i, doc in enumerate(documentos):
+        doc.update(revisao=primeira + i, atualizado_em=agora, versao=1)
+
+    if modo == "upsert":
+        # Versões atuais dos SKUs do lote, para tirar do resumo o que será substituído
+        antes = {
+            doc["sku"]: doc
+            for doc in collection.find({"sku": {"$in": [d["sku"] for d in documentos]}}, {**PROJECAO_RESUMO, "versao": 1})
+        }
+        for doc in documentos:
+            if doc["sku"] in antes: # O ReplaceOne troca o documento inteiro: a versão segue a anterior
+                doc["versao"] = antes[doc["sku"]].get("versao", 0) + 1
+        resultado = collection.bulk_write(
+            [ReplaceOne({"sku": doc["sku"]}, doc, upsert=True) for doc in documentos],
+            ordered=False
+        )
+        cache_sku.remover(antes)
+        atualizar_resumo(entradas=documentos, saidas=antes.values())
+        incrementar_versao()
+        return resultado.upserted_count, resultado.matched_count, repetidos
+
+    try:
+        resultado = collection.insert_many(documentos, ordered=False)
+        atualizar_resumo(entradas=documentos)
+        incrementar_versao()
+        return len(resultado.inserted_ids), 0, repetidos
+    except BulkWriteError as erro:
+        # Com ordered=False o Mongo insere tudo o que pode e lista as falhas
+        detalhes = erro.details
+        falhas = [
+            (posicoes[e["index"]], ERRO_SKU_EXISTENTE if e.get("code") == 11000 else e.get("errmsg", "Erro ao gravar"))
+            for e in detalhes.get("writeErrors", [])
+        ]
+        com_falha = {e["index"] for e in detalhes.get("writeErrors", [])}
+        atualizar_resumo(entradas=[doc for i, doc in enumerate(documentos) if i not in com_falha])
+        if detalhes.get("nInserted", 0):
+            incrementar_versao()
+        return detalhes.get("nInserted", 0), 0, repetidos + falhas
+
+# Ordenação -> (campo, direção). "recentes" usa o _id (ObjectId cresce com a inserção).
+ORDENACOES_MONGO = {
+    "recentes": ("_id", DESCENDING),
+    "menor_preco": ("preco", ASCENDING),
+    "maior_preco": ("preco", DESCENDING),
+    "nome": ("nome", ASCENDING),
+}
+
+# Tipos de total aceitos. Sem total, nenhuma contagem extra é feita.
+TIPOS_TOTAL = ("exato", "estimado", "cache")
+
+# Cache de totais por filtro: {chave_do_filtro: (expira_em, total)}
+TTL_CACHE_TOTAL = 30 # segundos
+_cache_totais = {}
+
+def contar_produtos(query: dict, tipo: str):
+    """
+    Conta os produtos do filtro conforme o tipo pedido.
+    - exato: count_documents (varre os documentos filtrados)
+    - estimado: estimated_document_count (metadado da coleção); só vale sem filtro,
+      com filtro cai para a contagem exata
+    - cache: contagem exata guardada por filtro durante TTL_CACHE_TOTAL segundos
+    """
+    if tipo == "estimado" and not query:
+        return collection.estimated_document_count()
+    if tipo == "cache":
+        total = total_em_cache(query)
+        if total is None:
+            total = collection.count_documents(query)
+            guardar_total(query, total)
+        return total
+    return collection.count_documents(query)
+
+def total_em_cache(query: dict):
+    """Total guardado para o filtro, ou None se não houver (ou tiver expirado)."""
+    guardado = _cache_totais.get(repr(sorted(query.items())))
+    if guardado and guardado[0] > time.monotonic():
+        return guardado[1]
+    return None
+
+def guardar_total(query: dict, total: int):
+    if len(_cache_totais) >= 1024:
+        _cache_totais.clear() # Limite simples para não crescer sem controle
+    _cache_totais[repr(sorted(query.items()))] = (time.monotonic() + TTL_CACHE_TOTAL, total)
+
+def montar_filtro(categoria: str = None, min_preco: float = None, max_preco: float = None):
+    """Monta o filtro do Mongo usado pela listagem e pela exportação."""
     # Começamos com um dicionário vazio (traz tudo)
     query = {}
     
     # Se o usuário passou uma categoria, adicionamos ao filtro
     if categoria:
-        # $regex com 'i' faz a busca ser Case Insensitive (ignora maiúscula/minúscula)
-        query["categoria"] = {"$regex": categoria, "$options": "i"}
+        # Igualdade no campo normalizado: ignora maiúsculas/acentos e usa o índice
+        # (um $regex com 'i' não aproveitaria índice nenhum)
+        query["categoria_busca"] = normalizar_categoria(categoria)
     
     # Filtro de Faixa de Preço (Range)
     if min_preco or max_preco:
@@ -46,42 +318,209 @@ def listar_produtos_avancado(
         if max_preco:
             query["preco"]["$lte"] = max_preco # $lte = Less Than or Equal (Menor ou igual)
 
-    # 2. Paginação (Pular registros)
-    # Ex: Página 2 com limite 10 deve pular (skip) os primeiros 10 registros.
-    pular = (pagina - 1) * limite
+    return query
 
-    # 3. Execução da Busca no Mongo
-    # find(query) aplica os filtros
-    # skip() pula os registros das páginas anteriores
-    # limit() restringe a quantidade de resultados
-    cursor = collection.find(query, {"_id": 0}).skip(pular).limit(limite)
-    
-    # Converte o cursor (iterador do banco) para uma lista em memória
-    produtos = list(cursor)
+def ordem_de(ordenar: str):
+    """Lista de ordenação do find() para uma chave de ORDENACOES_MONGO."""
+    campo, direcao = ORDENACOES_MONGO[ordenar]
+    return [(campo, direcao)] if campo == "_id" else [(campo, direcao), ("sku", direcao)]
+
+def filtro_da_pagina(query: dict, ordenar: str, cursor: str = None):
+    """
+    Com `cursor` a página continua depois do último item visto (chave
+    (campo_de_ordenação, sku)), sem skip: o custo não cresce com a profundidade.
+    """
+    if not cursor:
+        return query
+
+    # Keyset: só o que vem depois da chave do último item da página anterior
+    campo, direcao = ORDENACOES_MONGO[ordenar]
+    # Confere a chave contra a ordenação (ValueError -> 400 na rota); o _id vai como texto
+    chave = decodificar_cursor(cursor, ordenar, tipo_id=str)
+    operador = "$lt" if direcao == DESCENDING else "$gt"
+    if campo == "_id":
+        try:
+            condicao = {"_id": {operador: ObjectId(chave[0])}}
+        except InvalidId:
+            raise ValueError("Cursor inválido")
+    else:
+        condicao = {"$or": [
+            {campo: {operador: chave[0]}},
+            {campo: chave[0], "sku": {operador: chave[1]}}
+        ]}
+    return {"$and": [query, condicao]} if query else condicao
+
+def fechar_pagina(produtos: list, limite: int, ordenar: str):
+    """
+    Recebe até limite + 1 documentos e devolve (produtos_da_pagina, proximo_cursor),
+    já sem os campos internos.
+    """
+    campo, _ = ORDENACOES_MONGO[ordenar]
+    proximo_cursor = None
+    if len(produtos) > limite:
+        produtos = produtos[:limite]
+        ultimo = produtos[-1]
+        chave = [str(ultimo["_id"])] if campo == "_id" else [ultimo.get(campo), ultimo["sku"]]
+        proximo_cursor = codificar_cursor(chave)
+
+    for produto in produtos:
+        produto.pop("_id", None)
+        produto.pop("categoria_busca", None)
+    return produtos, proximo_cursor
+
+def listar_produtos_avancado(
+    categoria: str = None, 
+    min_preco: float = None, 
+    max_preco: float = None, 
+    pagina: int = 1, 
+    limite: int = 10,
+    ordenar: str = "recentes",
+    cursor: str = None,
+    total: str = None
+):
+    """
+    Lista produtos com filtros dinâmicos e paginação.
+    Isso é essencial para performance em e-commerces reais.
+    """
     
-    # Conta quantos itens existem no TOTAL para esse filtro (útil para o frontend saber quantas páginas criar)
-    total_items = collection.count_documents(query)
+    # 1. Construção da Query (Filtro)
+    query = montar_filtro(categoria, min_preco, max_preco)
+
+    # 2. Paginação: por cursor ou, no modo clássico, a página 2 com limite 10
+    # deve pular (skip) os primeiros 10 registros.
+    filtro_pagina = filtro_da_pagina(query, ordenar, cursor)
+    pular = 0 if cursor else (pagina - 1) * limite
+
+    # 3. Execução da Busca no Mongo
+    # Buscamos um item a mais só para saber se existe próxima página
+    resultado = collection.find(filtro_pagina).sort(ordem_de(ordenar)).skip(pular).limit(limite + 1)
+    produtos, proximo_cursor = fechar_pagina(list(resultado), limite, ordenar)
+
+    # O total é opcional: é uma segunda consulta e só roda quando pedido
+    total_items = contar_produtos(query, total) if total else None
 
     return {
         "produtos": produtos,
         "total": total_items,
         "pagina": pagina,
-        "limite": limite
+        "limite": limite,
+        "proximo_cursor": proximo_cursor
     }
 
+def exportar_produtos(
+    categoria: str = None,
+    min_preco: float = None,
+    max_preco: float = None,
+    ordenar: str = "recentes",
+    tamanho_lote: int = 1000
+):
+    """
+    Gera os produtos do filtro em lotes de tamanho fixo direto do cursor do Mongo,
+    sem montar a lista completa em memória.
+    """
+    cursor = collection.find(montar_filtro(categoria, min_preco, max_preco), PROJECAO_PUBLICA)
+    cursor = cursor.sort(ordem_de(ordenar)).batch_size(tamanho_lote)
+
+    lote = []
+    for produto in cursor:
+        lote.append(produto)
+        if len(lote) == tamanho_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def kpis_inventario():
+    """KPIs do relatório somados do resumo por categoria (custo por categoria)."""
+    totais = {"total_skus": 0, "total_itens": 0, "patrimonio": 0}
+    for c in resumo.find({}, {"qtd_produtos": 1, "total_estoque": 1, "valor_estoque": 1}):
+        totais["total_skus"] += c["qtd_produtos"]
+        totais["total_itens"] += c["total_estoque"]
+        totais["patrimonio"] += c["valor_estoque"]
+    return totais
+
+def linhas_inventario(tamanho_lote: int = 5000):
+    """Linhas do relatório (sku, nome, categoria, preco, estoque, total) direto do cursor."""
+    projecao = {"_id": 0, "sku": 1, "nome": 1, "categoria": 1, "preco": 1, "estoque": 1}
+    for p in collection.find({}, projecao).sort("_id", ASCENDING).batch_size(tamanho_lote):
+        preco, estoque = p.get("preco") or 0, p.get("estoque") or 0
+        yield (p.get("sku", "SEM-SKU"), p.get("nome") or "Sem Nome", p.get("categoria") or "Geral", preco, estoque, preco * estoque)
+
+def buscar_texto(q: str, categoria: str = None, limite: int = 20):
+    """
+    Busca textual pelo índice 'busca_texto', ordenada por relevância ($meta textScore).
+    O índice de texto do Mongo trabalha com palavras inteiras (com stemming), não prefixos.
+    """
+    query, projecao, ordem = consulta_texto(q, categoria)
+    return list(collection.find(query, projecao).sort(ordem).limit(limite))
+
+def consulta_texto(q: str, categoria: str = None):
+    """(filtro, projeção, ordenação) da busca textual."""
+    query = {"$text": {"$search": q}}
+    if categoria:
+        query["categoria_busca"] = normalizar_categoria(categoria)
+    projecao = {**PROJECAO_PUBLICA, "relevancia": {"$meta": "textScore"}}
+    return query, projecao, [("relevancia", {"$meta": "textScore"})]
+
 def buscar_por_sku(sku: str):
-    """Busca exata pelo código SKU."""
-    return collection.find_one({"sku": sku}, {"_id": 0})
+    """Busca exata pelo código SKU (do cache, se o produto estiver lá)."""
+    guardado = cache_sku.obter(sku)
+    if guardado is not None:
+        return guardado[0]
+    return collection.find_one({"sku": sku}, PROJECAO_PUBLICA)
 
-def atualizar_produto_logica(sku: str, dados_novos: ProdutoUpdate):
+def produto_e_versao(sku: str):
     """
-    Atualiza um produto. Usa o operador $set do MongoDB para 
-    alterar apenas os campos enviados, mantendo o resto intacto.
+    (produto, versao_do_produto) para o GET por SKU (a versão vira o ETag),
+    lendo do banco só na falta do cache. None quando o SKU não existe (o 404
+    não é guardado).
     """
+    guardado = cache_sku.obter(sku)
+    if guardado is None:
+        geracao = cache_sku.geracao()
+        produto = collection.find_one({"sku": sku}, PROJECAO_PUBLICA)
+        if produto is None:
+            return None
+        guardado = (produto, produto.get("versao", 1))
+        cache_sku.guardar(sku, guardado, geracao)
+    return guardado
+
+def dados_de_atualizacao(dados_novos: ProdutoUpdate):
+    """Campos do $set de uma atualização parcial (com a categoria normalizada)."""
     # exclude_unset=True remove campos que vieram como 'None' no JSON,
     # para não apagarmos dados acidentalmente no banco.
-    dados_para_atualizar = dados_novos.dict(exclude_unset=True)
+    dados = dados_novos.dict(exclude_unset=True)
+    if "categoria" in dados:
+        dados["categoria_busca"] = normalizar_categoria(dados["categoria"])
+    return dados
+
+def carimbar(dados: dict, revisao: int) -> dict:
+    """$set de uma atualização já com a revisão reservada."""
+    return {**dados, "revisao": revisao, "atualizado_em": agora_iso()}
 
+def filtro_da_escrita(sku: str, versao: int = None) -> dict:
+    """Filtro de uma escrita por SKU; com `versao` (If-Match) só casa se o produto ainda estiver nela."""
+    return {"sku": sku} if versao is None else {"sku": sku, "versao": versao}
+
+def recusar_escrita(sku: str, versao: int):
+    """
+    A escrita condicional não casou: se o produto existe em outra versão, outra
+    escrita passou na frente (VersaoDesatualizada). Na mesma versão, o que
+    não casou foi a mudança (PUT sem mudança). Só o caminho de erro lê.
+    """
+    if versao is not None:
+        atual = collection.find_one({"sku": sku}, {"_id": 0, "versao": 1})
+        if atual is not None and atual.get("versao") != versao:
+            raise VersaoDesatualizada(atual.get("versao"))
+
+def atualizar_produto_logica(sku: str, dados_novos: ProdutoUpdate, versao: int = None):
+    """
+    Atualiza um produto. Usa o operador $set do MongoDB para 
+    alterar apenas os campos enviados, mantendo o resto intacto.
+    Com `versao`, só grava se o produto ainda estiver nela (VersaoDesatualizada).
+    Devolve o produto alterado, ou None se o SKU não existe.
+    """
+    dados_para_atualizar = dados_de_atualizacao(dados_novos)
     if not dados_para_atualizar:
         return None # Nada para atualizar
 
@@ -90,46 +529,357 @@ def atualizar_produto_logica(sku: str, dados_novos: ProdutoUpdate):
     # faremos uma substituição do objeto de especificações ou merge via código se necessário.
     # Neste exemplo simples, substituímos o objeto 'especificacoes' se ele for enviado.
     
-    # find_one_and_update é atômico (seguro para concorrência)
-    resultado = collection.find_one_and_update(
-        {"sku": sku},                 # Filtro: Quem vamos atualizar?
-        {"$set": dados_para_atualizar}, # Operação: $set atualiza apenas os campos listados
-        projection={"_id": 0},        # Não retornar o _id
-        return_document=ReturnDocument.AFTER # Retorna o objeto JÁ alterado
+    # Revisão reservada antes de gravar (feed de mudanças)
+    carimbo = carimbar({}, reservar_revisoes())
+
+    # find_one_and_update é atômico (seguro para concorrência): a checagem
+    # da versão e a gravação são a mesma operação. Como no lote, só casa se
+    # algum campo mudar: PUT sem mudança não sobe a versão (nem gera 412 nos outros)
+    antes = collection.find_one_and_update(
+        filtro_da_atualizacao(sku, dados_para_atualizar, versao), # Filtro: Quem vamos atualizar?
+        {"$set": {**dados_para_atualizar, **carimbo}, "$inc": {"versao": 1}}, # $set altera só os campos listados
+        projection=PROJECAO_PUBLICA,  # Não retornar o _id nem campos internos
+        return_document=ReturnDocument.BEFORE # Versão anterior: o resumo precisa do "antes"
     )
-    
-    return resultado
+    cache_sku.remover([sku])
+    if antes is None:
+        recusar_escrita(sku, versao)
+        # Não mudou nada: devolve o produto como está (None se o SKU não existe)
+        return collection.find_one({"sku": sku}, PROJECAO_PUBLICA)
+
+    # Monta o "depois" localmente, sem outra ida ao banco
+    depois = {**antes, **dados_novos.dict(exclude_unset=True), **carimbo, "versao": antes.get("versao", 0) + 1}
+    if mudou_para_resumo(antes, depois):
+        atualizar_resumo(entradas=[depois], saidas=[antes])
+    incrementar_versao()
+    return depois
+
+def filtro_se_mudou(sku: str, dados: dict) -> dict:
+    """
+    Só casa se algum campo for diferente do atual: item sem mudança não
+    ganha revisão nova nem conta como modificado.
+    """
+    return {"sku": sku, "$or": [{campo: {"$ne": valor}} for campo, valor in dados.items()]}
+
+def filtro_da_atualizacao(sku: str, dados: dict, versao: int = None) -> dict:
+    """filtro_da_escrita (If-Match) + filtro_se_mudou: a versão só sobe com mudança de fato."""
+    return {**filtro_se_mudou(sku, dados), **filtro_da_escrita(sku, versao)}
+
+def atualizar_em_lote(atualizacoes: list):
+    """
+    Aplica várias atualizações parciais (ProdutoUpdateLote) com um único bulk_write.
+    Retorna (encontrados, modificados, skus_nao_encontrados).
+    """
+    # Uma operação por produto (SKU repetido já vem junto): modified_count conta produtos
+    por_sku = juntar_por_sku(atualizacoes)
+    skus = list(por_sku)
+    # Uma leitura dos SKUs do lote: diz quem não existe e dá o "antes" para o resumo
+    antes = {doc["sku"]: doc for doc in collection.find({"sku": {"$in": skus}}, PROJECAO_RESUMO)}
+
+    operacoes, depois = [], {sku: dict(doc) for sku, doc in antes.items()}
+    for sku, dados in por_sku.items():
+        if not dados or sku not in antes:
+            continue
+        depois[sku].update({c: dados[c] for c in ("categoria", "preco", "estoque") if c in dados})
+        if "categoria" in dados:
+            dados["categoria_busca"] = normalizar_categoria(dados["categoria"])
+        operacoes.append((sku, dados))
+
+    modificados = 0
+    if operacoes:
+        primeira = reservar_revisoes(len(operacoes))
+        operacoes = [
+            UpdateOne(filtro_se_mudou(sku, dados), {"$set": carimbar(dados, primeira + i), "$inc": {"versao": 1}})
+            for i, (sku, dados) in enumerate(operacoes)
+        ]
+        modificados = collection.bulk_write(operacoes, ordered=False).modified_count
+        cache_sku.remover(antes)
+        alterados = [sku for sku in antes if mudou_para_resumo(antes[sku], depois[sku])]
+        atualizar_resumo(entradas=[depois[s] for s in alterados], saidas=[antes[s] for s in alterados])
+        if modificados:
+            incrementar_versao()
+
+    return len(antes), modificados, [sku for sku in skus if sku not in antes]
+
+def deletar_produto_logica(sku: str, versao: int = None):
+    """Remove um produto do banco baseado no SKU (com `versao`, só se ainda estiver nela)."""
+    revisao = reservar_revisoes()
+    removido = collection.find_one_and_delete(filtro_da_escrita(sku, versao), projection=PROJECAO_RESUMO)
+    cache_sku.remover([sku])
+    # None quando não achou nada
+    if removido is None:
+        recusar_escrita(sku, versao)
+        return False
+    # A lápide avisa as réplicas (feed de mudanças) que o SKU saiu
+    removidos.bulk_write([lapide(sku, revisao)])
+    atualizar_resumo(saidas=[removido])
+    incrementar_versao()
+    return True
+
+def mover_estoque(quantidade: int, revisao: int) -> dict:
+    """Update que soma `quantidade` (negativa na baixa) ao estoque, com revisão e versão novas."""
+    return {"$inc": {"estoque": quantidade, "versao": 1}, "$set": carimbar({}, revisao)}
+
+def documento_reserva(reserva: str, pedido: dict) -> dict:
+    # Itens em lista: o SKU pode ter "." ou "$", que não valem como nome de campo
+    itens = [{"sku": sku, "quantidade": quantidade} for sku, quantidade in pedido.items()]
+    return {"_id": reserva, "itens": itens, "status": PENDENTE, "criada_em": agora_iso(), "finalizada_em": None}
+
+def pedido_da_reserva(doc: dict) -> dict:
+    return {item["sku"]: item["quantidade"] for item in doc["itens"]}
+
+def reserva_lida(doc: dict) -> dict:
+    return {
+        **resposta_reserva(doc["_id"], doc["status"], pedido_da_reserva(doc)),
+        "criada_em": doc.get("criada_em"),
+        "finalizada_em": doc.get("finalizada_em"),
+    }
+
+def reservar_estoque(pedido: dict):
+    """
+    Baixa o estoque de cada item do pedido ({sku: quantidade}) com um $inc
+    condicionado a estoque >= quantidade: a checagem e a baixa são a mesma
+    operação atômica, então reservas concorrentes nunca vendem a mesma unidade.
+    Tudo ou nada: se um item não passar, os já baixados são devolvidos e sobe
+    EstoqueInsuficiente. Sem transação, outra leitura pode ver a baixa desfeita
+    por alguns milissegundos, mas nunca estoque negativo.
+    """
+    primeira = reservar_revisoes(len(pedido))
+    baixados = [] # "antes" de cada produto já baixado
+    for i, (sku, quantidade) in enumerate(pedido.items()):
+        antes = collection.find_one_and_update(
+            {"sku": sku, "estoque": {"$gte": quantidade}}, mover_estoque(-quantidade, primeira + i),
+            projection=PROJECAO_RESUMO
+        )
+        if antes is None:
+            break
+        baixados.append(antes)
+    cache_sku.remover(pedido)
+
+    if len(baixados) < len(pedido):
+        if baixados: # O resumo ainda não foi tocado: só o estoque volta
+            devolver_estoque({doc["sku"]: pedido[doc["sku"]] for doc in baixados})
+            incrementar_versao()
+        disponiveis = {doc["sku"]: doc.get("estoque") or 0 for doc in collection.find({"sku": {"$in": list(pedido)}}, PROJECAO_RESUMO)}
+        raise EstoqueInsuficiente(faltas_do_pedido(pedido, disponiveis))
+
+    reserva = nova_reserva()
+    reservas.insert_one(documento_reserva(reserva, pedido))
+    depois = [{**doc, "estoque": doc["estoque"] - pedido[doc["sku"]]} for doc in baixados]
+    atualizar_resumo(entradas=depois, saidas=baixados)
+    incrementar_versao()
+    return resposta_reserva(reserva, PENDENTE, pedido, {doc["sku"]: doc["estoque"] for doc in depois})
 
-def deletar_produto_logica(sku: str):
-    """Remove um produto do banco baseado no SKU."""
-    resultado = collection.delete_one({"sku": sku})
-    # deleted_count retorna 1 se deletou, 0 se não achou nada
-    return resultado.deleted_count > 0
+def devolver_estoque(pedido: dict) -> list:
+    """Soma de volta as quantidades do pedido; devolve o "depois" de cada produto que ainda existe."""
+    primeira = reservar_revisoes(len(pedido))
+    devolvidos = [
+        collection.find_one_and_update(
+            {"sku": sku}, mover_estoque(quantidade, primeira + i),
+            projection=PROJECAO_RESUMO, return_document=ReturnDocument.AFTER
+        )
+        for i, (sku, quantidade) in enumerate(pedido.items())
+    ]
+    cache_sku.remover(pedido)
+    return [doc for doc in devolvidos if doc is not None]
+
+def finalizar_reserva(reserva: str, status: str):
+    """
+    Confirma (o estoque fica baixado) ou libera (o estoque volta) uma reserva
+    pendente. None se a reserva não existe; ReservaFinalizada se já saiu de pendente.
+    """
+    finalizada = reservas.find_one_and_update(
+        {"_id": reserva, "status": PENDENTE}, {"$set": {"status": status, "finalizada_em": agora_iso()}}
+    )
+    if finalizada is None:
+        atual = reservas.find_one({"_id": reserva}, {"status": 1})
+        if atual is None:
+            return None
+        raise ReservaFinalizada(atual["status"])
+
+    pedido = pedido_da_reserva(finalizada)
+    if status == CONFIRMADA:
+        return resposta_reserva(reserva, status, pedido)
+    depois = devolver_estoque(pedido)
+    antes = [{**doc, "estoque": doc["estoque"] - pedido[doc["sku"]]} for doc in depois]
+    atualizar_resumo(entradas=depois, saidas=antes)
+    incrementar_versao()
+    return resposta_reserva(reserva, status, pedido, {doc["sku"]: doc["estoque"] for doc in depois})
+
+def obter_reserva(reserva: str):
+    doc = reservas.find_one({"_id": reserva})
+    return reserva_lida(doc) if doc else None
+
+def listar_mudancas(desde: int, limite: int = 1000):
+    """
+    Produtos gravados e lápides com revisão maior que `desde`, em ordem de revisão.
+    Ver fechar_mudancas para a revisão devolvida ao cliente.
+    """
+    filtro = {"revisao": {"$gt": desde}}
+    alterados = collection.find(filtro, PROJECAO_PUBLICA).sort("revisao", ASCENDING).limit(limite + 1)
+    apagados = removidos.find(filtro).sort("revisao", ASCENDING).limit(limite + 1)
+    alterados, apagados = list(alterados), list(apagados)
+    if not alterados and not apagados:
+        validar_revisao(desde, contadores.find_one(FILTRO_VERSAO))
+    return fechar_mudancas(alterados, apagados, desde, limite)
+
+def validar_revisao(desde: int, contador: dict):
+    """Revisão à frente do banco (ex: banco recriado): a réplica do cliente não vale mais."""
+    if desde > ((contador or {}).get("revisao") or 0):
+        raise ValueError("Revisão desconhecida: sincronize de novo com since=0")
+
+def fechar_mudancas(alterados: list, apagados: list, desde: int, limite: int):
+    """
+    Junta as duas listas (já ordenadas), corta em `limite` e decide até onde o
+    cliente pode avançar: até o último item antes do primeiro gravado dentro de
+    JANELA_ESTAVEL. Os itens recentes saem na resposta (o cliente vê a própria
+    escrita na hora) e voltam na próxima chamada, quando já estiverem estáveis.
+    """
+    itens = sorted(
+        [(p["revisao"], p.get("atualizado_em"), p) for p in alterados] +
+        [(r["revisao"], r.get("removido_em"), {"sku": r["_id"], "revisao": r["revisao"], "removido_em": r.get("removido_em")}) for r in apagados],
+        key=lambda item: item[0]
+    )
+    tem_mais = len(itens) > limite
+    itens = itens[:limite]
+
+    corte = datetime.now(timezone.utc).timestamp() - JANELA_ESTAVEL
+    revisao = desde
+    for rev, gravado_em, _ in itens:
+        if gravado_em and datetime.fromisoformat(gravado_em.replace("Z", "+00:00")).timestamp() > corte:
+            tem_mais = False # O resto vem na próxima sincronização
+            break
+        revisao = rev
+
+    return {
+        "revisao": revisao,
+        "alterados": [p for _, _, p in itens if "removido_em" not in p],
+        "removidos": [p for _, _, p in itens if "removido_em" in p],
+        "tem_mais": tem_mais
+    }
 
 def analise_de_catalogo():
-    """Aggregation Pipeline para estatísticas."""
-    pipeline = [
-        # $group: Agrupa documentos baseado no campo 'categoria'
+    """
+    Estatísticas por categoria lidas do resumo materializado
+    (custo proporcional ao nº de categorias, não ao catálogo).
+    """
+    categorias = resumo.find({"qtd_produtos": {"$gt": 0}}).sort("qtd_produtos", DESCENDING)
+    return formatar_resumo(categorias)
+
+def formatar_resumo(categorias):
+    """Documentos do resumo -> formato de resposta do /analytics/geral."""
+    return [
         {
-            "$group": {
-                "_id": "$categoria",             # A chave do agrupamento
-                "qtd_produtos": {"$sum": 1},     # Conta +1 para cada produto
-                "media_preco": {"$avg": "$preco"}, # Calcula média aritmética
-                "total_estoque": {"$sum": "$estoque"} # Soma o estoque total
-            }
+            "categoria": c["_id"],
+            "qtd_produtos": c["qtd_produtos"],
+            "media_preco": round(c["soma_preco"] / c["qtd_produtos"], 2),
+            "total_estoque": c["total_estoque"],
+            "valor_estoque": round(c["valor_estoque"], 2)
+        }
+        for c in categorias
+    ]
+
+def pipeline_top_valor(top: int, categoria: str = None):
+    """Maiores produtos por valor em estoque (preco * estoque); $sort + $limit vira um top-k."""
+    filtro = {"categoria_busca": normalizar_categoria(categoria)} if categoria else {}
+    return [
+        {"$match": filtro},
+        {"$project": {"_id": 0, "sku": 1, "nome": 1, "categoria": 1, "valor": {"$multiply": ["$preco", "$estoque"]}}},
+        {"$sort": {"valor": DESCENDING}},
+        {"$limit": top}
+    ]
+
+def montar_receita(top: list, categorias, categoria: str = None):
+    """
+    Top N + "Outros". O total sai do resumo por categoria (custo por categoria,
+    não por produto); com `categoria`, só das que batem com ela normalizada.
+    """
+    if categoria:
+        alvo = normalizar_categoria(categoria)
+        categorias = [c for c in categorias if normalizar_categoria(c["_id"]) == alvo]
+    qtd_total = sum(c["qtd_produtos"] for c in categorias)
+    valor_total = sum(c["valor_estoque"] for c in categorias)
+    valor_top = sum(item["valor"] for item in top)
+    return {
+        "categoria": categoria,
+        "top": top,
+        "outros": {
+            "qtd_produtos": max(qtd_total - len(top), 0),
+            "valor": round(max(valor_total - valor_top, 0), 2)
         },
-        # $project: Formata a saída para ficar mais bonita (renomeia _id para categoria)
+        "total": {"qtd_produtos": qtd_total, "valor": round(valor_total, 2)}
+    }
+
+def receita_por_produto(top: int = 10, categoria: str = None):
+    maiores = list(collection.aggregate(pipeline_top_valor(top, categoria)))
+    return montar_receita(maiores, list(resumo.find({"qtd_produtos": {"$gt": 0}})), categoria)
+
+# Agregação completa do catálogo no mesmo formato do resumo
+PIPELINE_RESUMO = [
+    # $group: Agrupa documentos baseado no campo 'categoria'
+    {
+        "$group": {
+            "_id": "$categoria",             # A chave do agrupamento
+            "qtd_produtos": {"$sum": 1},     # Conta +1 para cada produto
+            "soma_preco": {"$sum": "$preco"},
+            "total_estoque": {"$sum": "$estoque"}, # Soma o estoque total
+            "valor_estoque": {"$sum": {"$multiply": ["$preco", "$estoque"]}}
+        }
+    }
+]
+
+def pipeline_kpis(limite: int):
+    """
+    Indicadores do Dashboard numa ida ao banco: o $facet passa pela coleção
+    uma vez e devolve as somas por categoria e a contagem de estoque baixo.
+    """
+    return [{
+        "$facet": {
+            "categorias": PIPELINE_RESUMO,
+            "estoque_baixo": [
+                {"$match": {"estoque": {"$lte": limite}}},
+                {
+                    "$group": {
+                        "_id": "$categoria",
+                        "estoque_baixo": {"$sum": 1},
+                        "sem_estoque": {"$sum": {"$cond": [{"$lte": ["$estoque", 0]}, 1, 0]}}
+                    }
+                }
+            ]
+        }
+    }]
+
+def juntar_kpis(resultado: dict, limite: int):
+    """Documento do $facet -> resposta do /analytics/kpis."""
+    baixo = {c["_id"]: c for c in resultado["estoque_baixo"]}
+    categorias = [
         {
-            "$project": {
-                "categoria": "$_id",
-                "_id": 0,
-                "qtd_produtos": 1,
-                "media_preco": {"$round": ["$media_preco", 2]}, # Arredonda para 2 casas decimais
-                "total_estoque": 1
-            }
-        },
-        # $sort: Ordena por quantidade decrescente (-1)
-        {"$sort": {"qtd_produtos": -1}}
+            **c,
+            "categoria": c["_id"] or "",
+            "estoque_baixo": baixo.get(c["_id"], {}).get("estoque_baixo", 0),
+            "sem_estoque": baixo.get(c["_id"], {}).get("sem_estoque", 0),
+        }
+        for c in resultado["categorias"]
     ]
-    
-    return list(collection.aggregate(pipeline))
\ No newline at end of file
+    return montar_kpis(categorias, limite)
+
+def kpis_do_catalogo(limite: int = ESTOQUE_BAIXO):
+    resultado = next(collection.aggregate(pipeline_kpis(limite)))
+    return juntar_kpis(resultado, limite)
+
+def reconstruir_resumo():
+    """Recalcula o resumo do zero. $out troca a coleção inteira de uma vez."""
+    collection.aggregate(PIPELINE_RESUMO + [{"$out": resumo.name}])
+    return resumo.count_documents({})
+
+def verificar_resumo(tolerancia: float = 0.01):
+    """Compara o resumo materializado com a agregação completa. Retorna as divergências."""
+    esperado = {c["_id"]: c for c in collection.aggregate(PIPELINE_RESUMO)}
+    atual = {c["_id"]: c for c in resumo.find({"qtd_produtos": {"$gt": 0}})}
+
+    divergencias = []
+    for categoria in set(esperado) | set(atual):
+        e, a = esperado.get(categoria), atual.get(categoria)
+        if e is None or a is None or any(abs(e[c] - a[c]) > tolerancia for c in CAMPOS_RESUMO):
+            divergencias.append({"categoria": categoria, "esperado": e, "materializado": a})
+    return divergencias
@@ -0,0 +1,273 @@
+"""
+Versões async das operações do dia a dia, usadas quando NEXUS_MODO=async.
+A regra de negócio (filtros, cursor, resumo) vem de app.services; aqui só
+muda a ida ao banco, que passa pelo AsyncMongoClient e não ocupa thread.
+"""
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from app.database import db_async
+from app.eventos import avisar_escrita
+from app.models import ProdutoSchema, ProdutoUpdate
+from app.reservas import (
+    CONFIRMADA, PENDENTE, EstoqueInsuficiente, ReservaFinalizada, faltas_do_pedido, nova_reserva, resposta_reserva
+)
+from app.services import (
+    FILTRO_VERSAO,
+    PROJECAO_PUBLICA,
+    PROJECAO_RESUMO,
+    agora_iso,
+    cache_sku,
+    carimbar,
+    documento_reserva,
+    consulta_texto,
+    dados_de_atualizacao,
+    fechar_mudancas,
+    fechar_pagina,
+    filtro_da_atualizacao,
+    filtro_da_pagina,
+    filtro_da_escrita,
+    formatar_resumo,
+    guardar_total,
+    juntar_kpis,
+    montar_receita,
+    pipeline_kpis,
+    pipeline_top_valor,
+    lapide,
+    montar_filtro,
+    mover_estoque,
+    mudou_para_resumo,
+    normalizar_categoria,
+    operacoes_resumo,
+    ordem_de,
+    pedido_da_reserva,
+    reserva_lida,
+    total_em_cache,
+    validar_revisao,
+    VersaoDesatualizada,
+)
+
+
+async def atualizar_resumo(entradas=(), saidas=()):
+    operacoes = operacoes_resumo(entradas, saidas)
+    if operacoes:
+        await db_async().resumo_categorias.bulk_write(operacoes, ordered=False)
+
+async def versao_catalogo() -> int:
+    doc = await db_async().contadores.find_one(FILTRO_VERSAO)
+    return doc.get("versao", 0) if doc else 0
+
+async def incrementar_versao():
+    await db_async().contadores.update_one(FILTRO_VERSAO, {"$inc": {"versao": 1}}, upsert=True)
+    avisar_escrita()
+
+async def revisao_catalogo() -> int:
+    doc = await db_async().contadores.find_one(FILTRO_VERSAO)
+    return doc.get("revisao", 0) if doc else 0
+
+async def reservar_revisoes(quantidade: int = 1) -> int:
+    contador = await db_async().contadores.find_one_and_update(
+        FILTRO_VERSAO, {"$inc": {"revisao": quantidade}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return contador["revisao"] - quantidade + 1
+
+async def criar_produto(produto: ProdutoSchema):
+    """Insere um novo produto no banco (SKU repetido: DuplicateKeyError do índice único)."""
+    produto_dict = produto.dict()
+    produto_dict["categoria_busca"] = normalizar_categoria(produto.categoria)
+    produto_dict.update(revisao=await reservar_revisoes(), atualizado_em=agora_iso(), versao=1)
+    await db_async().produtos.insert_one(produto_dict)
+    await atualizar_resumo(entradas=[produto_dict])
+    await incrementar_versao()
+    return produto_dict
+
+async def contar_produtos(query: dict, tipo: str):
+    """Mesmas regras de app.services.contar_produtos (e o mesmo cache)."""
+    produtos = db_async().produtos
+    if tipo == "estimado" and not query:
+        return await produtos.estimated_document_count()
+    if tipo == "cache":
+        total = total_em_cache(query)
+        if total is None:
+            total = await produtos.count_documents(query)
+            guardar_total(query, total)
+        return total
+    return await produtos.count_documents(query)
+
+async def listar_produtos_avancado(
+    categoria: str = None,
+    min_preco: float = None,
+    max_preco: float = None,
+    pagina: int = 1,
+    limite: int = 10,
+    ordenar: str = "recentes",
+    cursor: str = None,
+    total: str = None
+):
+    """Lista produtos com filtros dinâmicos e paginação (ver app.services)."""
+    query = montar_filtro(categoria, min_preco, max_preco)
+    filtro_pagina = filtro_da_pagina(query, ordenar, cursor)
+    pular = 0 if cursor else (pagina - 1) * limite
+
+    resultado = db_async().produtos.find(filtro_pagina).sort(ordem_de(ordenar)).skip(pular).limit(limite + 1)
+    produtos, proximo_cursor = fechar_pagina(await resultado.to_list(), limite, ordenar)
+    total_items = await contar_produtos(query, total) if total else None
+
+    return {
+        "produtos": produtos,
+        "total": total_items,
+        "pagina": pagina,
+        "limite": limite,
+        "proximo_cursor": proximo_cursor
+    }
+
+async def buscar_texto(q: str, categoria: str = None, limite: int = 20):
+    query, projecao, ordem = consulta_texto(q, categoria)
+    return await db_async().produtos.find(query, projecao).sort(ordem).limit(limite).to_list()
+
+async def buscar_por_sku(sku: str):
+    guardado = cache_sku.obter(sku)
+    if guardado is not None:
+        return guardado[0]
+    return await db_async().produtos.find_one({"sku": sku}, PROJECAO_PUBLICA)
+
+async def produto_e_versao(sku: str):
+    """Mesma regra de app.services.produto_e_versao (e o mesmo cache)."""
+    guardado = cache_sku.obter(sku)
+    if guardado is None:
+        geracao = cache_sku.geracao()
+        produto = await db_async().produtos.find_one({"sku": sku}, PROJECAO_PUBLICA)
+        if produto is None:
+            return None
+        guardado = (produto, produto.get("versao", 1))
+        cache_sku.guardar(sku, guardado, geracao)
+    return guardado
+
+async def recusar_escrita(sku: str, versao: int):
+    """Como services.recusar_escrita: só o caminho de erro lê o produto."""
+    if versao is not None:
+        atual = await db_async().produtos.find_one({"sku": sku}, {"_id": 0, "versao": 1})
+        if atual is not None and atual.get("versao") != versao:
+            raise VersaoDesatualizada(atual.get("versao"))
+
+async def atualizar_produto_logica(sku: str, dados_novos: ProdutoUpdate, versao: int = None):
+    """Atualização parcial com $set (condicional com `versao`); devolve o produto já alterado ou None."""
+    dados_para_atualizar = dados_de_atualizacao(dados_novos)
+    if not dados_para_atualizar:
+        return None
+
+    carimbo = carimbar({}, await reservar_revisoes())
+    antes = await db_async().produtos.find_one_and_update(
+        filtro_da_atualizacao(sku, dados_para_atualizar, versao), # Sem mudança de fato, não casa
+        {"$set": {**dados_para_atualizar, **carimbo}, "$inc": {"versao": 1}},
+        projection=PROJECAO_PUBLICA,
+        return_document=ReturnDocument.BEFORE # O resumo precisa do "antes"
+    )
+    cache_sku.remover([sku])
+    if antes is None:
+        await recusar_escrita(sku, versao)
+        return await db_async().produtos.find_one({"sku": sku}, PROJECAO_PUBLICA) # Nada mudou (ou não existe)
+
+    depois = {**antes, **dados_novos.dict(exclude_unset=True), **carimbo, "versao": antes.get("versao", 0) + 1}
+    if mudou_para_resumo(antes, depois):
+        await atualizar_resumo(entradas=[depois], saidas=[antes])
+    await incrementar_versao()
+    return depois
+
+async def deletar_produto_logica(sku: str, versao: int = None):
+    revisao = await reservar_revisoes()
+    removido = await db_async().produtos.find_one_and_delete(filtro_da_escrita(sku, versao), projection=PROJECAO_RESUMO)
+    cache_sku.remover([sku])
+    if removido is None:
+        await recusar_escrita(sku, versao)
+        return False
+    await db_async().produtos_removidos.bulk_write([lapide(sku, revisao)])
+    await atualizar_resumo(saidas=[removido])
+    await incrementar_versao()
+    return True
+
+async def reservar_estoque(pedido: dict):
+    """Mesma regra de app.services.reservar_estoque ($inc condicionado, tudo ou nada)."""
+    produtos = db_async().produtos
+    primeira = await reservar_revisoes(len(pedido))
+    baixados = []
+    for i, (sku, quantidade) in enumerate(pedido.items()):
+        antes = await produtos.find_one_and_update(
+            {"sku": sku, "estoque": {"$gte": quantidade}}, mover_estoque(-quantidade, primeira + i),
+            projection=PROJECAO_RESUMO
+        )
+        if antes is None:
+            break
+        baixados.append(antes)
+    cache_sku.remover(pedido)
+
+    if len(baixados) < len(pedido):
+        if baixados:
+            await devolver_estoque({doc["sku"]: pedido[doc["sku"]] for doc in baixados})
+            await incrementar_versao()
+        atuais = await produtos.find({"sku": {"$in": list(pedido)}}, PROJECAO_RESUMO).to_list()
+        raise EstoqueInsuficiente(faltas_do_pedido(pedido, {doc["sku"]: doc.get("estoque") or 0 for doc in atuais}))
+
+    reserva = nova_reserva()
+    await db_async().reservas.insert_one(documento_reserva(reserva, pedido))
+    depois = [{**doc, "estoque": doc["estoque"] - pedido[doc["sku"]]} for doc in baixados]
+    await atualizar_resumo(entradas=depois, saidas=baixados)
+    await incrementar_versao()
+    return resposta_reserva(reserva, PENDENTE, pedido, {doc["sku"]: doc["estoque"] for doc in depois})
+
+async def devolver_estoque(pedido: dict) -> list:
+    primeira = await reservar_revisoes(len(pedido))
+    devolvidos = [
+        await db_async().produtos.find_one_and_update(
+            {"sku": sku}, mover_estoque(quantidade, primeira + i),
+            projection=PROJECAO_RESUMO, return_document=ReturnDocument.AFTER
+        )
+        for i, (sku, quantidade) in enumerate(pedido.items())
+    ]
+    cache_sku.remover(pedido)
+    return [doc for doc in devolvidos if doc is not None]
+
+async def finalizar_reserva(reserva: str, status: str):
+    """Mesma regra de app.services.finalizar_reserva."""
+    finalizada = await db_async().reservas.find_one_and_update(
+        {"_id": reserva, "status": PENDENTE}, {"$set": {"status": status, "finalizada_em": agora_iso()}}
+    )
+    if finalizada is None:
+        atual = await db_async().reservas.find_one({"_id": reserva}, {"status": 1})
+        if atual is None:
+            return None
+        raise ReservaFinalizada(atual["status"])
+
+    pedido = pedido_da_reserva(finalizada)
+    if status == CONFIRMADA:
+        return resposta_reserva(reserva, status, pedido)
+    depois = await devolver_estoque(pedido)
+    antes = [{**doc, "estoque": doc["estoque"] - pedido[doc["sku"]]} for doc in depois]
+    await atualizar_resumo(entradas=depois, saidas=antes)
+    await incrementar_versao()
+    return resposta_reserva(reserva, status, pedido, {doc["sku"]: doc["estoque"] for doc in depois})
+
+async def obter_reserva(reserva: str):
+    doc = await db_async().reservas.find_one({"_id": reserva})
+    return reserva_lida(doc) if doc else None
+
+async def listar_mudancas(desde: int, limite: int = 1000):
+    """Mesma regra de app.services.listar_mudancas."""
+    filtro = {"revisao": {"$gt": desde}}
+    alterados = db_async().produtos.find(filtro, PROJECAO_PUBLICA).sort("revisao", ASCENDING).limit(limite + 1)
+    apagados = db_async().produtos_removidos.find(filtro).sort("revisao", ASCENDING).limit(limite + 1)
+    alterados, apagados = await alterados.to_list(), await apagados.to_list()
+    if not alterados and not apagados:
+        validar_revisao(desde, await db_async().contadores.find_one(FILTRO_VERSAO))
+    return fechar_mudancas(alterados, apagados, desde, limite)
+
+async def receita_por_produto(top: int = 10, categoria: str = None):
+    maiores = await (await db_async().produtos.aggregate(pipeline_top_valor(top, categoria))).to_list()
+    categorias = await db_async().resumo_categorias.find({"qtd_produtos": {"$gt": 0}}).to_list()
+    return montar_receita(maiores, categorias, categoria)
+
+async def kpis_do_catalogo(limite: int):
+    resultado = (await (await db_async().produtos.aggregate(pipeline_kpis(limite))).to_list())[0]
+    return juntar_kpis(resultado, limite)
+
+async def analise_de_catalogo():
+    categorias = db_async().resumo_categorias.find({"qtd_produtos": {"$gt": 0}}).sort("qtd_produtos", DESCENDING)
+    return formatar_resumo(await categorias.to_list())
@@ -0,0 +1,267 @@
+import os
+import threading
+
+import numpy as np
+
+# Snapshot colunar do catálogo em memória (um por processo). Desligado por
+# padrão: ocupa ~150 MB por milhão de produtos (sku e nome ficam como str).
+USAR_SNAPSHOT = os.getenv("NEXUS_SNAPSHOT", "0").lower() in ("1", "true", "sim")
+
+# Ordenação -> (coluna, decrescente), as mesmas da listagem no banco
+ORDENACOES_SNAPSHOT = {
+    "recentes": ("rowid", True),
+    "menor_preco": ("preco", False),
+    "maior_preco": ("preco", True),
+    "nome": ("nome", False),
+}
+
+CAPACIDADE_INICIAL = 1024
+COLUNAS_SNAPSHOT = ("rowid", "sku", "nome", "prefixo_nome", "categoria", "preco", "estoque", "ativo")
+
+
+def prefixo_ordenavel(textos) -> np.ndarray:
+    """
+    Primeiros 8 bytes UTF-8 de cada texto como uint64 big-endian: comparar os
+    números dá a mesma ordem que comparar os textos (a ordem BINARY do SQLite),
+    só que empatando quando o começo é igual.
+    """
+    return np.array([texto.encode("utf-8")[:8] for texto in textos], dtype="S8").view(">u8").astype(np.uint64)
+
+
+class SnapshotCatalogo:
+    """
+    Cópia do catálogo em colunas NumPy (rowid, sku, nome, código da categoria,
+    preço e estoque) para filtros, ordenações e agregados vetorizados. sku e
+    nome ficam como str (dtype object); para ordenar por nome sem comparar
+    strings uma a uma existe a coluna prefixo_nome (ver prefixo_ordenavel).
+
+    O banco continua sendo a fonte da verdade: o snapshot só recebe as mudanças
+    do catálogo em ordem de revisão (aplicar) e guarda até qual versão chegou.
+    Removidos viram buracos (ativo=False) até a próxima compactação.
+    Thread-safe: leituras e escritas passam pelo mesmo lock, e cada operação
+    dura micro a poucos milissegundos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        with self._lock:
+            self.revisao = 0 # Versão do catálogo já refletida
+            self._n = 0 # Posições usadas (ativas + buracos)
+            self._buracos = 0
+            self._posicao = {} # sku -> posição nas colunas
+            self._categorias = [] # código -> nome
+            self._codigos = {} # nome -> código
+            self._alocar(CAPACIDADE_INICIAL)
+
+    def _alocar(self, capacidade: int):
+        """(Re)cria as colunas com a capacidade pedida, copiando as posições usadas."""
+        n = self._n
+        novas = {
+            "rowid": np.zeros(capacidade, dtype=np.int64),
+            "sku": np.empty(capacidade, dtype=object),
+            "nome": np.empty(capacidade, dtype=object),
+            "prefixo_nome": np.zeros(capacidade, dtype=np.uint64),
+            "categoria": np.zeros(capacidade, dtype=np.int32),
+            "preco": np.zeros(capacidade, dtype=np.float64),
+            "estoque": np.zeros(capacidade, dtype=np.int64),
+            "ativo": np.zeros(capacidade, dtype=bool),
+        }
+        if n:
+            for nome, coluna in novas.items():
+                coluna[:n] = getattr(self, nome)[:n]
+        for nome, coluna in novas.items():
+            setattr(self, nome, coluna)
+
+    def _codigo(self, categoria) -> int:
+        categoria = categoria or "" # Como o IFNULL(categoria, '') do resumo
+        codigo = self._codigos.get(categoria)
+        if codigo is None:
+            codigo = self._codigos[categoria] = len(self._categorias)
+            self._categorias.append(categoria)
+        return codigo
+
+    # --- ESCRITA ---
+
+    def aplicar(self, mudancas, revisao: int) -> int:
+        """
+        Aplica mudanças em ordem de revisão e marca o snapshot na versão `revisao`.
+        Cada mudança é (revisao, rowid, sku, nome, categoria, preco, estoque);
+        rowid None é uma remoção. Reaplicar uma mudança é inofensivo, então
+        duas sincronizações concorrentes podem se sobrepor: só a de versão mais
+        nova é aplicada. Retorna o nº de mudanças aplicadas.
+        """
+        with self._lock:
+            if revisao <= self.revisao:
+                return 0
+            aplicadas = 0
+            novos = {} # sku -> mudança dos produtos que ainda não estão nas colunas
+            for _, rowid, sku, nome, categoria, preco, estoque in mudancas:
+                aplicadas += 1
+                if rowid is None:
+                    novos.pop(sku, None)
+                    posicao = self._posicao.pop(sku, None)
+                    if posicao is not None:
+                        self.ativo[posicao] = False
+                        self.sku[posicao] = self.nome[posicao] = None
+                        self._buracos += 1
+                    continue
+                posicao = self._posicao.get(sku)
+                if posicao is None:
+                    novos[sku] = (rowid, sku, nome, categoria, preco, estoque)
+                    continue
+                self.rowid[posicao] = rowid
+                self.nome[posicao] = nome
+                self.prefixo_nome[posicao] = prefixo_ordenavel([nome])[0]
+                self.categoria[posicao] = self._codigo(categoria)
+                self.preco[posicao] = preco
+                self.estoque[posicao] = estoque
+            if novos:
+                self._acrescentar(list(novos.values()))
+            if self._buracos > max(self._n // 2, CAPACIDADE_INICIAL):
+                self._compactar()
+            self.revisao = revisao
+            return aplicadas
+
+    def _acrescentar(self, linhas: list):
+        inicio, fim = self._n, self._n + len(linhas)
+        if fim > len(self.ativo):
+            self._alocar(max(fim, 2 * len(self.ativo)))
+        rowids, skus, nomes, categorias, precos, estoques = zip(*linhas)
+        self.rowid[inicio:fim] = rowids
+        self.sku[inicio:fim] = skus
+        self.nome[inicio:fim] = nomes
+        self.prefixo_nome[inicio:fim] = prefixo_ordenavel(nomes)
+        self.categoria[inicio:fim] = [self._codigo(c) for c in categorias]
+        self.preco[inicio:fim] = precos
+        self.estoque[inicio:fim] = estoques
+        self.ativo[inicio:fim] = True
+        self._posicao.update(zip(skus, range(inicio, fim)))
+        self._n = fim
+
+    def _compactar(self):
+        """Descarta os buracos deixados pelas remoções e refaz as posições."""
+        manter = np.flatnonzero(self.ativo[:self._n])
+        for nome in COLUNAS_SNAPSHOT:
+            coluna = getattr(self, nome)
+            coluna[:len(manter)] = coluna[manter]
+            coluna[len(manter):self._n] = 0 if coluna.dtype != object else None
+        self._n = len(manter)
+        self._buracos = 0
+        self._posicao = dict(zip(self.sku[:self._n].tolist(), range(self._n)))
+
+    # --- LEITURA ---
+
+    def _mascara(self, categorias=None, min_preco=None, max_preco=None):
+        """
+        Máscara dos produtos ativos que passam nos filtros, ou None se nenhum
+        pode passar. `categorias`: nomes gravados aceitos (ver nomes_da_categoria).
+        """
+        mascara = self.ativo[:self._n].copy()
+        if categorias:
+            codigos = [self._codigos[nome] for nome in categorias if nome in self._codigos]
+            if not codigos:
+                return None
+            mascara &= np.isin(self.categoria[:self._n], codigos)
+        if min_preco is not None:
+            mascara &= self.preco[:self._n] >= min_preco
+        if max_preco is not None:
+            mascara &= self.preco[:self._n] <= max_preco
+        return mascara
+
+    def pagina(self, categorias=None, min_preco=None, max_preco=None, ordenar="recentes", chave=None, limite=100) -> list:
+        """
+        rowids da página da listagem, na ordem pedida. `chave` é a do cursor
+        ([rowid] ou [valor, sku] do último item visto), como na paginação do banco.
+        """
+        coluna, decrescente = ORDENACOES_SNAPSHOT[ordenar]
+        with self._lock:
+            mascara = self._mascara(categorias, min_preco, max_preco)
+            if mascara is None:
+                return []
+            posicoes = np.flatnonzero(mascara)
+
+            if coluna == "rowid":
+                valores = self.rowid[posicoes]
+                if chave:
+                    depois = (valores < chave[0]) if decrescente else (valores > chave[0])
+                    valores = valores[depois]
+                if len(valores) > limite:
+                    valores = np.partition(valores, len(valores) - limite)[len(valores) - limite:] if decrescente \
+                        else np.partition(valores, limite - 1)[:limite]
+                valores.sort()
+                return (valores[::-1] if decrescente else valores)[:limite].tolist()
+
+            # Ordem exata: (valor, sku). Os cortes usam uma chave numérica que
+            # nunca inverte essa ordem (o preço, ou o prefixo do nome) e só os
+            # empates dela são comparados como tupla, em Python
+            exata = getattr(self, coluna)
+            numerica = self.prefixo_nome if coluna == "nome" else self.preco
+            valores = numerica[posicoes]
+            if chave:
+                referencia = prefixo_ordenavel([chave[0]])[0] if coluna == "nome" else chave[0]
+                depois = (valores < referencia) if decrescente else (valores > referencia)
+                empatados = np.flatnonzero(valores == referencia)
+                if len(empatados):
+                    ultimo = (chave[0], chave[1])
+                    pares = zip(exata[posicoes[empatados]].tolist(), self.sku[posicoes[empatados]].tolist())
+                    depois[empatados] = [(par < ultimo) if decrescente else (par > ultimo) for par in pares]
+                posicoes, valores = posicoes[depois], valores[depois]
+
+            if len(posicoes) > limite:
+                # Só os `limite` primeiros interessam: corta no valor do limite-ésimo
+                # (mantendo os empatados com ele) em vez de ordenar tudo
+                k = len(posicoes) - limite if decrescente else limite - 1
+                corte = np.partition(valores, k)[k]
+                posicoes = posicoes[(valores >= corte) if decrescente else (valores <= corte)]
+
+            chaves = list(zip(exata[posicoes].tolist(), self.sku[posicoes].tolist(), self.rowid[posicoes].tolist()))
+            chaves.sort(reverse=decrescente)
+            return [rowid for _, _, rowid in chaves[:limite]]
+
+    def resumo_categorias(self, limite_estoque: int) -> list:
+        """
+        Somas por categoria no formato das linhas do SQL_KPIS (qtd_produtos,
+        soma_preco, total_estoque, valor_estoque, estoque_baixo, sem_estoque).
+        """
+        with self._lock:
+            ativo = self.ativo[:self._n]
+            codigos = self.categoria[:self._n][ativo]
+            precos = self.preco[:self._n][ativo]
+            estoques = self.estoque[:self._n][ativo]
+            tamanho = len(self._categorias)
+            nomes = list(self._categorias)
+
+        qtd = np.bincount(codigos, minlength=tamanho)
+        soma_preco = np.bincount(codigos, weights=precos, minlength=tamanho)
+        total_estoque = np.bincount(codigos, weights=estoques, minlength=tamanho)
+        valor_estoque = np.bincount(codigos, weights=precos * estoques, minlength=tamanho)
+        baixo = estoques <= limite_estoque
+        estoque_baixo = np.bincount(codigos[baixo], minlength=tamanho)
+        sem_estoque = np.bincount(codigos[estoques <= 0], minlength=tamanho)
+        return [
+            {
+                "categoria": nomes[codigo],
+                "qtd_produtos": int(qtd[codigo]),
+                "soma_preco": float(soma_preco[codigo]),
+                "total_estoque": int(total_estoque[codigo]),
+                "valor_estoque": float(valor_estoque[codigo]),
+                "estoque_baixo": int(estoque_baixo[codigo]),
+                "sem_estoque": int(sem_estoque[codigo]),
+            }
+            for codigo in np.flatnonzero(qtd)
+        ]
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            bytes_colunas = sum(getattr(self, nome).nbytes for nome in COLUNAS_SNAPSHOT)
+            return {
+                "revisao": self.revisao,
+                "produtos": len(self._posicao),
+                "posicoes": self._n,
+                "capacidade": len(self.ativo),
+                "categorias": len(self._categorias),
+                "memoria_colunas_mb": round(bytes_colunas / 2**20, 1),
+            }
@@ -0,0 +1,465 @@
+"""
+Benchmark de todas as rotas da API com catálogos sintéticos (10k, 100k, 1M).
+Para cada tamanho, sobe a API num processo separado, semeia o catálogo e
+dispara cada rota com N clientes concorrentes. Mede vazão, latência
+(p50/p95/p99), tempo no banco (lido do /metrics) e pico de RSS do servidor.
+
+    python benchmark_api.py --backend sqlite --produtos 10000,100000,1000000
+    python benchmark_api.py --backend mongomock --produtos 10000 --clientes 8
+    MONGO_URL=mongodb://localhost:27017 python benchmark_api.py --backend mongo
+    python benchmark_api.py --saida atual.json --comparar anterior.json
+
+Backends:
+- sqlite: main.py com um banco temporário (NEXUS_MODO via --modo)
+- mongo: app/routes.py num mongod local (MONGO_URL), banco "nexus_benchmark"
+- mongomock: app/routes.py sobre o mongomock em memória (pip install mongomock).
+  Só --modo sync e 1 cliente (o mongomock não tem cliente async nem é
+  thread-safe), sem $text (a busca falha) e sem tempo no banco (não emite
+  os eventos de comando do driver). Serve para comparar commits, não para
+  estimar o MongoDB de verdade.
+
+O resultado vai para um JSON (--saida) com o commit atual, para comparar
+execuções entre commits com --comparar.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from teste_carga import percentil
+
+# Categorias com peso (participação no catálogo), tipos de produto e marcas
+CATEGORIAS = [
+    ("Eletrônicos", 22, ["Smart TV", "Fone Bluetooth", "Caixa de Som", "Carregador"], ["Samsung", "LG", "Sony", "JBL"]),
+    ("Gamer", 14, ["Notebook Gamer", "Mouse", "Teclado Mecânico", "Headset"], ["Dell", "Logitech", "Razer", "HyperX"]),
+    ("Casa", 16, ["Air Fryer", "Liquidificador", "Aspirador", "Cafeteira"], ["Philips", "Mondial", "Electrolux", "Oster"]),
+    ("Moda", 12, ["Camiseta", "Tênis", "Jaqueta", "Mochila"], ["Nike", "Adidas", "Puma", "Hering"]),
+    ("Livros", 10, ["Romance", "Biografia", "Manual", "Coletânea"], ["Companhia", "Rocco", "Sextante", "Intrínseca"]),
+    ("Esportes", 8, ["Bicicleta", "Bola", "Halter", "Esteira"], ["Caloi", "Penalty", "Kikos", "Oxer"]),
+    ("Beleza", 8, ["Perfume", "Secador", "Hidratante", "Chapinha"], ["Natura", "Boticário", "Taiff", "Nivea"]),
+    ("Ferramentas", 6, ["Furadeira", "Parafusadeira", "Serra", "Jogo de Chaves"], ["Bosch", "Makita", "Tramontina", "Vonder"]),
+    ("Automotivo", 4, ["Pneu", "Som Automotivo", "Capa de Banco", "Aspirador Veicular"], ["Pirelli", "Pioneer", "Multilaser", "Black+Decker"]),
+]
+CORES = ["Preto", "Branco", "Prata", "Azul", "Vermelho", "Verde"]
+PREFIXO_SKU = "BEN"
+
+
+def sku_de(i: int) -> str:
+    return f"{PREFIXO_SKU}-{i:07d}"
+
+
+def gerar_catalogo(quantidade: int, semente: int = 42):
+    """Produtos sintéticos (dicts no formato do POST), sempre os mesmos para a mesma semente."""
+    rng = random.Random(semente)
+    pesos = [c[1] for c in CATEGORIAS]
+    for i in range(quantidade):
+        categoria, _, tipos, marcas = rng.choices(CATEGORIAS, weights=pesos)[0]
+        tipo, marca = rng.choice(tipos), rng.choice(marcas)
+        yield {
+            "sku": sku_de(i),
+            "nome": f"{tipo} {marca} {rng.randint(100, 9999)}",
+            "categoria": categoria,
+            # Preços concentrados nas faixas baixas, com cauda longa (como num catálogo real)
+            "preco": round(min(rng.lognormvariate(5, 1.1), 50000) + 1, 2),
+            # ~5% sem estoque
+            "estoque": 0 if rng.random() < 0.05 else int(rng.expovariate(1 / 40)),
+            "url_imagem": None,
+            "especificacoes": {
+                "marca": marca,
+                "cor": rng.choice(CORES),
+                "peso_kg": round(rng.uniform(0.1, 25), 2),
+                "garantia_meses": rng.choice([3, 6, 12, 24]),
+            },
+        }
+
+
+def em_lotes(itens, tamanho: int):
+    lote = []
+    for item in itens:
+        lote.append(item)
+        if len(lote) == tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# --- SERVIDOR (processo filho) ---
+def preparar_mongomock():
+    """Troca o MongoClient do pymongo pelo do mongomock antes de importar app.database."""
+    import mongomock
+    import mongomock.collection
+    import pymongo
+
+    pymongo.MongoClient = mongomock.MongoClient
+    # O pymongo 4.x passa argumentos (sort, namespace) que o mongomock não conhece
+    for nome in ("add_update", "add_replace", "add_delete"):
+        original = getattr(mongomock.collection.BulkOperationBuilder, nome)
+        def sem_extras(self, *args, _original=original, **kwargs):
+            kwargs.pop("sort", None)
+            kwargs.pop("namespace", None)
+            return _original(self, *args, **kwargs)
+        setattr(mongomock.collection.BulkOperationBuilder, nome, sem_extras)
+
+
+def semear_sqlite(produtos: int):
+    import main
+
+    main.init_db()
+    conn = main.pool.conexao()
+    for lote in em_lotes(gerar_catalogo(produtos), 20000):
+        with conn:
+            conn.executemany(main.SQL_INSERIR, [
+                (p["sku"], p["nome"], p["categoria"], p["preco"], p["estoque"], p["url_imagem"],
+                 json.dumps(p["especificacoes"], ensure_ascii=False))
+                for p in lote
+            ])
+    conn.execute("PRAGMA optimize")
+    return main.app
+
+
+def semear_mongo(produtos: int):
+    from fastapi import FastAPI
+    from app.database import db
+    from app.metricas import MiddlewareMetricas
+    from app.models import ProdutoSchema
+    from app.routes import router
+    from app.services import importar_lote, preparar_colecao
+
+    db.client.drop_database(db.name)
+    preparar_colecao()
+    for lote in em_lotes(gerar_catalogo(produtos), 10000):
+        importar_lote([ProdutoSchema(**p) for p in lote])
+
+    app = FastAPI()
+    app.add_middleware(MiddlewareMetricas)
+    app.include_router(router)
+    return app
+
+
+def servir(args):
+    """Semeia o catálogo, avisa o processo pai (uma linha JSON no stdout) e sobe a API."""
+    import uvicorn
+
+    os.environ["NEXUS_MODO"] = args.modo
+    if args.backend == "sqlite":
+        os.environ["NEXUS_DB"] = os.path.join(args.pasta, "benchmark.db")
+        os.environ["NEXUS_CACHE_RELATORIOS_DIR"] = os.path.join(args.pasta, "relatorios")
+    else:
+        os.environ["DATABASE_NAME"] = "nexus_benchmark"
+        os.environ["NEXUS_CACHE_RELATORIOS_DIR"] = os.path.join(args.pasta, "relatorios")
+        if args.backend == "mongomock":
+            preparar_mongomock()
+
+    inicio = time.perf_counter()
+    app = semear_sqlite(args.produtos) if args.backend == "sqlite" else semear_mongo(args.produtos)
+    print(json.dumps({"semear_s": round(time.perf_counter() - inicio, 1)}), flush=True)
+    uvicorn.run(app, host="127.0.0.1", port=args.porta, log_level="warning")
+
+
+# --- ROTAS ---
+def palavras_de_busca():
+    return sorted({tipo.split()[0] for _, _, tipos, _ in CATEGORIAS for tipo in tipos})
+
+
+def payload_aleatorio(rng: random.Random, sku: str) -> dict:
+    categoria, _, tipos, marcas = rng.choice(CATEGORIAS)
+    return {
+        "sku": sku, "nome": f"{rng.choice(tipos)} {rng.choice(marcas)}", "categoria": categoria,
+        "preco": round(rng.uniform(10, 5000), 2), "estoque": rng.randint(0, 100),
+        "especificacoes": {"cor": rng.choice(CORES)},
+    }
+
+
+def jsonl_de_importacao(rng: random.Random, produtos: int, linhas: int = 1000) -> bytes:
+    return "\n".join(
+        json.dumps(payload_aleatorio(rng, sku_de(rng.randrange(produtos))), ensure_ascii=False) for _ in range(linhas)
+    ).encode()
+
+
+def montar_rotas(produtos: int, execucao: str):
+    """
+    Rotas exercitadas, na ordem: (nome, molde da rota no /metrics, pesada, montar).
+    montar(rng, i) devolve os argumentos do httpx.request. As pesadas (exportação,
+    relatório, importação) recebem --requisicoes-pesadas requisições.
+    POST cria SKUs novos que o DELETE logo depois remove.
+    """
+    categorias = [c[0] for c in CATEGORIAS]
+    palavras = palavras_de_busca()
+    novo = lambda i: f"NOVO-{execucao}-{i}"
+    sku = lambda rng: sku_de(rng.randrange(produtos))
+
+    def atualizar(rng, i):
+        alvo = sku(rng)
+        return {"method": "PUT", "url": f"/produtos/{alvo}", "json": payload_aleatorio(rng, alvo)}
+
+    return [
+        ("GET /produtos/{sku}", "/produtos/{sku}", False,
+         lambda rng, i: {"method": "GET", "url": f"/produtos/{sku(rng)}"}),
+        ("GET /produtos/ (recentes)", "/produtos/", False,
+         lambda rng, i: {"method": "GET", "url": "/produtos/", "params": {"limite": 20}}),
+        ("GET /produtos/ (categoria + preço)", "/produtos/", False,
+         lambda rng, i: {"method": "GET", "url": "/produtos/", "params": {
+             "categoria": rng.choice(categorias), "min_preco": 50, "max_preco": 2000, "ordenar": "menor_preco", "limite": 20}}),
+        ("GET /produtos/busca", "/produtos/busca", False,
+         lambda rng, i: {"method": "GET", "url": "/produtos/busca", "params": {"q": rng.choice(palavras)}}),
+        ("GET /produtos/changes", "/produtos/changes", False,
+         lambda rng, i: {"method": "GET", "url": "/produtos/changes", "params": {"since": max(produtos - 500, 0)}}),
+        ("GET /analytics/geral", "/analytics/geral", False,
+         lambda rng, i: {"method": "GET", "url": "/analytics/geral"}),
+        ("GET /analytics/kpis", "/analytics/kpis", False,
+         lambda rng, i: {"method": "GET", "url": "/analytics/kpis"}),
+        ("GET /analytics/receita", "/analytics/receita", False,
+         lambda rng, i: {"method": "GET", "url": "/analytics/receita", "params": {"top": 10}}),
+        ("PUT /produtos/{sku}", "/produtos/{sku}", False, atualizar),
+        ("PATCH /produtos/bulk", "/produtos/bulk", False,
+         lambda rng, i: {"method": "PATCH", "url": "/produtos/bulk",
+                         "json": [{"sku": sku(rng), "estoque": rng.randint(0, 100)} for _ in range(50)]}),
+        ("POST /produtos/", "/produtos/", False,
+         lambda rng, i: {"method": "POST", "url": "/produtos/", "json": payload_aleatorio(rng, novo(i))}),
+        ("DELETE /produtos/{sku}", "/produtos/{sku}", False,
+         lambda rng, i: {"method": "DELETE", "url": f"/produtos/{novo(i)}"}),
+        ("GET /produtos/export", "/produtos/export", True,
+         lambda rng, i: {"method": "GET", "url": "/produtos/export", "params": {"formato": "ndjson"}}),
+        ("GET /relatorios/inventario.xlsx", "/relatorios/inventario.xlsx", True,
+         lambda rng, i: {"method": "GET", "url": "/relatorios/inventario.xlsx"}),
+        ("POST /produtos/bulk-import", "/produtos/bulk-import", True,
+         lambda rng, i: {"method": "POST", "url": "/produtos/bulk-import", "params": {"modo": "upsert"},
+                         "files": {"arquivo": ("lote.jsonl", jsonl_de_importacao(rng, produtos))}}),
+    ]
+
+
+# --- MEDIÇÃO ---
+def ler_pico_rss(pid: int):
+    """Pico de memória residente (VmHWM) do processo em MB; None fora do Linux."""
+    try:
+        with open(f"/proc/{pid}/status") as arquivo:
+            for linha in arquivo:
+                if linha.startswith("VmHWM:"):
+                    return round(int(linha.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def zerar_pico_rss(pid: int):
+    """Faz o VmHWM voltar ao RSS atual, para medir o pico de cada rota separadamente."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as arquivo:
+            arquivo.write("5")
+    except OSError:
+        pass
+
+
+async def tempo_no_banco(http) -> dict:
+    """{(método, rota): (segundos, requisições)} do histograma de tempo no banco do /metrics."""
+    for tentativa in range(3):
+        try:
+            texto = (await http.get("/metrics")).text
+            break
+        except httpx.HTTPError: # Conexão derrubada por um erro 500 da rota anterior
+            await asyncio.sleep(0.1)
+    else:
+        return {}
+    series = {}
+    for linha in texto.splitlines():
+        for sufixo, posicao in (("_sum", 0), ("_count", 1)):
+            prefixo = f"nexus_http_request_db_seconds{sufixo}{{"
+            if linha.startswith(prefixo):
+                rotulos, valor = linha[len(prefixo):].rsplit("} ", 1)
+                chave = tuple(par.split("=", 1)[1].strip('"') for par in rotulos.split('",')[:2])
+                series.setdefault(chave, [0.0, 0])[posicao] = float(valor)
+    return series
+
+
+async def medir_rota(http, pid: int, rota, requisicoes: int, clientes: int, semente: int) -> dict:
+    nome, molde, _, montar = rota
+    metodo = nome.split()[0]
+    rng = random.Random(semente)
+    pedidos = [montar(rng, i) for i in range(requisicoes)]
+    proximo = iter(range(requisicoes))
+    latencias, erros = [], []
+
+    async def cliente():
+        for i in proximo: # Iterador compartilhado: cada pedido sai uma vez só
+            inicio = time.perf_counter()
+            try:
+                resposta = await http.request(**pedidos[i])
+                await resposta.aread()
+            except httpx.HTTPError as erro:
+                erros.append(type(erro).__name__)
+                continue
+            if resposta.status_code >= 400:
+                erros.append(resposta.status_code)
+                continue
+            latencias.append(time.perf_counter() - inicio)
+
+    banco_antes = await tempo_no_banco(http)
+    zerar_pico_rss(pid)
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(min(clientes, requisicoes))))
+    decorrido = time.perf_counter() - inicio
+    pico = ler_pico_rss(pid)
+    banco_depois = await tempo_no_banco(http)
+
+    segundos_antes, contagem_antes = banco_antes.get((metodo, molde), (0.0, 0))
+    segundos_depois, contagem_depois = banco_depois.get((metodo, molde), (0.0, 0))
+    contagem = contagem_depois - contagem_antes
+    latencias.sort()
+    return {
+        "rota": nome,
+        "requisicoes": len(latencias) + len(erros),
+        "erros": len(erros),
+        "status_erros": sorted({str(e) for e in erros}),
+        "req_por_s": round(len(latencias) / decorrido, 1) if decorrido else None,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+        "banco_ms_medio": round((segundos_depois - segundos_antes) / contagem * 1000, 2) if contagem else None,
+        "pico_rss_mb": pico,
+    }
+
+
+async def aguardar_api(url: str, processo, limite_s: float = 60):
+    fim = time.monotonic() + limite_s
+    async with httpx.AsyncClient(base_url=url, timeout=2) as http:
+        while time.monotonic() < fim:
+            if processo.poll() is not None:
+                raise SystemExit("O servidor do benchmark terminou antes de responder")
+            try:
+                if (await http.get("/metrics")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("O servidor do benchmark não respondeu a tempo")
+
+
+async def medir_catalogo(args, produtos: int) -> dict:
+    with tempfile.TemporaryDirectory() as pasta:
+        comando = [
+            sys.executable, os.path.abspath(__file__), "servidor", "--backend", args.backend, "--modo", args.modo,
+            "--produtos", str(produtos), "--porta", str(args.porta), "--pasta", pasta,
+        ]
+        processo = subprocess.Popen(comando, stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            linha = processo.stdout.readline() # Só chega depois de semear
+            if not linha:
+                raise SystemExit("O servidor do benchmark falhou ao semear o catálogo")
+            semeadura = json.loads(linha)
+            url = f"http://127.0.0.1:{args.porta}"
+            await aguardar_api(url, processo)
+            rss_inicial = ler_pico_rss(processo.pid)
+
+            limites = httpx.Limits(max_connections=args.clientes, max_keepalive_connections=args.clientes)
+            execucao = datetime.now().strftime("%H%M%S")
+            rotas = [r for r in montar_rotas(produtos, execucao) if not args.rotas or any(f in r[0] for f in args.rotas)]
+            resultados = []
+            async with httpx.AsyncClient(base_url=url, limits=limites, timeout=args.timeout) as http:
+                for posicao, rota in enumerate(rotas):
+                    requisicoes = args.requisicoes_pesadas if rota[2] else args.requisicoes
+                    resultado = await medir_rota(http, processo.pid, rota, requisicoes, args.clientes, args.semente + posicao)
+                    if args.backend == "mongomock":
+                        resultado["banco_ms_medio"] = None # Sem eventos de comando: o /metrics marcaria 0
+                    resultados.append(resultado)
+                    print(f"  {produtos:>9} | {resultado['rota']:<36} {resultado['req_por_s']:>9} req/s  "
+                          f"p95 {resultado['p95_ms']:>9} ms  erros {resultado['erros']}", file=sys.stderr)
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+
+    return {"produtos": produtos, "semear_s": semeadura["semear_s"], "rss_apos_semear_mb": rss_inicial, "rotas": resultados}
+
+
+def commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual: dict, anterior: dict):
+    """Variação de vazão e p95 por (tamanho, rota) contra um resultado anterior."""
+    base = {(c["produtos"], r["rota"]): r for c in anterior["catalogos"] for r in c["rotas"]}
+    print(f"\nComparação com {anterior.get('commit')} ({anterior.get('data')}):")
+    for catalogo in atual["catalogos"]:
+        for rota in catalogo["rotas"]:
+            antes = base.get((catalogo["produtos"], rota["rota"]))
+            if not antes or not antes["req_por_s"] or not antes["p95_ms"]:
+                continue
+            vazao = (rota["req_por_s"] or 0) / antes["req_por_s"] * 100 - 100
+            p95 = rota["p95_ms"] / antes["p95_ms"] * 100 - 100
+            alerta = "  <- regressão" if vazao < -10 or p95 > 10 else ""
+            print(f"  {catalogo['produtos']:>9} | {rota['rota']:<36} vazão {vazao:+7.1f}%  p95 {p95:+7.1f}%{alerta}")
+
+
+def executar(args) -> dict:
+    resultado = {
+        "commit": commit_atual(),
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "backend": args.backend,
+        "modo": args.modo,
+        "clientes": args.clientes,
+        "requisicoes": args.requisicoes,
+        "requisicoes_pesadas": args.requisicoes_pesadas,
+        "catalogos": [],
+    }
+    for produtos in args.produtos:
+        print(f"Catálogo de {produtos} produtos ({args.backend}, {args.modo})", file=sys.stderr)
+        resultado["catalogos"].append(asyncio.run(medir_catalogo(args, produtos)))
+    return resultado
+
+
+def lista_de_inteiros(texto: str) -> list:
+    return [int(parte) for parte in texto.split(",") if parte.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das rotas da API Nexus")
+    parser.add_argument("papel", nargs="?", choices=["medir", "servidor"], default="medir", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", choices=["sqlite", "mongo", "mongomock"], default="sqlite")
+    parser.add_argument("--modo", choices=["sync", "async"], default="sync", help="NEXUS_MODO do servidor")
+    parser.add_argument("--produtos", type=lista_de_inteiros, default=[10000, 100000, 1000000],
+                        help="Tamanhos de catálogo separados por vírgula")
+    parser.add_argument("--clientes", type=int, default=16, help="Requisições simultâneas")
+    parser.add_argument("--requisicoes", type=int, default=2000, help="Requisições por rota")
+    parser.add_argument("--requisicoes-pesadas", type=int, default=5, help="Requisições por rota pesada (exportação, relatório, importação)")
+    parser.add_argument("--rotas", nargs="*", help="Só as rotas cujo nome contém um destes textos")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", default="benchmark_api.json")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior")
+    parser.add_argument("--pasta", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.papel == "servidor":
+        args.produtos = args.produtos[0]
+        servir(args)
+        sys.exit(0)
+
+    if args.backend == "mongomock" and args.modo == "async":
+        parser.error("o mongomock não tem cliente async: use --modo sync")
+    if args.backend == "mongomock" and args.clientes > 1:
+        print("mongomock não é thread-safe: usando 1 cliente", file=sys.stderr)
+        args.clientes = 1
+    resultado = executar(args)
+    with open(args.saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+    print(f"Resultados em {args.saida}", file=sys.stderr)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            comparar(resultado, json.load(arquivo))
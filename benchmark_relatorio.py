@@ -0,0 +1,79 @@
+"""
+Benchmark do relatório Excel (/relatorios/inventario.xlsx) no backend SQLite.
+Cria um banco temporário com N produtos, gera o relatório e mede tempo,
+pico de memória Python (tracemalloc), tamanho do arquivo e o tempo de um
+pedido servido pelo cache em disco.
+
+    python benchmark_relatorio.py --linhas 100000
+
+Imprime o resultado em JSON.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+
+def popular(caminho: str, linhas: int):
+    conn = sqlite3.connect(caminho)
+    with conn:
+        conn.executemany(
+            "INSERT INTO produtos (sku, nome, categoria, preco, estoque, url_imagem, especificacoes) VALUES (?, ?, ?, ?, ?, ?, '{}')",
+            (
+                (f"SKU-{i:07d}", f"Produto de teste {i}", f"Categoria {i % 20}", 10 + (i % 1000) * 1.5, i % 200, None)
+                for i in range(linhas)
+            )
+        )
+    conn.close()
+
+
+def medir(main, limpar=True):
+    """(segundos, caminho) de um pedido do relatório; limpar=True força a geração."""
+    if limpar:
+        main.cache_relatorios.limpar()
+    inicio = time.perf_counter()
+    resposta = main.relatorio_inventario(if_none_match=None)
+    return time.perf_counter() - inicio, resposta.path
+
+
+def executar(linhas: int):
+    with tempfile.TemporaryDirectory() as pasta:
+        os.environ["NEXUS_DB"] = os.path.join(pasta, "benchmark.db")
+        os.environ["NEXUS_CACHE_RELATORIOS_DIR"] = os.path.join(pasta, "relatorios")
+        import main # Lê NEXUS_DB na importação
+
+        main.init_db()
+        popular(main.DB_PATH, linhas)
+
+        # 1ª rodada só tempo; a 2ª com tracemalloc (que deixa tudo mais lento)
+        segundos, caminho = medir(main)
+        tamanho = os.path.getsize(caminho)
+
+        # Mesmo catálogo: sai do cache em disco
+        segundos_cache, _ = medir(main, limpar=False)
+
+        tracemalloc.start()
+        medir(main)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        main.cache_relatorios.limpar()
+        main.pool.fechar()
+
+    return {
+        "linhas": linhas,
+        "segundos": round(segundos, 2),
+        "linhas_por_s": round(linhas / segundos),
+        "segundos_cache": round(segundos_cache, 4),
+        "pico_memoria_mb": round(pico / 2**20, 1),
+        "tamanho_mb": round(tamanho / 2**20, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do relatório Excel de inventário")
+    parser.add_argument("--linhas", type=int, default=100000)
+    args = parser.parse_args()
+    print(json.dumps(executar(args.linhas), indent=2))
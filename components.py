@@ -58,8 +58,13 @@ def render_card(p):
 """
     st.markdown(html, unsafe_allow_html=True)
 
-def render_charts(df):
-    if df.empty: return
+def render_charts(receita, categorias):
+    """
+    receita: resposta do /analytics/receita (top N + "Outros");
+    categorias: resposta do /analytics/geral. O tamanho do gráfico depende
+    do N escolhido, não do catálogo.
+    """
+    if not receita or not categorias: return
     c1, c2 = st.columns([2, 1], gap="medium")
     
     # Configuração Global do Plotly (Tema Escuro)
@@ -77,44 +82,47 @@ def render_charts(df):
     )
     
     with c1:
-        st.markdown("##### 📊 Receita Estimada (Todos os Produtos)")
-        df['total'] = df['preco'] * df['estoque']
+        titulo = f"Top {len(receita['top'])}" + (f" • {receita['categoria']}" if receita["categoria"] else "")
+        st.markdown(f"##### 📊 Receita Estimada ({titulo})")
         
-        # 1. MOSTRAR TODOS (Removemos o .head() ou .nlargest())
-        # Ordenamos pelo total para que o gráfico de barras fique organizado do maior para o menor
-        all_data = df.sort_values('total', ascending=True)
+        # Do menor para o maior: no gráfico horizontal o maior fica no topo.
+        # "Outros" (o resto do catálogo somado) vai embaixo, em cinza.
+        top = sorted(receita["top"], key=lambda item: item["valor"])
+        outros = receita["outros"]
+        barras = ([{"sku": "__outros__", "nome": f"Outros ({outros['qtd_produtos']} produtos)", "valor": outros["valor"]}]
+                  if outros["qtd_produtos"] else []) + top
         
-        # 2. ALTURA DINÂMICA (Cresce conforme a quantidade de produtos)
-        # Mínimo de 350px, adiciona 35px por produto extra
-        chart_height = max(350, len(all_data) * 35 + 50)
+        # Altura proporcional ao N escolhido (limitado pela API)
+        chart_height = max(350, len(barras) * 35 + 50)
 
         fig = go.Figure(go.Bar(
-            x=all_data['total'], 
-            y=all_data['nome'], 
+            x=[b["valor"] for b in barras], 
+            y=[b["sku"] for b in barras], # SKU como chave: nomes repetidos não se fundem numa barra só
             orientation='h',
-            marker=dict(color='#3b82f6', cornerradius=4),
+            marker=dict(color=["#52525b" if b["sku"] == "__outros__" else "#3b82f6" for b in barras], cornerradius=4),
             texttemplate='  R$ %{x:,.0f}', 
             textposition='outside',
-            hovertemplate='<b>%{y}</b><br>Receita Total: R$ %{x:,.2f}<extra></extra>'
+            customdata=[b["nome"] for b in barras],
+            hovertemplate='<b>%{customdata}</b><br>Receita Total: R$ %{x:,.2f}<extra></extra>'
         ))
         
         # Ajuste do eixo X para dar espaço aos textos de valor (multiplicamos max por 1.3)
-        max_val = all_data['total'].max() if not all_data.empty else 100
+        max_val = max((b["valor"] for b in barras), default=0) or 100
         
         fig.update_layout(
             **layout_theme,
             margin=dict(l=0,r=50,t=20,b=0), 
             height=chart_height, # Aplica a altura calculada
             xaxis=dict(showgrid=False, showticklabels=False, range=[0, max_val * 1.3]),
-            yaxis=dict(showgrid=False, tickfont=dict(size=12))
+            yaxis=dict(showgrid=False, tickfont=dict(size=12), tickvals=[b["sku"] for b in barras], ticktext=[b["nome"] for b in barras])
         )
         st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
 
     with c2:
         st.markdown("##### 📦 Mix de Categorias")
         fig2 = go.Figure(go.Pie(
-            labels=df['categoria'], 
-            values=df['estoque'], 
+            labels=[c["categoria"] for c in categorias], 
+            values=[c["total_estoque"] for c in categorias], 
             hole=0.65,
             marker=dict(colors=px.colors.qualitative.Pastel),
             textinfo='none',
@@ -126,6 +134,6 @@ def render_charts(df):
             margin=dict(l=0,r=0,t=20,b=0), 
             height=350, # Altura fixa para o donut
             showlegend=False,
-            annotations=[dict(text=str(len(df)), x=0.5, y=0.5, font_size=32, showarrow=False, font_color="white", font_weight="bold")]
+            annotations=[dict(text=str(sum(c["qtd_produtos"] for c in categorias)), x=0.5, y=0.5, font_size=32, showarrow=False, font_color="white", font_weight="bold")]
         )
-        st.plotly_chart(fig2, use_container_width=True, config={'displayModeBar': False})
\ No newline at end of file
+        st.plotly_chart(fig2, use_container_width=True, config={'displayModeBar': False})
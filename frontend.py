@@ -6,8 +6,9 @@ from datetime import datetime
 
 # Imports do Projeto
 from styles import apply_theme, inject_sidebar_js
-from utils import (get_produtos, criar_produto, deletar_produto, atualizar_produto, 
-                   formatar_moeda, ProductValidator, converter_para_excel, gerar_sku_sugestao)
+from utils import (get_produtos, get_pagina_produtos, get_categorias, get_kpis, get_receita, ORDENACOES_VITRINE,
+                   criar_produto, deletar_produto, atualizar_produto, estatisticas_cliente,
+                   formatar_moeda, ProductValidator, baixar_relatorio_inventario, gerar_sku_sugestao)
 from components import render_kpi, render_card, render_charts
 
 # --- LISTA MESTRA DE CATEGORIAS ---
@@ -55,8 +56,11 @@ def abrir_modal_edicao(p):
         
         if submit:
             payload = {"sku": p['sku'], "nome": nome, "categoria": cat, "preco": preco, "estoque": estoque, "url_imagem": img}
-            if atualizar_produto(p['sku'], payload):
+            res = atualizar_produto(p['sku'], payload, p.get('versao'))
+            if res is not None and res.status_code in [200, 204]:
                 st.toast("Produto atualizado com sucesso!", icon="✅"); time.sleep(0.5); st.rerun()
+            elif res is not None and res.status_code == 412:
+                st.warning("Produto alterado por outra pessoa enquanto você editava. Reabra a edição para ver os dados atuais.")
             else:
                 st.error("Erro ao atualizar. Verifique a conexão.")
 
@@ -75,47 +79,54 @@ with st.sidebar:
         </div>
     """, unsafe_allow_html=True)
     
-    selected = option_menu(None, ["Dashboard", "Vitrine", "Novo Produto"], 
-        icons=["bar-chart-fill", "grid-fill", "plus-square-fill"], default_index=0,
+    selected = option_menu(None, ["Dashboard", "Vitrine", "Novo Produto", "Admin"], 
+        icons=["bar-chart-fill", "grid-fill", "plus-square-fill", "speedometer2"], default_index=0,
         styles={"container": {"padding": "0!important", "background": "transparent"}, "nav-link": {"font-size": "13px", "color": "#a1a1aa", "padding-left": "15px"}, "nav-link-selected": {"background": "#3b82f615", "color": "#3b82f6", "font-weight": "600", "border-left": "3px solid #3b82f6"}})
 
 # --- ROTAS ---
 
 # 1. DASHBOARD
 if selected == "Dashboard":
-    produtos = get_produtos()
-    if not produtos:
+    # Indicadores agregados pela API (/analytics/kpis): não dependem de baixar o catálogo
+    kpis = get_kpis()
+    if not kpis or not kpis["total_produtos"]:
         st.info("O sistema está pronto. Comece cadastrando produtos.")
     else:
-        df = pd.DataFrame(produtos)
-        df['preco'] = pd.to_numeric(df['preco'], errors='coerce').fillna(0)
-        df['estoque'] = pd.to_numeric(df['estoque'], errors='coerce').fillna(0)
-        
+        baixo = kpis["estoque_baixo"]
         c1, c2 = st.columns([4, 1.2])
-        with c1: st.title("Visão Geral"); st.caption(f"Dados consolidados • {len(df)} produtos ativos")
+        with c1: st.title("Visão Geral"); st.caption(f"Dados consolidados • {kpis['total_produtos']} produtos ativos • {baixo['qtd_produtos']} com estoque baixo (≤ {baixo['limite']} un)")
         with c2:
             st.markdown('<div style="height: 15px;"></div>', unsafe_allow_html=True)
-            try: st.download_button("📥 Baixar Relatório", converter_para_excel(df), f"Report_{datetime.now().strftime('%Y%m%d')}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True, type="primary")
-            except: pass
+            # A planilha é gerada na API (direto do banco); aqui só repassamos o arquivo
+            # data=callable: o relatório só é pedido à API no clique, não a cada rerun
+            st.download_button("📥 Baixar Relatório", baixar_relatorio_inventario, f"Report_{datetime.now().strftime('%Y%m%d')}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", on_click="ignore", use_container_width=True, type="primary")
         
         st.markdown("---")
         k1,k2,k3,k4 = st.columns(4)
-        with k1: render_kpi("Produtos Totais", len(df), "📦", "#3b82f6")
-        with k2: render_kpi("Valor Estoque", formatar_moeda((df['preco']*df['estoque']).sum()), "💰", "#10b981")
-        with k3: render_kpi("Ticket Médio", formatar_moeda(df['preco'].mean()), "📈", "#f59e0b")
-        with k4: render_kpi("Categorias", df['categoria'].nunique(), "🏷️", "#8b5cf6")
+        with k1: render_kpi("Produtos Totais", kpis["total_produtos"], "📦", "#3b82f6")
+        with k2: render_kpi("Valor Estoque", formatar_moeda(kpis["valor_estoque"]), "💰", "#10b981")
+        with k3: render_kpi("Ticket Médio", formatar_moeda(kpis["ticket_medio"]), "📈", "#f59e0b")
+        with k4: render_kpi("Categorias", kpis["qtd_categorias"], "🏷️", "#8b5cf6")
         
         st.markdown("<br>", unsafe_allow_html=True)
+        # Gráficos agregados pela API: top N por valor em estoque, com detalhe por categoria
+        analise = kpis["categorias"]
+        g1, g2, _ = st.columns([1, 1.5, 3])
+        with g1: top_n = st.selectbox("Top produtos", [10, 20, 50], label_visibility="collapsed")
+        with g2: cat_grafico = st.selectbox("Categoria do gráfico", ["Todas as categorias"] + sorted(c["categoria"] for c in analise), label_visibility="collapsed")
+        receita = get_receita(top_n, None if cat_grafico == "Todas as categorias" else cat_grafico)
         with st.container():
             st.markdown("""<div class="dashboard-card">""", unsafe_allow_html=True)
-            render_charts(df)
+            render_charts(receita, analise)
             st.markdown("</div>", unsafe_allow_html=True)
             
         st.markdown("<br>", unsafe_allow_html=True)
 
-        # TABELA DE ESTOQUE COMPLETA
+        # TABELA DE ESTOQUE COMPLETA (única parte que precisa do catálogo: vem da réplica local)
         st.markdown("##### 📊 Monitoramento de Estoque (Todos os Produtos)")
+        df = pd.DataFrame(get_produtos())
         if not df.empty:
+            df['estoque'] = pd.to_numeric(df['estoque'], errors='coerce').fillna(0)
             stock_df = df.sort_values('estoque')[['sku', 'nome', 'categoria', 'estoque']]
             st.dataframe(
                 stock_df,
@@ -138,48 +149,51 @@ if selected == "Dashboard":
 
 # 2. VITRINE
 elif selected == "Vitrine":
-    produtos = get_produtos()
-    if not produtos:
+    categorias = get_categorias()
+    if not categorias:
         st.warning("Nenhum produto cadastrado.")
     else:
-        df = pd.DataFrame(produtos)
-        df['preco'] = pd.to_numeric(df['preco'], errors='coerce').fillna(0)
-        
-        min_real = float(df['preco'].min())
-        max_real = float(df['preco'].max())
-        if min_real == max_real: max_real += 100.0
-
         with st.expander("🔎 Filtros & Busca", expanded=True):
-            f1, f2, f3 = st.columns([2, 1.5, 1.5], gap="medium")
+            f1, f2, f3, f4 = st.columns([2, 1.5, 1.5, 1], gap="medium")
             with f1: query = st.text_input("Buscar", placeholder="Nome ou SKU...", label_visibility="collapsed")
-            with f2: cat_sel = st.selectbox("Categoria", ["Todas"] + sorted(list(df['categoria'].unique())), label_visibility="collapsed")
-            with f3: sort_sel = st.selectbox("Ordenar", ["Recentes", "Menor Preço", "Maior Preço", "A-Z"], label_visibility="collapsed")
+            with f2: cat_sel = st.selectbox("Categoria", ["Todas"] + sorted(categorias), label_visibility="collapsed")
+            with f3: sort_sel = st.selectbox("Ordenar", list(ORDENACOES_VITRINE), label_visibility="collapsed")
+            with f4: por_pagina = st.selectbox("Por página", [12, 24, 48, 96], index=1, label_visibility="collapsed")
             
             st.markdown("<div style='height:10px'></div>", unsafe_allow_html=True)
-            st.caption("Filtrar por Faixa de Preço (R$)")
+            st.caption("Filtrar por Faixa de Preço (R$) • 0 = sem limite")
             
             p1, p2, p3 = st.columns([1, 1, 2], gap="medium")
-            with p1: min_p = st.number_input("Mínimo", value=min_real, step=10.0, label_visibility="collapsed")
-            with p2: max_p = st.number_input("Máximo", value=max_real, step=10.0, label_visibility="collapsed")
-
-        # Lógica de Filtro
-        df_show = df.copy()
-        if query: df_show = df_show[df_show['nome'].str.contains(query, case=False) | df_show['sku'].str.contains(query, case=False)]
-        if cat_sel != "Todas": df_show = df_show[df_show['categoria'] == cat_sel]
-        df_show = df_show[(df_show['preco'] >= min_p) & (df_show['preco'] <= max_p)]
-        
-        if sort_sel == "Menor Preço": df_show = df_show.sort_values('preco')
-        elif sort_sel == "Maior Preço": df_show = df_show.sort_values('preco', ascending=False)
-        elif sort_sel == "A-Z": df_show = df_show.sort_values('nome')
-        else: df_show = df_show.iloc[::-1]
+            with p1: min_p = st.number_input("Mínimo", value=0.0, min_value=0.0, step=10.0, label_visibility="collapsed")
+            with p2: max_p = st.number_input("Máximo", value=0.0, min_value=0.0, step=10.0, label_visibility="collapsed")
 
-        st.markdown(f"<div style='margin: 15px 0; color:#71717a; font-size:12px; font-weight:500;'>Encontrados: <b style='color:#f4f4f5'>{len(df_show)}</b> produtos</div>", unsafe_allow_html=True)
+        # Filtro, ordenação e paginação ficam na API: cada rerun busca e desenha
+        # só uma página, então o custo não cresce com o catálogo
+        filtros = {
+            "categoria": None if cat_sel == "Todas" else cat_sel,
+            "min_preco": min_p or None, "max_preco": max_p or None,
+            "q": query.strip() or None, "ordenar": ORDENACOES_VITRINE[sort_sel]
+        }
+        # Pilha de cursores das páginas visitadas; volta à 1ª se os filtros mudarem
+        assinatura = (tuple(filtros.items()), por_pagina)
+        if st.session_state.get("vitrine_filtros") != assinatura:
+            st.session_state.vitrine_filtros = assinatura
+            st.session_state.vitrine_cursores = [None]
+        cursores = st.session_state.vitrine_cursores
+        pagina = get_pagina_produtos(**filtros, cursor=cursores[-1], limite=por_pagina)
 
-        if df_show.empty:
+        # Total só quando sai de graça do resumo por categoria (sem preço nem busca)
+        total = None
+        if not (filtros["min_preco"] or filtros["max_preco"] or filtros["q"]):
+            total = categorias.get(cat_sel, 0) if filtros["categoria"] else sum(categorias.values())
+        encontrados = f"Encontrados: <b style='color:#f4f4f5'>{total}</b> produtos • " if total is not None else ""
+        st.markdown(f"<div style='margin: 15px 0; color:#71717a; font-size:12px; font-weight:500;'>{encontrados}Página <b style='color:#f4f4f5'>{len(cursores)}</b></div>", unsafe_allow_html=True)
+
+        if not pagina["produtos"]:
             st.info("Nenhum resultado encontrado para os filtros selecionados.")
         else:
             cols = st.columns(4)
-            for idx, row in enumerate(df_show.to_dict('records')):
+            for idx, row in enumerate(pagina["produtos"]):
                 with cols[idx % 4]:
                     render_card(row)
                     b1, b2 = st.columns(2)
@@ -190,6 +204,14 @@ elif selected == "Vitrine":
                             deletar_produto(row['sku'])
                             st.rerun()
 
+        n1, _, n2 = st.columns([1, 4, 1])
+        with n1:
+            if st.button("← Anterior", disabled=len(cursores) == 1, use_container_width=True):
+                cursores.pop(); st.rerun()
+        with n2:
+            if st.button("Próxima →", disabled=not pagina["proximo_cursor"], use_container_width=True):
+                cursores.append(pagina["proximo_cursor"]); st.rerun()
+
 # 3. NOVO PRODUTO
 elif selected == "Novo Produto":
     keys = ["f_sku", "f_nome", "f_price", "f_cost", "f_img"]
@@ -252,4 +274,25 @@ elif selected == "Novo Produto":
             "preco": val, 
             "estoque": st.session_state.f_qty, 
             "url_imagem": st.session_state.f_img
-        })
\ No newline at end of file
+        })
+
+# 4. ADMIN
+elif selected == "Admin":
+    st.markdown("### ⚙️ Latência da API")
+    st.caption("Chamadas feitas por este processo do Streamlit (últimas 500 por rota).")
+    estatisticas = estatisticas_cliente()
+    if not estatisticas:
+        st.info("Nenhuma chamada à API ainda.")
+    else:
+        st.dataframe(
+            pd.DataFrame(estatisticas),
+            column_config={
+                "rota": "Rota", "chamadas": "Chamadas", "erros": "Erros",
+                "media_ms": st.column_config.NumberColumn("Média (ms)", format="%.1f"),
+                "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+                "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+                "max_ms": st.column_config.NumberColumn("Máx (ms)", format="%.1f"),
+            },
+            hide_index=True,
+            use_container_width=True
+        )
@@ -1,30 +1,582 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Header, HTTPException, Query, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+import aiosqlite
+import asyncio
+import json
+import os
+import re
 import sqlite3
+import threading
+import time
+from functools import lru_cache
 
-app = FastAPI()
+from app.cache import TAMANHO_CACHE_SKU, TTL_CACHE_SKU, CacheLRU
+from app.categorias import nomes_da_categoria
+from app.eventos import CABECALHOS_SSE, MEDIA_TYPE_SSE, HubEventos, avisar_escrita, revisao_de_retomada
+from app.etag import cabecalhos_etag, cliente_atualizado, etag_da_versao, etag_do_produto, resposta_304, versao_do_if_match
+from app.exportacao import FORMATOS_EXPORTACAO, transmitir
+from app.importacao import (
+    ERRO_SKU_EXISTENTE, ERRO_SKU_REPETIDO, MODOS_IMPORTACAO, RelatorioImportacao, detectar_formato, ler_lotes
+)
+from app.kpis import ESTOQUE_BAIXO, montar_kpis
+from app.metricas import MEDIA_TYPE_PROMETHEUS, MiddlewareMetricas, medicao_atual, metricas
+from app.models import (
+    MAX_ITENS_LOTE, PedidoReserva, ProdutoSchema, ProdutoUpdateLote, QuantidadeReserva, ResultadoLoteResponse,
+    juntar_por_sku
+)
+from app.paginacao import ORDENACOES, codificar_cursor, decodificar_cursor
+from app.relatorios import (
+    MAX_RELATORIOS, MEDIA_TYPE_XLSX, PASTA_CACHE_RELATORIOS, CacheRelatorios, chave_relatorio, gerar_inventario, nome_relatorio
+)
+from app.reservas import (
+    CONFIRMADA, LIBERADA, PENDENTE, EstoqueInsuficiente, faltas_do_pedido, juntar_itens, nova_reserva, resposta_reserva
+)
+from app.snapshot import USAR_SNAPSHOT, SnapshotCatalogo
+
+DB_PATH = os.getenv("NEXUS_DB", "nexus.db")
+# sync (padrão): handlers "def" rodando no threadpool do Starlette.
+# async: as rotas do dia a dia viram "async def" sobre o aiosqlite (PoolConexoesAsync).
+MODO_ASYNC = os.getenv("NEXUS_MODO", "sync").lower() == "async"
+
+# --- MÉTRICAS DO BANCO ---
+@lru_cache(maxsize=1024)
+def operacao_sql(sql: str) -> str:
+    """Primeira palavra do comando (SELECT, INSERT, ...): rótulo da operação em /metrics."""
+    partes = sql.split(None, 1)
+    return partes[0].upper() if partes else "?"
+
+def medir_banco(operacao: str, medicao, funcao, *args):
+    inicio = time.perf_counter()
+    try:
+        return funcao(*args)
+    finally:
+        metricas.registrar_banco(operacao, time.perf_counter() - inicio, medicao)
+
+class CursorMedido(sqlite3.Cursor):
+    """
+    Cursor que registra o tempo de cada chamada ao SQLite em /metrics.
+    Execução e fetch* são medidos; iterar o cursor direto (exportação,
+    relatório) não, porque ali cada linha se mistura com a serialização.
+    """
+
+    operacao = "?"
+
+    def execute(self, sql, parametros=()):
+        self.operacao = operacao_sql(sql)
+        return medir_banco(self.operacao, self.connection.medicao, super().execute, sql, parametros)
+
+    def executemany(self, sql, parametros):
+        self.operacao = operacao_sql(sql)
+        return medir_banco(self.operacao, self.connection.medicao, super().executemany, sql, parametros)
+
+    def fetchone(self):
+        return medir_banco(self.operacao, self.connection.medicao, super().fetchone)
+
+    def fetchmany(self, *args):
+        return medir_banco(self.operacao, self.connection.medicao, super().fetchmany, *args)
+
+    def fetchall(self):
+        return medir_banco(self.operacao, self.connection.medicao, super().fetchall)
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão (factory do sqlite3.connect) cujos comandos passam pelo CursorMedido."""
+
+    # Medição da requisição dona da conexão. Só é preenchida no aiosqlite, que
+    # executa numa thread própria, fora do contexto da requisição; no pool sync
+    # a medição vem do contexto.
+    medicao = None
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def commit(self):
+        return medir_banco("COMMIT", self.medicao, super().commit)
+
+    def rollback(self):
+        return medir_banco("ROLLBACK", self.medicao, super().rollback)
+
+    def __exit__(self, tipo, valor, rastreio):
+        # "with conn": commit (ou rollback no erro) ao sair do bloco
+        operacao = "COMMIT" if tipo is None else "ROLLBACK"
+        return medir_banco(operacao, self.medicao, super().__exit__, tipo, valor, rastreio)
+
+# --- POOL DE CONEXÕES ---
+class PoolConexoes:
+    """
+    Mantém uma conexão SQLite por thread do worker, aberta uma única vez e
+    reaproveitada entre requisições (sem reabrir arquivo nem reler o schema).
+    """
+
+    # WAL: leitores não bloqueiam o escritor (e vice-versa).
+    # synchronous=NORMAL é seguro em WAL e evita um fsync por commit.
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -65536",     # 64 MB de cache de páginas por conexão
+        "PRAGMA mmap_size = 268435456",   # 256 MB mapeados em memória
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA busy_timeout = 5000",     # Espera até 5s por um lock em vez de falhar
+    )
+
+    def __init__(self, caminho: str, statements_em_cache: int = 256):
+        self.caminho = caminho
+        # O sqlite3 guarda os statements já preparados por SQL idêntico
+        self.statements_em_cache = statements_em_cache
+        self._local = threading.local()
+        self._conexoes = []
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        conn = sqlite3.connect(
+            self.caminho,
+            check_same_thread=False, # O fechamento acontece na thread do lifespan
+            cached_statements=self.statements_em_cache,
+            factory=ConexaoMedida,
+        )
+        conn.row_factory = sqlite3.Row # Para acessar colunas pelo nome
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def conexao(self):
+        """Retorna a conexão da thread atual, abrindo-a na primeira chamada."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._abrir()
+            self._local.conn = conn
+            with self._lock:
+                self._conexoes.append(conn)
+        return conn
+
+    def fechar(self):
+        """Fecha todas as conexões abertas (chamado no desligamento da API)."""
+        with self._lock:
+            for conn in self._conexoes:
+                conn.close()
+            self._conexoes.clear()
+            # Threads que voltarem a pedir conexão recebem uma nova
+            self._local = threading.local()
+
+pool = PoolConexoes(DB_PATH)
+
+class PoolConexoesAsync:
+    """
+    Conexões aiosqlite para os handlers async. Cada conexão aiosqlite tem uma
+    thread própria executando o SQLite, então o event loop não fica parado
+    esperando o banco. Abertas no lifespan e emprestadas por requisição.
+    """
+
+    def __init__(self, caminho: str, tamanho: int = 8, statements_em_cache: int = 256):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.statements_em_cache = statements_em_cache
+        self._conexoes = []
+        self._livres = None
+        self._sqlite = {} # conexão aiosqlite -> ConexaoMedida por baixo dela
+
+    async def abrir(self):
+        self._livres = asyncio.Queue()
+        for _ in range(self.tamanho):
+            criada = []
+            def fabrica(*args, **kwargs):
+                criada.append(ConexaoMedida(*args, **kwargs))
+                return criada[0]
+            conn = await aiosqlite.connect(self.caminho, cached_statements=self.statements_em_cache, factory=fabrica)
+            conn.row_factory = sqlite3.Row
+            for pragma in PoolConexoes.PRAGMAS:
+                await conn.execute(pragma)
+            self._conexoes.append(conn)
+            self._sqlite[conn] = criada[0]
+            self._livres.put_nowait(conn)
+
+    @asynccontextmanager
+    async def conexao(self):
+        """Empresta uma conexão livre (espera na fila se todas estiverem em uso)."""
+        conn = await self._livres.get()
+        # O tempo no banco enquanto a conexão está emprestada é desta requisição
+        medida = self._sqlite[conn]
+        medida.medicao = medicao_atual.get()
+        try:
+            yield conn
+        finally:
+            medida.medicao = None
+            self._livres.put_nowait(conn)
+
+    @asynccontextmanager
+    async def transacao(self):
+        """Equivalente ao "with conn" do sqlite3: commit ao final ou rollback no erro."""
+        async with self.conexao() as conn:
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+
+    async def fechar(self):
+        for conn in self._conexoes:
+            await conn.close()
+        self._conexoes.clear()
+        self._sqlite.clear()
+
+pool_async = PoolConexoesAsync(DB_PATH, int(os.getenv("NEXUS_POOL_ASYNC", "8")))
 
 # --- CONFIGURAÇÃO DO BANCO DE DADOS ---
 def init_db():
-    conn = sqlite3.connect('nexus.db')
-    cursor = conn.cursor()
+    conn = pool.conexao()
     # Cria a tabela se não existir
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS produtos (
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS produtos (
+                sku TEXT PRIMARY KEY,
+                nome TEXT NOT NULL,
+                categoria TEXT,
+                preco REAL NOT NULL,
+                estoque INTEGER NOT NULL,
+                url_imagem TEXT,
+                especificacoes TEXT NOT NULL DEFAULT '{}',
+                revisao INTEGER NOT NULL DEFAULT 0,
+                atualizado_em TEXT,
+                versao INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        # Bancos criados antes da coluna de especificações (JSON em texto)
+        colunas = {row["name"] for row in conn.execute("PRAGMA table_info(produtos)")}
+        if "especificacoes" not in colunas:
+            conn.execute("ALTER TABLE produtos ADD COLUMN especificacoes TEXT NOT NULL DEFAULT '{}'")
+        # Versão de cada produto para as escritas condicionais (If-Match)
+        if "versao" not in colunas:
+            conn.execute("ALTER TABLE produtos ADD COLUMN versao INTEGER NOT NULL DEFAULT 1")
+        # Índices que sustentam os filtros e ordenações da listagem.
+        # O sku no final serve de desempate para a paginação por cursor;
+        # só (categoria) já vem ordenado pelo rowid, que atende "recentes".
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_categoria ON produtos (categoria)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_categoria_preco ON produtos (categoria, preco, sku)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_preco ON produtos (preco, sku)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_nome ON produtos (nome, sku)")
+        # Maiores valores em estoque (/analytics/receita): índice na própria expressão,
+        # o ORDER BY precisa usar exatamente "preco * estoque" para aproveitá-lo
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_valor ON produtos (preco * estoque)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_categoria_valor ON produtos (categoria, preco * estoque)")
+        # Estoque baixo (/analytics/kpis): só a faixa estoque <= limite é lida, sem ir à tabela
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_estoque ON produtos (estoque, categoria)")
+        init_busca(conn)
+        init_resumo(conn)
+        init_versao(conn)
+        init_reservas(conn)
+
+def init_busca(conn):
+    """
+    Índice de texto (FTS5) sobre nome/sku/categoria/especificações.
+    É uma tabela de conteúdo externo: guarda só o índice invertido e lê o
+    texto da própria tabela produtos. Os triggers mantêm os dois em sincronia.
+    """
+    ja_existia = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'produtos_fts'"
+    ).fetchone()
+    # remove_diacritics: "eletronico" encontra "Eletrônico" (dados em português)
+    # prefix: índices extras para buscas por prefixo de 2 e 3 letras
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+            sku, nome, categoria, especificacoes,
+            content = 'produtos', content_rowid = 'rowid',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS produtos_fts_ai AFTER INSERT ON produtos BEGIN
+            INSERT INTO produtos_fts (rowid, sku, nome, categoria, especificacoes)
+            VALUES (new.rowid, new.sku, new.nome, new.categoria, new.especificacoes);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS produtos_fts_ad AFTER DELETE ON produtos BEGIN
+            INSERT INTO produtos_fts (produtos_fts, rowid, sku, nome, categoria, especificacoes)
+            VALUES ('delete', old.rowid, old.sku, old.nome, old.categoria, old.especificacoes);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS produtos_fts_au AFTER UPDATE OF sku, nome, categoria, especificacoes ON produtos
+        WHEN old.sku IS NOT new.sku OR old.nome IS NOT new.nome
+          OR old.categoria IS NOT new.categoria OR old.especificacoes IS NOT new.especificacoes
+        BEGIN
+            INSERT INTO produtos_fts (produtos_fts, rowid, sku, nome, categoria, especificacoes)
+            VALUES ('delete', old.rowid, old.sku, old.nome, old.categoria, old.especificacoes);
+            INSERT INTO produtos_fts (rowid, sku, nome, categoria, especificacoes)
+            VALUES (new.rowid, new.sku, new.nome, new.categoria, new.especificacoes);
+        END
+    """)
+    if not ja_existia:
+        # Indexa o que já estava no banco e fixa o ranking bm25 com pesos por coluna
+        # (sku e nome valem mais que categoria e especificações)
+        conn.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO produtos_fts (produtos_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')")
+
+# Momento da escrita em UTC (ISO 8601), calculado pelo próprio SQLite
+AGORA_SQL = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+def init_versao(conn):
+    """
+    Versão do catálogo: um contador que sobe a cada linha inserida, alterada ou
+    removida (triggers, na mesma transação da escrita). Vira o ETag das leituras.
+    Cada produto guarda a versão da sua última escrita (revisao) e cada remoção
+    deixa uma lápide em produtos_removidos: juntos formam o feed /produtos/changes.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo_versao (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO catalogo_versao VALUES (1, 0)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS produtos_removidos (
             sku TEXT PRIMARY KEY,
-            nome TEXT NOT NULL,
-            categoria TEXT,
-            preco REAL NOT NULL,
-            estoque INTEGER NOT NULL,
-            url_imagem TEXT
+            revisao INTEGER NOT NULL,
+            removido_em TEXT NOT NULL
         )
-    ''')
-    conn.commit()
-    conn.close()
+    """)
+    # Triggers da versão anterior, que só contavam as escritas
+    for antigo in ("versao_ai", "versao_ad", "versao_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {antigo}")
+
+    # Bancos anteriores à revisão: cada produto recebe uma revisão única (pela
+    # ordem de inserção) e a versão do catálogo passa a cobrir todas elas
+    colunas = {row["name"] for row in conn.execute("PRAGMA table_info(produtos)")}
+    if "revisao" not in colunas:
+        conn.execute("ALTER TABLE produtos ADD COLUMN revisao INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE produtos ADD COLUMN atualizado_em TEXT")
+        conn.execute("UPDATE produtos SET revisao = rowid")
+    conn.execute("""
+        UPDATE catalogo_versao SET versao = MAX(versao, (SELECT IFNULL(MAX(revisao), 0) FROM produtos))
+        WHERE id = 1
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_produtos_revisao ON produtos (revisao)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_removidos_revisao ON produtos_removidos (revisao)")
+
+    # O UPDATE de revisao dentro dos triggers não dispara nenhum "UPDATE OF" (revisao não está nas listas)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS revisao_ai AFTER INSERT ON produtos BEGIN
+            UPDATE catalogo_versao SET versao = versao + 1 WHERE id = 1;
+            UPDATE produtos SET revisao = (SELECT versao FROM catalogo_versao WHERE id = 1),
+                                atualizado_em = {AGORA_SQL}
+            WHERE rowid = new.rowid;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS revisao_au AFTER UPDATE OF nome, categoria, preco, estoque, url_imagem, especificacoes ON produtos
+        WHEN old.nome IS NOT new.nome OR old.categoria IS NOT new.categoria OR old.preco IS NOT new.preco
+          OR old.estoque IS NOT new.estoque OR old.url_imagem IS NOT new.url_imagem
+          OR old.especificacoes IS NOT new.especificacoes
+        BEGIN
+            UPDATE catalogo_versao SET versao = versao + 1 WHERE id = 1;
+            UPDATE produtos SET revisao = (SELECT versao FROM catalogo_versao WHERE id = 1),
+                                atualizado_em = {AGORA_SQL}
+            WHERE rowid = new.rowid;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS revisao_ad AFTER DELETE ON produtos BEGIN
+            UPDATE catalogo_versao SET versao = versao + 1 WHERE id = 1;
+            INSERT OR REPLACE INTO produtos_removidos (sku, revisao, removido_em)
+            VALUES (old.sku, (SELECT versao FROM catalogo_versao WHERE id = 1), {AGORA_SQL});
+        END
+    """)
+
+def init_reservas(conn):
+    """
+    Reservas de estoque: o estoque é baixado na hora da reserva e a linha
+    guarda o pedido ({sku: quantidade} em JSON) para confirmar ou devolver depois.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS reservas (
+            id TEXT PRIMARY KEY,
+            itens TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT '{PENDENTE}',
+            criada_em TEXT NOT NULL DEFAULT ({AGORA_SQL}),
+            finalizada_em TEXT
+        )
+    """)
+
+SQL_VERSAO = "SELECT versao FROM catalogo_versao WHERE id = 1"
+
+# Resumo por categoria a partir de produtos; usado na reconstrução e na verificação
+SQL_AGREGAR_CATEGORIAS = """
+    SELECT IFNULL(categoria, '') AS categoria,
+           COUNT(*) AS qtd_produtos,
+           SUM(preco) AS soma_preco,
+           SUM(estoque) AS total_estoque,
+           SUM(preco * estoque) AS valor_estoque
+    FROM produtos GROUP BY IFNULL(categoria, '')
+"""
+
+def init_resumo(conn):
+    """
+    Tabela com os totais de cada categoria, mantida por triggers na mesma
+    transação de cada escrita em produtos. Os relatórios leem daqui em vez
+    de agrupar o catálogo inteiro: o custo passa a depender do nº de categorias.
+    """
+    ja_existia = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'resumo_categorias'"
+    ).fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_categorias (
+            categoria TEXT PRIMARY KEY,
+            qtd_produtos INTEGER NOT NULL,
+            soma_preco REAL NOT NULL,
+            total_estoque INTEGER NOT NULL,
+            valor_estoque REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS resumo_ai AFTER INSERT ON produtos BEGIN
+            INSERT INTO resumo_categorias VALUES (IFNULL(new.categoria, ''), 1, new.preco, new.estoque, new.preco * new.estoque)
+            ON CONFLICT(categoria) DO UPDATE SET
+                qtd_produtos = qtd_produtos + 1,
+                soma_preco = soma_preco + excluded.soma_preco,
+                total_estoque = total_estoque + excluded.total_estoque,
+                valor_estoque = valor_estoque + excluded.valor_estoque;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS resumo_ad AFTER DELETE ON produtos BEGIN
+            UPDATE resumo_categorias SET
+                qtd_produtos = qtd_produtos - 1,
+                soma_preco = soma_preco - old.preco,
+                total_estoque = total_estoque - old.estoque,
+                valor_estoque = valor_estoque - old.preco * old.estoque
+            WHERE categoria = IFNULL(old.categoria, '');
+            DELETE FROM resumo_categorias WHERE categoria = IFNULL(old.categoria, '') AND qtd_produtos <= 0;
+        END
+    """)
+    # Atualização = tira o produto antigo do resumo e soma o novo
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS resumo_au AFTER UPDATE OF categoria, preco, estoque ON produtos
+        WHEN old.categoria IS NOT new.categoria OR old.preco IS NOT new.preco OR old.estoque IS NOT new.estoque
+        BEGIN
+            UPDATE resumo_categorias SET
+                qtd_produtos = qtd_produtos - 1,
+                soma_preco = soma_preco - old.preco,
+                total_estoque = total_estoque - old.estoque,
+                valor_estoque = valor_estoque - old.preco * old.estoque
+            WHERE categoria = IFNULL(old.categoria, '');
+            DELETE FROM resumo_categorias WHERE categoria = IFNULL(old.categoria, '') AND qtd_produtos <= 0;
+            INSERT INTO resumo_categorias VALUES (IFNULL(new.categoria, ''), 1, new.preco, new.estoque, new.preco * new.estoque)
+            ON CONFLICT(categoria) DO UPDATE SET
+                qtd_produtos = qtd_produtos + 1,
+                soma_preco = soma_preco + excluded.soma_preco,
+                total_estoque = total_estoque + excluded.total_estoque,
+                valor_estoque = valor_estoque + excluded.valor_estoque;
+        END
+    """)
+    if not ja_existia:
+        reconstruir_resumo(conn)
+
+def reconstruir_resumo(conn):
+    """Recalcula o resumo inteiro a partir de produtos. Retorna o nº de categorias."""
+    conn.execute("DELETE FROM resumo_categorias")
+    conn.execute(f"INSERT INTO resumo_categorias {SQL_AGREGAR_CATEGORIAS}")
+    return conn.execute("SELECT COUNT(*) FROM resumo_categorias").fetchone()[0]
+
+def verificar_resumo(conn, tolerancia: float = 0.01):
+    """
+    Compara o resumo materializado com a agregação completa de produtos.
+    Retorna a lista de categorias divergentes (vazia quando está tudo certo).
+    """
+    esperado = {row["categoria"]: dict(row) for row in conn.execute(SQL_AGREGAR_CATEGORIAS)}
+    atual = {row["categoria"]: dict(row) for row in conn.execute("SELECT * FROM resumo_categorias")}
+
+    divergencias = []
+    for categoria in sorted(set(esperado) | set(atual)):
+        e, a = esperado.get(categoria), atual.get(categoria)
+        # Somas de preço em ponto flutuante podem acumular erro de arredondamento
+        if e is None or a is None or any(abs(e[c] - a[c]) > tolerancia for c in e if c != "categoria"):
+            divergencias.append({"categoria": categoria, "esperado": e, "materializado": a})
+    return divergencias
+
+# --- SNAPSHOT COLUNAR (NEXUS_SNAPSHOT=1) ---
+# Mudanças depois de uma revisão, para o snapshot em memória: produtos gravados
+# e lápides num SELECT só (uma leitura consistente), em ordem de revisão
+SQL_SNAPSHOT_MUDANCAS = """
+    SELECT revisao, rowid, sku, nome, categoria, preco, estoque FROM produtos WHERE revisao > :desde
+    UNION ALL
+    SELECT revisao, NULL, sku, NULL, NULL, NULL, NULL FROM produtos_removidos WHERE revisao > :desde
+    ORDER BY revisao
+"""
 
-# Inicializa o banco ao ligar
-init_db()
+# Filtros, ordenações e agregados da listagem e dos analytics saem daqui
+# quando ligado; o banco segue como fonte da verdade
+snapshot = SnapshotCatalogo() if USAR_SNAPSHOT else None
+
+def versao_para_snapshot(versao: int) -> int:
+    """Revisão a partir da qual sincronizar (0 recarrega tudo: banco recriado)."""
+    if versao < snapshot.revisao:
+        snapshot.limpar()
+    return snapshot.revisao
+
+def sincronizar_snapshot(conn, versao: int = None):
+    """
+    Traz para o snapshot as escritas feitas depois da última sincronização,
+    deste ou de outro processo. A versão é lida antes das mudanças: o que
+    entrar no meio é aplicado de novo na próxima vez, sem efeito colateral.
+    """
+    if snapshot is None:
+        return
+    if versao is None:
+        versao = conn.execute(SQL_VERSAO).fetchone()[0]
+    if versao == snapshot.revisao:
+        return
+    desde = versao_para_snapshot(versao)
+    snapshot.aplicar(conn.execute(SQL_SNAPSHOT_MUDANCAS, {"desde": desde}).fetchall(), versao)
+
+async def sincronizar_snapshot_async(conn, versao: int = None):
+    if snapshot is None:
+        return
+    if versao is None:
+        versao = (await conn.execute_fetchall(SQL_VERSAO))[0][0]
+    if versao == snapshot.revisao:
+        return
+    desde = versao_para_snapshot(versao)
+    snapshot.aplicar(await conn.execute_fetchall(SQL_SNAPSHOT_MUDANCAS, {"desde": desde}), versao)
+
+def apos_escrita(conn):
+    """Depois do commit de toda escrita: snapshot em dia e aviso ao hub do /eventos."""
+    sincronizar_snapshot(conn)
+    avisar_escrita()
+
+async def apos_escrita_async():
+    """Handlers async: a conexão da escrita já voltou ao pool; empresta outra."""
+    avisar_escrita()
+    if snapshot is not None:
+        async with pool_async.conexao() as conn:
+            await sincronizar_snapshot_async(conn)
+
+# Abre o pool e inicializa o banco ao ligar; fecha as conexões ao desligar
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    sincronizar_snapshot(pool.conexao()) # Carga inicial (catálogo inteiro)
+    if MODO_ASYNC:
+        await pool_async.abrir()
+    await hub_eventos.iniciar()
+    yield
+    await hub_eventos.parar()
+    if MODO_ASYNC:
+        await pool_async.fechar()
+    pool.fechar()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MiddlewareMetricas)
 
 # --- MODELOS (Pydantic) ---
 class Produto(BaseModel):
@@ -34,78 +586,1111 @@ class Produto(BaseModel):
     preco: float
     estoque: int
     url_imagem: Optional[str] = None
+    especificacoes: Optional[Dict[str, Any]] = None # None no PUT mantém as atuais
+
+# Produto como sai nas leituras: com a revisão da última escrita e a versão
+# do produto (conta as alterações; é o valor que vai no If-Match)
+class ProdutoLido(Produto):
+    revisao: int = 0
+    atualizado_em: Optional[str] = None
+    versao: int = 1
+
+COLUNAS = "sku, nome, categoria, preco, estoque, url_imagem, especificacoes"
+# Leituras trazem também a revisão (preenchida pelos triggers, nunca pelo cliente)
+COLUNAS_LEITURA = COLUNAS + ", revisao, atualizado_em, versao"
+SQL_INSERIR = f"INSERT INTO produtos ({COLUNAS}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+def valores_produto(produto):
+    """Tupla na ordem de COLUNAS, com as especificações serializadas em JSON."""
+    return (produto.sku, produto.nome, produto.categoria, produto.preco, produto.estoque,
+            produto.url_imagem, json.dumps(produto.especificacoes or {}, ensure_ascii=False))
+
+def linha_para_produto(row):
+    """Converte uma linha do banco no formato JSON da API (sem o rowid interno)."""
+    produto = {k: row[k] for k in row.keys() if k != "rowid"}
+    produto["especificacoes"] = json.loads(produto.get("especificacoes") or "{}")
+    return produto
+
+def expressao_busca(texto: str) -> str:
+    """
+    Converte o texto digitado em uma consulta FTS5 por prefixo:
+    'note dell' -> '"note"* "dell"*' (todos os termos, cada um como prefixo).
+    As aspas neutralizam operadores do FTS5 digitados pelo usuário.
+    """
+    termos = re.findall(r"\w+", texto)
+    return " ".join(f'"{termo}"*' for termo in termos)
+
+# Ordenação -> (coluna, direção). "recentes" segue a ordem de inserção (rowid).
+ORDENACOES_SQL = {
+    "recentes": ("rowid", "DESC"),
+    "menor_preco": ("preco", "ASC"),
+    "maior_preco": ("preco", "DESC"),
+    "nome": ("nome", "ASC"),
+}
+
+# Filtro de categoria sem diferenciar maiúsculas/acentos, como o Mongo: a
+# categoria pedida vira os nomes gravados equivalentes (o resumo tem um por
+# categoria) e a consulta segue com "categoria = ?" no índice de sempre. Só
+# com grafias diferentes gravadas vira um IN (e a ordem sai de um sort)
+SQL_NOMES_CATEGORIAS = "SELECT categoria FROM resumo_categorias"
+
+def categorias_do_filtro(conn, categoria):
+    """Nomes gravados equivalentes à categoria pedida (None sem filtro)."""
+    if not categoria:
+        return None
+    return nomes_da_categoria(categoria, [row[0] for row in conn.execute(SQL_NOMES_CATEGORIAS)])
+
+async def categorias_do_filtro_async(conn, categoria):
+    if not categoria:
+        return None
+    return nomes_da_categoria(categoria, [row[0] for row in await conn.execute_fetchall(SQL_NOMES_CATEGORIAS)])
+
+def condicao_categoria(categorias, coluna="categoria"):
+    """(condição, params) do filtro: igualdade com um nome (o caso comum), IN com vários."""
+    if len(categorias) == 1:
+        return f"{coluna} = ?", list(categorias)
+    return f"{coluna} IN ({', '.join('?' * len(categorias))})", list(categorias)
+
+def montar_consulta_produtos(categorias=None, min_preco=None, max_preco=None, q=None,
+                             ordenar="recentes", cursor=None, limite=None):
+    """
+    Monta o SELECT da listagem com filtros e paginação por cursor (keyset).
+    Em vez de OFFSET, a página seguinte começa depois da chave do último item,
+    então o custo depende do tamanho da página e não da profundidade.
+    `categorias` vem de categorias_do_filtro.
+    """
+    coluna, direcao = ORDENACOES_SQL[ordenar]
+    comparador = "<" if direcao == "DESC" else ">"
+    condicoes, params = [], []
+
+    if categorias:
+        condicao, valores = condicao_categoria(categorias)
+        condicoes.append(condicao)
+        params.extend(valores)
+    if min_preco is not None:
+        condicoes.append("preco >= ?")
+        params.append(min_preco)
+    if max_preco is not None:
+        condicoes.append("preco <= ?")
+        params.append(max_preco)
+    if q and expressao_busca(q):
+        # Busca textual pelo índice FTS5 (prefixo, sem acentos)
+        condicoes.append("rowid IN (SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ?)")
+        params.append(expressao_busca(q))
+
+    if cursor:
+        chave = decodificar_cursor(cursor, ordenar)
+        if coluna == "rowid":
+            condicoes.append(f"rowid {comparador} ?")
+            params.append(chave[0])
+        else:
+            # Comparação de tupla: (valor, sku) depois do último item visto
+            condicoes.append(f"({coluna}, sku) {comparador} (?, ?)")
+            params.extend(chave[:2])
+
+    sql = f"SELECT rowid, {COLUNAS_LEITURA} FROM produtos"
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    if coluna == "rowid":
+        sql += f" ORDER BY rowid {direcao}"
+    else:
+        sql += f" ORDER BY {coluna} {direcao}, sku {direcao}"
+    if limite is not None:
+        sql += " LIMIT ?"
+        params.append(limite)
+    return sql, params
+
+def chave_cursor(row, ordenar):
+    """Chave do item usada para gerar o cursor da próxima página."""
+    coluna, _ = ORDENACOES_SQL[ordenar]
+    if coluna == "rowid":
+        return [row["rowid"]]
+    return [row[coluna], row["sku"]]
 
 # --- ROTAS DA API ---
 
-@app.get("/produtos/", response_model=dict)
-def listar_produtos():
-    conn = sqlite3.connect('nexus.db')
-    conn.row_factory = sqlite3.Row # Para acessar colunas pelo nome
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM produtos")
-    dados = cursor.fetchall()
-    conn.close()
-    
+def consulta_listagem(categorias, min_preco, max_preco, q, ordenar, cursor, limite):
+    """Valida os parâmetros da listagem e devolve (sql, params)."""
+    if ordenar not in ORDENACOES:
+        raise HTTPException(status_code=400, detail="Ordenação inválida")
+    try:
+        # Busca um item a mais só para saber se existe próxima página
+        return montar_consulta_produtos(categorias, min_preco, max_preco, q, ordenar, cursor, limite + 1)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+
+def pagina_de_produtos(dados, limite, ordenar):
+    tem_mais = len(dados) > limite
+    dados = dados[:limite]
+    proximo_cursor = codificar_cursor(chave_cursor(dados[-1], ordenar)) if tem_mais else None
+
     # Converte os dados do banco para o formato JSON
-    produtos = [dict(row) for row in dados]
-    return {"produtos": produtos}
-
-@app.get("/produtos/{sku}", response_model=Produto)
-def obter_produto(sku: str):
-    conn = sqlite3.connect('nexus.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM produtos WHERE sku = ?", (sku,))
-    dado = cursor.fetchone()
-    conn.close()
-    
-    if dado:
-        return dict(dado)
-    raise HTTPException(status_code=404, detail="Produto não encontrado")
+    produtos = [linha_para_produto(row) for row in dados]
+    return {"produtos": produtos, "proximo_cursor": proximo_cursor, "limite": limite}
+
+# Com o snapshot, a página (filtros, ordem e cursor) sai das colunas em memória
+# e o banco só entrega as linhas completas pela chave primária
+SQL_POR_ROWID = f"SELECT rowid, {COLUNAS_LEITURA} FROM produtos WHERE rowid IN (SELECT value FROM json_each(?))"
+
+def listagem_pelo_snapshot(q) -> bool:
+    # A busca textual depende do índice FTS5: essa continua no banco
+    return snapshot is not None and not (q and expressao_busca(q))
+
+def pagina_do_snapshot(categorias, min_preco, max_preco, ordenar, cursor, limite):
+    """rowids da página (com um item a mais, como a consulta) e o JSON para buscá-los."""
+    chave = decodificar_cursor(cursor, ordenar) if cursor else None # Já validado por consulta_listagem
+    rowids = snapshot.pagina(categorias, min_preco, max_preco, ordenar, chave, limite + 1)
+    return rowids, json.dumps(rowids)
+
+def linhas_na_ordem(dados, rowids):
+    """Linhas lidas por rowid, na ordem do snapshot (removidas nesse meio-tempo ficam de fora)."""
+    por_rowid = {row["rowid"]: row for row in dados}
+    return [por_rowid[rowid] for rowid in rowids if rowid in por_rowid]
+
+# Rotas do dia a dia têm duas versões: "def" (NEXUS_MODO=sync) e "async def"
+# (NEXUS_MODO=async). Só a registrada no app atende; a regra é a mesma nas duas.
+
+def listar_produtos(
+    response: Response,
+    categoria: str = Query(None, description="Filtrar por categoria"),
+    min_preco: float = Query(None, description="Preço mínimo"),
+    max_preco: float = Query(None, description="Preço máximo"),
+    q: str = Query(None, description="Busca por nome, SKU, categoria ou especificações"),
+    ordenar: str = Query("recentes", description=f"Uma de: {', '.join(ORDENACOES)}"),
+    cursor: str = Query(None, description="Token 'proximo_cursor' da página anterior"),
+    limite: int = Query(100, ge=1, le=1000, description="Itens por página (Max 1000)"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Lista produtos com filtros e paginação por cursor.
+    Exemplo: /produtos/?categoria=Gamer&ordenar=menor_preco&limite=20
+    Com If-None-Match igual ao ETag atual responde 304 sem consultar os produtos.
+    """
+    conn = pool.conexao()
+    categorias = categorias_do_filtro(conn, categoria)
+    sql, params = consulta_listagem(categorias, min_preco, max_preco, q, ordenar, cursor, limite)
+    # A versão é lida antes dos dados: se mudar no meio, o ETag fica "velho" e o
+    # cliente só baixa de novo na próxima vez (nunca guarda dado novo com ETag antigo)
+    versao = conn.execute(SQL_VERSAO).fetchone()[0]
+    etag = etag_da_versao(versao)
+    if cliente_atualizado(if_none_match, etag):
+        return resposta_304(etag)
+    if listagem_pelo_snapshot(q):
+        sincronizar_snapshot(conn, versao)
+        rowids, lista = pagina_do_snapshot(categorias, min_preco, max_preco, ordenar, cursor, limite)
+        dados = linhas_na_ordem(conn.execute(SQL_POR_ROWID, (lista,)).fetchall(), rowids)
+    else:
+        dados = conn.execute(sql, params).fetchall()
+    response.headers.update(cabecalhos_etag(etag))
+    return pagina_de_produtos(dados, limite, ordenar)
+
+async def listar_produtos_async(
+    response: Response,
+    categoria: str = Query(None, description="Filtrar por categoria"),
+    min_preco: float = Query(None, description="Preço mínimo"),
+    max_preco: float = Query(None, description="Preço máximo"),
+    q: str = Query(None, description="Busca por nome, SKU, categoria ou especificações"),
+    ordenar: str = Query("recentes", description=f"Uma de: {', '.join(ORDENACOES)}"),
+    cursor: str = Query(None, description="Token 'proximo_cursor' da página anterior"),
+    limite: int = Query(100, ge=1, le=1000, description="Itens por página (Max 1000)"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Lista produtos com filtros e paginação por cursor.
+    Exemplo: /produtos/?categoria=Gamer&ordenar=menor_preco&limite=20
+    Com If-None-Match igual ao ETag atual responde 304 sem consultar os produtos.
+    """
+    async with pool_async.conexao() as conn:
+        categorias = await categorias_do_filtro_async(conn, categoria)
+        sql, params = consulta_listagem(categorias, min_preco, max_preco, q, ordenar, cursor, limite)
+        versao = (await conn.execute_fetchall(SQL_VERSAO))[0][0]
+        etag = etag_da_versao(versao)
+        if cliente_atualizado(if_none_match, etag):
+            return resposta_304(etag)
+        if listagem_pelo_snapshot(q):
+            await sincronizar_snapshot_async(conn, versao)
+            rowids, lista = pagina_do_snapshot(categorias, min_preco, max_preco, ordenar, cursor, limite)
+            dados = linhas_na_ordem(await conn.execute_fetchall(SQL_POR_ROWID, (lista,)), rowids)
+        else:
+            dados = await conn.execute_fetchall(sql, params)
+    response.headers.update(cabecalhos_etag(etag))
+    return pagina_de_produtos(list(dados), limite, ordenar)
+
+app.get("/produtos/", response_model=dict)(listar_produtos_async if MODO_ASYNC else listar_produtos)
+
+def lotes_exportacao(filtros: dict, ordenar: str, tamanho_lote: int):
+    """
+    Percorre o resultado em lotes de tamanho fixo usando o mesmo cursor da listagem.
+    Cada lote é uma consulta curta: nenhum cursor do SQLite fica aberto entre
+    um envio e outro, e a memória usada é a de um lote.
+    """
+    cursor = None
+    while True:
+        sql, params = montar_consulta_produtos(**filtros, ordenar=ordenar, cursor=cursor, limite=tamanho_lote)
+        dados = pool.conexao().execute(sql, params).fetchall()
+        if not dados:
+            return
+        yield [linha_para_produto(row) for row in dados]
+        if len(dados) < tamanho_lote:
+            return
+        cursor = codificar_cursor(chave_cursor(dados[-1], ordenar))
+
+@app.get("/produtos/export")
+def exportar_produtos(
+    formato: str = Query("ndjson", description="ndjson ou csv"),
+    categoria: str = Query(None, description="Filtrar por categoria"),
+    min_preco: float = Query(None, description="Preço mínimo"),
+    max_preco: float = Query(None, description="Preço máximo"),
+    q: str = Query(None, description="Busca por nome, SKU, categoria ou especificações"),
+    ordenar: str = Query("recentes", description=f"Uma de: {', '.join(ORDENACOES)}"),
+    tamanho_lote: int = Query(1000, ge=1, le=10000, description="Linhas lidas por consulta")
+):
+    """Exporta o catálogo (com os mesmos filtros da listagem) em streaming."""
+    if formato not in FORMATOS_EXPORTACAO:
+        raise HTTPException(status_code=400, detail="Formato inválido")
+    if ordenar not in ORDENACOES:
+        raise HTTPException(status_code=400, detail="Ordenação inválida")
+
+    categorias = categorias_do_filtro(pool.conexao(), categoria)
+    filtros = {"categorias": categorias, "min_preco": min_preco, "max_preco": max_preco, "q": q}
+    return StreamingResponse(
+        transmitir(lotes_exportacao(filtros, ordenar, tamanho_lote), formato),
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers={"Content-Disposition": f'attachment; filename="produtos.{formato}"'}
+    )
+
+# --- RELATÓRIOS ---
+# KPIs do resumo por categoria e linhas já com o total calculado pelo banco
+SQL_KPIS_INVENTARIO = """
+    SELECT COALESCE(SUM(qtd_produtos), 0), COALESCE(SUM(total_estoque), 0), COALESCE(SUM(valor_estoque), 0)
+    FROM resumo_categorias
+"""
+SQL_LINHAS_INVENTARIO = """
+    SELECT sku, COALESCE(nome, 'Sem Nome'), COALESCE(categoria, 'Geral'), preco, estoque, preco * estoque
+    FROM produtos ORDER BY rowid
+"""
+
+cache_relatorios = CacheRelatorios(PASTA_CACHE_RELATORIOS, MAX_RELATORIOS)
+
+@app.get("/relatorios/inventario.xlsx")
+def relatorio_inventario(if_none_match: Optional[str] = Header(None)):
+    """
+    Relatório Executivo de Inventário em Excel, gerado a partir do banco em
+    modo constant_memory (memória constante, qualquer tamanho de catálogo).
+    Só é gerado quando o catálogo muda; senão sai do cache em disco.
+    Com If-None-Match igual ao ETag atual responde 304.
+    """
+    conn = pool.conexao()
+    # Versão, KPIs e linhas na mesma transação de leitura: o arquivo guardado
+    # sob uma versão tem exatamente os dados dela
+    conn.execute("BEGIN")
+    try:
+        versao = conn.execute(SQL_VERSAO).fetchone()[0]
+        etag = etag_da_versao(versao)
+        if cliente_atualizado(if_none_match, etag):
+            return resposta_304(etag)
+        total_skus, total_itens, patrimonio = conn.execute(SQL_KPIS_INVENTARIO).fetchone()
+        kpis = {"total_skus": total_skus, "total_itens": total_itens, "patrimonio": patrimonio}
+
+        def gerar(pasta):
+            cursor = conn.cursor()
+            cursor.row_factory = None # Tuplas simples: vão direto para o write_row
+            return gerar_inventario(cursor.execute(SQL_LINHAS_INVENTARIO), kpis, pasta)
+
+        caminho = cache_relatorios.obter_ou_gerar(chave_relatorio(os.path.abspath(DB_PATH), versao, kpis), gerar)
+    finally:
+        conn.execute("COMMIT")
+    return FileResponse(caminho, media_type=MEDIA_TYPE_XLSX, filename=nome_relatorio(), headers=cabecalhos_etag(etag))
+
+@app.get("/relatorios/cache")
+def estatisticas_cache_relatorios():
+    """Relatórios guardados em disco, acertos e gerações (deste processo)."""
+    return cache_relatorios.estatisticas()
+
+def consulta_busca(q: str, categorias: list, limite: int):
+    """(sql, params) da busca textual, ou None quando o texto não tem termos."""
+    expressao = expressao_busca(q)
+    if not expressao:
+        return None
+
+    sql = f"""
+        SELECT {", ".join("p." + c.strip() for c in COLUNAS_LEITURA.split(","))}, produtos_fts.rank AS relevancia
+        FROM produtos_fts JOIN produtos p ON p.rowid = produtos_fts.rowid
+        WHERE produtos_fts MATCH ?
+    """
+    params = [expressao]
+    if categorias:
+        condicao, valores = condicao_categoria(categorias, "p.categoria")
+        sql += " AND " + condicao
+        params.extend(valores)
+    sql += " ORDER BY produtos_fts.rank LIMIT ?"
+    params.append(limite)
+    return sql, params
+
+def buscar_produtos(
+    q: str = Query(..., min_length=1, description="Termos de busca (prefixo, sem acentos)"),
+    categoria: str = Query(None, description="Filtrar por categoria"),
+    limite: int = Query(20, ge=1, le=100, description="Máximo de resultados")
+):
+    """
+    Busca textual ranqueada por relevância (bm25) em nome, SKU, categoria e especificações.
+    Exemplo: /produtos/busca?q=note dell
+    """
+    conn = pool.conexao()
+    consulta = consulta_busca(q, categorias_do_filtro(conn, categoria), limite)
+    if consulta is None:
+        return {"produtos": []}
+    dados = conn.execute(*consulta).fetchall()
+    return {"produtos": [linha_para_produto(row) for row in dados]}
+
+async def buscar_produtos_async(
+    q: str = Query(..., min_length=1, description="Termos de busca (prefixo, sem acentos)"),
+    categoria: str = Query(None, description="Filtrar por categoria"),
+    limite: int = Query(20, ge=1, le=100, description="Máximo de resultados")
+):
+    """
+    Busca textual ranqueada por relevância (bm25) em nome, SKU, categoria e especificações.
+    Exemplo: /produtos/busca?q=note dell
+    """
+    async with pool_async.conexao() as conn:
+        consulta = consulta_busca(q, await categorias_do_filtro_async(conn, categoria), limite)
+        if consulta is None:
+            return {"produtos": []}
+        dados = await conn.execute_fetchall(*consulta)
+    return {"produtos": [linha_para_produto(row) for row in dados]}
+
+app.get("/produtos/busca")(buscar_produtos_async if MODO_ASYNC else buscar_produtos)
+
+# Feed de mudanças: produtos gravados e lápides depois de uma revisão, em ordem.
+# Cada lado usa o seu índice de revisao; o UNION ALL só intercala os dois.
+SQL_MUDANCAS = f"""
+    SELECT revisao, 0 AS removido, {COLUNAS}, versao, atualizado_em FROM produtos WHERE revisao > :desde
+    UNION ALL
+    SELECT revisao, 1, sku, NULL, NULL, NULL, NULL, NULL, NULL, NULL, removido_em FROM produtos_removidos WHERE revisao > :desde
+    ORDER BY revisao LIMIT :limite
+"""
+
+def pagina_de_mudancas(dados, desde: int, limite: int, versao: int):
+    """
+    Separa alterados e removidos e calcula a revisão a partir da qual o cliente
+    continua. Sem mais páginas ele fica em dia com a versão lida antes da consulta.
+    """
+    if desde > versao:
+        raise HTTPException(status_code=410, detail="Revisão desconhecida: sincronize de novo com since=0")
+    tem_mais = len(dados) > limite
+    dados = dados[:limite]
+
+    alterados, removidos = [], []
+    for row in dados:
+        if row["removido"]:
+            removidos.append({"sku": row["sku"], "revisao": row["revisao"], "removido_em": row["atualizado_em"]})
+        else:
+            produto = linha_para_produto(row)
+            produto.pop("removido")
+            alterados.append(produto)
+
+    ultima = dados[-1]["revisao"] if dados else desde
+    return {
+        "revisao": ultima if tem_mais else max(ultima, versao),
+        "alterados": alterados,
+        "removidos": removidos,
+        "tem_mais": tem_mais
+    }
+
+def listar_mudancas(
+    since: int = Query(0, ge=0, description="Última revisão que o cliente já tem (0 = catálogo inteiro)"),
+    limite: int = Query(1000, ge=1, le=10000, description="Máximo de mudanças por página")
+):
+    """
+    Produtos criados/alterados e removidos depois da revisão `since`.
+    O cliente aplica as remoções, depois os alterados, e guarda `revisao` para
+    a próxima chamada. Com tem_mais=true, chame de novo com since=revisao.
+    """
+    conn = pool.conexao()
+    versao = conn.execute(SQL_VERSAO).fetchone()[0]
+    dados = conn.execute(SQL_MUDANCAS, {"desde": since, "limite": limite + 1}).fetchall()
+    return pagina_de_mudancas(dados, since, limite, versao)
+
+async def listar_mudancas_async(
+    since: int = Query(0, ge=0, description="Última revisão que o cliente já tem (0 = catálogo inteiro)"),
+    limite: int = Query(1000, ge=1, le=10000, description="Máximo de mudanças por página")
+):
+    """
+    Produtos criados/alterados e removidos depois da revisão `since`.
+    O cliente aplica as remoções, depois os alterados, e guarda `revisao` para
+    a próxima chamada. Com tem_mais=true, chame de novo com since=revisao.
+    """
+    async with pool_async.conexao() as conn:
+        versao = (await conn.execute_fetchall(SQL_VERSAO))[0][0]
+        dados = await conn.execute_fetchall(SQL_MUDANCAS, {"desde": since, "limite": limite + 1})
+    return pagina_de_mudancas(list(dados), since, limite, versao)
+
+app.get("/produtos/changes", response_model=dict)(listar_mudancas_async if MODO_ASYNC else listar_mudancas)
+
+# --- EVENTOS (SSE) ---
+# O hub lê o mesmo feed do /produtos/changes, uma vez por mudança para todas
+# as conexões. As escritas deste processo o acordam (apos_escrita); as de
+# outros processos aparecem no intervalo (NEXUS_EVENTOS_INTERVALO).
+async def ler_mudancas_eventos(desde: int, limite: int):
+    try:
+        if MODO_ASYNC:
+            return await listar_mudancas_async(desde, limite)
+        return await asyncio.to_thread(listar_mudancas, desde, limite)
+    except HTTPException as erro: # 410: revisão à frente do banco
+        raise ValueError(erro.detail)
+
+async def ler_revisao_eventos():
+    if MODO_ASYNC:
+        async with pool_async.conexao() as conn:
+            return (await conn.execute_fetchall(SQL_VERSAO))[0][0]
+    return await asyncio.to_thread(lambda: pool.conexao().execute(SQL_VERSAO).fetchone()[0])
+
+hub_eventos = HubEventos(ler_mudancas_eventos, ler_revisao_eventos)
+
+@app.get("/eventos")
+async def transmitir_eventos(
+    since: Optional[int] = Query(None, ge=0, description="Revisão da qual retomar (padrão: só o que vier depois de conectar)"),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Mudanças do catálogo em tempo real (Server-Sent Events): "produto" a cada
+    criação/alteração e "removido" a cada remoção, com id = revisão do feed.
+    Ao reconectar, o EventSource manda o Last-Event-ID e recebe o que perdeu.
+    """
+    try:
+        desde = revisao_de_retomada(last_event_id, since)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+    return StreamingResponse(hub_eventos.assinar(desde), media_type=MEDIA_TYPE_SSE, headers=CABECALHOS_SSE)
+
+@app.get("/eventos/estatisticas")
+def estatisticas_eventos():
+    return hub_eventos.estatisticas()
+
+SQL_OBTER = f"SELECT {COLUNAS_LEITURA} FROM produtos WHERE sku = ?"
+
+# Cache de leitura por SKU: sku -> (produto, etag). PUT, DELETE, upsert em
+# massa e PATCH em lote removem a entrada depois do commit.
+cache_sku = CacheLRU(TAMANHO_CACHE_SKU, TTL_CACHE_SKU)
+
+def resposta_produto(guardado, response: Response, if_none_match: Optional[str]):
+    produto, etag = guardado
+    if cliente_atualizado(if_none_match, etag):
+        return resposta_304(etag)
+    response.headers.update(cabecalhos_etag(etag))
+    return produto
+
+def obter_produto(sku: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    guardado = cache_sku.obter(sku)
+    if guardado is None:
+        geracao = cache_sku.geracao()
+        dado = pool.conexao().execute(SQL_OBTER, (sku,)).fetchone()
+        if not dado:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        guardado = (linha_para_produto(dado), etag_do_produto(dado["versao"]))
+        cache_sku.guardar(sku, guardado, geracao)
+    return resposta_produto(guardado, response, if_none_match)
+
+async def obter_produto_async(sku: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    guardado = cache_sku.obter(sku)
+    if guardado is None:
+        geracao = cache_sku.geracao()
+        async with pool_async.conexao() as conn:
+            cursor = await conn.execute(SQL_OBTER, (sku,))
+            dado = await cursor.fetchone()
+        if not dado:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        guardado = (linha_para_produto(dado), etag_do_produto(dado["versao"]))
+        cache_sku.guardar(sku, guardado, geracao)
+    return resposta_produto(guardado, response, if_none_match)
+
+app.get("/produtos/{sku}", response_model=ProdutoLido)(obter_produto_async if MODO_ASYNC else obter_produto)
 
-@app.post("/produtos/", status_code=201)
 def criar_produto(produto: Produto):
+    conn = pool.conexao()
     try:
-        conn = sqlite3.connect('nexus.db')
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO produtos (sku, nome, categoria, preco, estoque, url_imagem)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (produto.sku, produto.nome, produto.categoria, produto.preco, produto.estoque, produto.url_imagem))
-        conn.commit()
-        conn.close()
-        return produto
+        # "with conn" faz commit ao final (ou rollback em caso de erro)
+        with conn:
+            conn.execute(SQL_INSERIR, valores_produto(produto))
+        apos_escrita(conn)
+        return {**produto.dict(), "versao": 1}
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="SKU já existe.")
 
-@app.delete("/produtos/{sku}")
-def deletar_produto(sku: str):
-    conn = sqlite3.connect('nexus.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM produtos WHERE sku = ?", (sku,))
+async def criar_produto_async(produto: Produto):
+    try:
+        async with pool_async.transacao() as conn:
+            await conn.execute(SQL_INSERIR, valores_produto(produto))
+        await apos_escrita_async()
+        return {**produto.dict(), "versao": 1}
+    except sqlite3.IntegrityError: # O aiosqlite repassa as exceções do sqlite3
+        raise HTTPException(status_code=400, detail="SKU já existe.")
+
+app.post("/produtos/", status_code=201)(criar_produto_async if MODO_ASYNC else criar_produto)
+
+# O lote é copiado para uma tabela temporária (sem índices nem triggers) e entra
+# em produtos com um único INSERT ... SELECT. Com um statement só, o FTS5 e os
+# índices processam o lote de uma vez, bem mais rápido que um executemany direto.
+SQL_LOTE_TEMPORARIO = f"CREATE TEMP TABLE IF NOT EXISTS lote_importacao ({COLUNAS})"
+SQL_INSERIR_TEMPORARIO = f"INSERT INTO temp.lote_importacao ({COLUNAS}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+SQL_INSERIR_LOTE = f"INSERT INTO produtos ({COLUNAS}) SELECT {COLUNAS} FROM temp.lote_importacao"
+# "WHERE true" desfaz a ambiguidade entre o SELECT e o ON CONFLICT
+SQL_UPSERT_LOTE = SQL_INSERIR_LOTE + """ WHERE true
+    ON CONFLICT(sku) DO UPDATE SET
+        nome = excluded.nome, categoria = excluded.categoria, preco = excluded.preco,
+        estoque = excluded.estoque, url_imagem = excluded.url_imagem,
+        especificacoes = excluded.especificacoes,
+        versao = versao + (nome IS NOT excluded.nome OR categoria IS NOT excluded.categoria
+                           OR preco IS NOT excluded.preco OR estoque IS NOT excluded.estoque
+                           OR url_imagem IS NOT excluded.url_imagem OR especificacoes IS NOT excluded.especificacoes)
+"""
+# Um único parâmetro JSON evita o limite de variáveis do SQLite em lotes grandes
+SQL_SKUS_EXISTENTES = "SELECT sku FROM produtos WHERE sku IN (SELECT value FROM json_each(?))"
+
+def gravar_lote_importacao(conn, validos, modo, relatorio):
+    """
+    Grava um lote já validado em uma única transação. BEGIN IMMEDIATE trava a
+    escrita antes de ler os SKUs existentes: ninguém insere um deles entre a
+    checagem e o INSERT (o que seria um IntegrityError no meio da importação).
+    """
+    erros, por_sku = [], {}
+    for linha, produto in validos:
+        if produto.sku in por_sku:
+            erros.append({"linha": linha, "sku": produto.sku, "erro": ERRO_SKU_REPETIDO})
+        else:
+            por_sku[produto.sku] = produto
+
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        existentes = {row["sku"] for row in conn.execute(SQL_SKUS_EXISTENTES, (json.dumps(list(por_sku)),))}
+        if modo == "inserir":
+            for linha, produto in validos:
+                if produto.sku in existentes and por_sku.get(produto.sku) is produto:
+                    erros.append({"linha": linha, "sku": produto.sku, "erro": ERRO_SKU_EXISTENTE})
+            gravar = [p for sku, p in por_sku.items() if sku not in existentes]
+        else:
+            gravar = list(por_sku.values())
+
+        conn.execute(SQL_LOTE_TEMPORARIO)
+        conn.execute("DELETE FROM temp.lote_importacao")
+        conn.executemany(SQL_INSERIR_TEMPORARIO, [valores_produto(p) for p in gravar])
+        conn.execute(SQL_INSERIR_LOTE if modo == "inserir" else SQL_UPSERT_LOTE)
+        conn.execute("DELETE FROM temp.lote_importacao")
+
+    if modo == "inserir":
+        relatorio.inseridos += len(gravar)
+    else:
+        cache_sku.remover(existentes)
+        relatorio.atualizados += len(existentes)
+        relatorio.inseridos += len(gravar) - len(existentes)
+    return erros
+
+@app.post("/produtos/bulk-import")
+def importar_produtos(
+    arquivo: UploadFile = File(..., description="Arquivo .csv ou .jsonl com um produto por linha"),
+    formato: str = Query(None, description="csv ou jsonl (padrão: pela extensão do arquivo)"),
+    modo: str = Query("inserir", description="inserir (SKU existente vira erro) ou upsert"),
+    tamanho_lote: int = Query(10000, ge=1, le=50000, description="Linhas por transação")
+):
+    """
+    Importa um catálogo inteiro em lotes: valida cada linha e grava o lote
+    com executemany em uma transação. Retorna um relatório com os erros por linha.
+    """
+    if modo not in MODOS_IMPORTACAO:
+        raise HTTPException(status_code=400, detail="Modo inválido")
+    try:
+        formato = detectar_formato(arquivo.filename, formato)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+
+    conn = pool.conexao()
+    relatorio = RelatorioImportacao()
+    for validos, erros in ler_lotes(arquivo.file, formato, ProdutoSchema, tamanho_lote):
+        relatorio.processados += len(validos) + len(erros)
+        erros += gravar_lote_importacao(conn, validos, modo, relatorio)
+        relatorio.registrar_erros(sorted(erros, key=lambda e: e["linha"]))
+    apos_escrita(conn)
+    return relatorio.como_dict()
+
+# Campos ausentes chegam como NULL e o COALESCE mantém o valor atual.
+# A condição extra no WHERE faz o rowcount contar só o que realmente mudou
+# (e só esses produtos ganham versão nova).
+CAMPOS_EDITAVEIS = ("nome", "categoria", "preco", "estoque", "url_imagem", "especificacoes")
+SQL_ATUALIZAR_PARCIAL = (
+    "UPDATE produtos SET "
+    + ", ".join(f"{c} = COALESCE(:{c}, {c})" for c in CAMPOS_EDITAVEIS)
+    + ", versao = versao + 1 WHERE sku = :sku AND ("
+    + " OR ".join(f"COALESCE(:{c}, {c}) IS NOT {c}" for c in CAMPOS_EDITAVEIS)
+    + ")"
+)
+@app.patch("/produtos/bulk", response_model=ResultadoLoteResponse)
+def atualizar_em_lote(atualizacoes: List[ProdutoUpdateLote]):
+    """
+    Atualiza preço, estoque ou qualquer outro campo de vários produtos
+    em uma única transação. Envie apenas os campos que deseja alterar.
+    """
+    if len(atualizacoes) > MAX_ITENS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_ITENS_LOTE} itens por lote")
+
+    # Um UPDATE por produto: o rowcount do executemany conta produtos alterados
+    por_sku = juntar_por_sku(atualizacoes)
+    skus = list(por_sku)
+    parametros = []
+    for sku, campos in por_sku.items():
+        item = {"sku": sku, **{c: campos.get(c) for c in CAMPOS_EDITAVEIS}}
+        if item["especificacoes"] is not None:
+            item["especificacoes"] = json.dumps(item["especificacoes"], ensure_ascii=False)
+        parametros.append(item)
+    conn = pool.conexao()
+    with conn:
+        existentes = {row["sku"] for row in conn.execute(SQL_SKUS_EXISTENTES, (json.dumps(skus),))}
+        cursor = conn.executemany(SQL_ATUALIZAR_PARCIAL, parametros)
+    cache_sku.remover(existentes)
+    apos_escrita(conn)
+
+    return {
+        "encontrados": len(existentes),
+        "modificados": cursor.rowcount,
+        "nao_encontrados": [sku for sku in skus if sku not in existentes]
+    }
+
+# --- ANALYTICS ---
+SQL_ANALISE = """
+    SELECT categoria, qtd_produtos, ROUND(soma_preco / qtd_produtos, 2) AS media_preco,
+           total_estoque, ROUND(valor_estoque, 2) AS valor_estoque
+    FROM resumo_categorias ORDER BY qtd_produtos DESC
+"""
+
+def analise_de_catalogo():
+    """Estatísticas por categoria, lidas do resumo materializado."""
+    dados = pool.conexao().execute(SQL_ANALISE).fetchall()
+    return [dict(row) for row in dados]
+
+async def analise_de_catalogo_async():
+    """Estatísticas por categoria, lidas do resumo materializado."""
+    async with pool_async.conexao() as conn:
+        dados = await conn.execute_fetchall(SQL_ANALISE)
+    return [dict(row) for row in dados]
+
+app.get("/analytics/geral")(analise_de_catalogo_async if MODO_ASYNC else analise_de_catalogo)
+
+# Receita estimada (preco * estoque): os N maiores produtos saem do índice de
+# valor e o total vem do resumo por categoria, sem varrer o catálogo
+SQL_TOP_VALOR = """
+    SELECT sku, nome, categoria, preco * estoque AS valor FROM produtos {onde}
+    ORDER BY preco * estoque DESC LIMIT ?
+"""
+SQL_TOTAL_VALOR = """
+    SELECT COALESCE(SUM(qtd_produtos), 0), COALESCE(SUM(valor_estoque), 0) FROM resumo_categorias {onde}
+"""
+
+def consultas_receita(top: int, categorias: Optional[list]):
+    """(sql, params) do top N e do total, com ou sem o filtro de categoria."""
+    onde, params = ("", [])
+    if categorias:
+        condicao, params = condicao_categoria(categorias)
+        onde = "WHERE " + condicao
+    return (
+        (SQL_TOP_VALOR.format(onde=onde), params + [top]),
+        (SQL_TOTAL_VALOR.format(onde=onde), params)
+    )
+
+def montar_receita(maiores, qtd_total: int, valor_total: float, categoria: Optional[str]):
+    """Top N + "Outros" (o que sobra do total depois do top)."""
+    top = [dict(row) for row in maiores]
+    valor_top = sum(item["valor"] for item in top)
+    return {
+        "categoria": categoria,
+        "top": top,
+        "outros": {
+            "qtd_produtos": max(qtd_total - len(top), 0),
+            "valor": round(max(valor_total - valor_top, 0), 2)
+        },
+        "total": {"qtd_produtos": qtd_total, "valor": round(valor_total, 2)}
+    }
+
+def receita_por_produto(
+    top: int = Query(10, ge=1, le=100, description="Quantos produtos mostrar; o resto vira 'Outros'"),
+    categoria: str = Query(None, description="Detalhar uma categoria")
+):
+    """Maiores produtos por valor em estoque (preço x estoque) e o agregado do restante."""
+    conn = pool.conexao()
+    (sql_top, params_top), (sql_total, params_total) = consultas_receita(top, categorias_do_filtro(conn, categoria))
+    maiores = conn.execute(sql_top, params_top).fetchall()
+    qtd, valor = conn.execute(sql_total, params_total).fetchone()
+    return montar_receita(maiores, qtd, valor, categoria)
+
+async def receita_por_produto_async(
+    top: int = Query(10, ge=1, le=100, description="Quantos produtos mostrar; o resto vira 'Outros'"),
+    categoria: str = Query(None, description="Detalhar uma categoria")
+):
+    """Maiores produtos por valor em estoque (preço x estoque) e o agregado do restante."""
+    async with pool_async.conexao() as conn:
+        categorias = await categorias_do_filtro_async(conn, categoria)
+        (sql_top, params_top), (sql_total, params_total) = consultas_receita(top, categorias)
+        maiores = await conn.execute_fetchall(sql_top, params_top)
+        qtd, valor = (await conn.execute_fetchall(sql_total, params_total))[0]
+    return montar_receita(maiores, qtd, valor, categoria)
+
+app.get("/analytics/receita")(receita_por_produto_async if MODO_ASYNC else receita_por_produto)
+
+# Indicadores do Dashboard numa consulta só: somas por categoria do resumo
+# materializado + contagem de estoque baixo pela faixa do índice de estoque
+SQL_KPIS = """
+    SELECT r.categoria, r.qtd_produtos, r.soma_preco, r.total_estoque, r.valor_estoque,
+           COALESCE(b.estoque_baixo, 0) AS estoque_baixo, COALESCE(b.sem_estoque, 0) AS sem_estoque
+    FROM resumo_categorias r LEFT JOIN (
+        SELECT IFNULL(categoria, '') AS categoria, COUNT(*) AS estoque_baixo, SUM(estoque <= 0) AS sem_estoque
+        FROM produtos WHERE estoque <= ? GROUP BY 1
+    ) b ON b.categoria = r.categoria
+"""
+
+def kpis_do_catalogo(
+    estoque_baixo: int = Query(ESTOQUE_BAIXO, ge=0, description="Estoque até este valor conta como baixo")
+):
+    """Totais do catálogo (produtos, valor em estoque, ticket médio, categorias), por categoria e estoque baixo."""
+    conn = pool.conexao()
+    if snapshot is not None:
+        sincronizar_snapshot(conn)
+        return montar_kpis(snapshot.resumo_categorias(estoque_baixo), estoque_baixo)
+    linhas = conn.execute(SQL_KPIS, (estoque_baixo,)).fetchall()
+    return montar_kpis([dict(row) for row in linhas], estoque_baixo)
+
+async def kpis_do_catalogo_async(
+    estoque_baixo: int = Query(ESTOQUE_BAIXO, ge=0, description="Estoque até este valor conta como baixo")
+):
+    """Totais do catálogo (produtos, valor em estoque, ticket médio, categorias), por categoria e estoque baixo."""
+    async with pool_async.conexao() as conn:
+        if snapshot is not None:
+            await sincronizar_snapshot_async(conn)
+            return montar_kpis(snapshot.resumo_categorias(estoque_baixo), estoque_baixo)
+        linhas = await conn.execute_fetchall(SQL_KPIS, (estoque_baixo,))
+    return montar_kpis([dict(row) for row in linhas], estoque_baixo)
+
+app.get("/analytics/kpis", response_model=dict)(kpis_do_catalogo_async if MODO_ASYNC else kpis_do_catalogo)
+
+@app.post("/analytics/resumo/reconstruir")
+def reconstruir_resumo_categorias():
+    """Recalcula o resumo por categoria do zero (ex: após carga direta no banco)."""
+    conn = pool.conexao()
+    with conn:
+        categorias = reconstruir_resumo(conn)
+    return {"categorias": categorias}
+
+@app.get("/analytics/resumo/verificar")
+def verificar_resumo_categorias():
+    """Confere o resumo materializado contra a agregação completa do catálogo."""
+    divergencias = verificar_resumo(pool.conexao())
+    return {"consistente": not divergencias, "divergencias": divergencias}
+
+# --- MÉTRICAS ---
+@app.get("/metrics")
+def exportar_metricas():
+    """Requisições, erros e latência por rota e tempo no banco, no formato do Prometheus."""
+    return Response(metricas.texto(), media_type=MEDIA_TYPE_PROMETHEUS)
+
+# --- CACHE ---
+@app.get("/cache/sku")
+def estatisticas_cache_sku():
+    """Acertos, faltas e despejos do cache de produtos por SKU (deste processo)."""
+    return cache_sku.estatisticas()
+
+@app.get("/cache/snapshot")
+def estatisticas_snapshot():
+    """Versão, tamanho e memória do snapshot colunar (deste processo)."""
+    if snapshot is None:
+        return {"ativo": False}
+    return {"ativo": True, **snapshot.estatisticas()}
+
+# --- ESCRITAS CONDICIONAIS (If-Match) ---
+# A condição de versão vai no próprio WHERE: uma instrução só, sem ler antes.
+# Sem If-Match (:versao NULL) a escrita é incondicional, como antes.
+SQL_VERSAO_PRODUTO = "SELECT versao FROM produtos WHERE sku = ?"
+
+def versao_esperada(if_match: Optional[str]):
+    try:
+        return versao_do_if_match(if_match)
+    except ValueError as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+
+def escrita_recusada(atual):
+    """
+    A escrita condicional não casou com nenhuma linha. Só agora (caminho de
+    erro) o banco é consultado para dizer o motivo: 404 ou 412.
+    """
+    if atual is None:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+    raise HTTPException(
+        status_code=412, detail=f"O produto mudou desde a leitura (versão atual: {atual[0]}). Leia de novo e reaplique."
+    )
+
+SQL_DELETAR = "DELETE FROM produtos WHERE sku = :sku AND (:versao IS NULL OR versao = :versao)"
+
+def deletar_produto(sku: str, if_match: Optional[str] = Header(None)):
+    versao = versao_esperada(if_match)
+    conn = pool.conexao()
+    with conn:
+        cursor = conn.execute(SQL_DELETAR, {"sku": sku, "versao": versao})
+    cache_sku.remover([sku])
+    apos_escrita(conn)
     # Verifica se deletou algo
     linhas_afetadas = cursor.rowcount
-    conn.commit()
-    conn.close()
     
     if linhas_afetadas == 0:
-        raise HTTPException(status_code=404, detail="Produto não encontrado")
+        escrita_recusada(conn.execute(SQL_VERSAO_PRODUTO, (sku,)).fetchone())
     return {"message": "Produto removido com sucesso"}
 
-@app.put("/produtos/{sku}")
-def atualizar_produto(sku: str, produto: Produto):
-    conn = sqlite3.connect('nexus.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE produtos 
-        SET nome = ?, categoria = ?, preco = ?, estoque = ?, url_imagem = ?
-        WHERE sku = ?
-    """, (produto.nome, produto.categoria, produto.preco, produto.estoque, produto.url_imagem, sku))
-    
-    linhas_afetadas = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
-    if linhas_afetadas == 0:
-        raise HTTPException(status_code=404, detail="Produto não encontrado")
-    return produto
\ No newline at end of file
+async def deletar_produto_async(sku: str, if_match: Optional[str] = Header(None)):
+    versao = versao_esperada(if_match)
+    async with pool_async.transacao() as conn:
+        cursor = await conn.execute(SQL_DELETAR, {"sku": sku, "versao": versao})
+    cache_sku.remover([sku])
+    await apos_escrita_async()
+
+    if cursor.rowcount == 0:
+        async with pool_async.conexao() as conn:
+            atual = await conn.execute_fetchall(SQL_VERSAO_PRODUTO, (sku,))
+        escrita_recusada(atual[0] if atual else None)
+    return {"message": "Produto removido com sucesso"}
+
+app.delete("/produtos/{sku}")(deletar_produto_async if MODO_ASYNC else deletar_produto)
+
+# A versão só sobe quando algum valor muda (mesma condição do trigger da
+# revisão), e o RETURNING devolve a linha gravada (versão nova e especificações
+# mantidas quando o corpo não as traz) sem outra consulta. A revisão fica de
+# fora: quem a preenche é o trigger, depois do RETURNING
+SQL_ATUALIZAR = f"""
+    UPDATE produtos
+    SET nome = :nome, categoria = :categoria, preco = :preco, estoque = :estoque, url_imagem = :url_imagem,
+        especificacoes = COALESCE(:especificacoes, especificacoes),
+        versao = versao + (nome IS NOT :nome OR categoria IS NOT :categoria OR preco IS NOT :preco
+                           OR estoque IS NOT :estoque OR url_imagem IS NOT :url_imagem
+                           OR especificacoes IS NOT COALESCE(:especificacoes, especificacoes))
+    WHERE sku = :sku AND (:versao IS NULL OR versao = :versao)
+    RETURNING {COLUNAS}, versao
+"""
+
+def valores_atualizacao(sku: str, produto: Produto, versao: Optional[int]):
+    especificacoes = None if produto.especificacoes is None else json.dumps(produto.especificacoes, ensure_ascii=False)
+    return {
+        "nome": produto.nome, "categoria": produto.categoria, "preco": produto.preco, "estoque": produto.estoque,
+        "url_imagem": produto.url_imagem, "especificacoes": especificacoes, "sku": sku, "versao": versao
+    }
+
+def atualizar_produto(sku: str, produto: Produto, if_match: Optional[str] = Header(None)):
+    """
+    Substitui os dados do produto. Com If-Match (a `versao` lida), só grava se
+    ninguém alterou o produto nesse meio-tempo; senão responde 412.
+    """
+    versao = versao_esperada(if_match)
+    conn = pool.conexao()
+    with conn:
+        # fetchall: o RETURNING precisa terminar antes do commit
+        gravado = conn.execute(SQL_ATUALIZAR, valores_atualizacao(sku, produto, versao)).fetchall()
+    cache_sku.remover([sku])
+    apos_escrita(conn)
+
+    if not gravado:
+        escrita_recusada(conn.execute(SQL_VERSAO_PRODUTO, (sku,)).fetchone())
+    return linha_para_produto(gravado[0])
+
+async def atualizar_produto_async(sku: str, produto: Produto, if_match: Optional[str] = Header(None)):
+    """
+    Substitui os dados do produto. Com If-Match (a `versao` lida), só grava se
+    ninguém alterou o produto nesse meio-tempo; senão responde 412.
+    """
+    versao = versao_esperada(if_match)
+    async with pool_async.transacao() as conn:
+        gravado = await conn.execute_fetchall(SQL_ATUALIZAR, valores_atualizacao(sku, produto, versao))
+    cache_sku.remover([sku])
+    await apos_escrita_async()
+
+    if not gravado:
+        async with pool_async.conexao() as conn:
+            atual = await conn.execute_fetchall(SQL_VERSAO_PRODUTO, (sku,))
+        escrita_recusada(atual[0] if atual else None)
+    return linha_para_produto(gravado[0])
+
+app.put("/produtos/{sku}")(atualizar_produto_async if MODO_ASYNC else atualizar_produto)
+
+# --- RESERVA DE ESTOQUE ---
+# A baixa é uma instrução só para o pedido inteiro: cada linha só é alterada
+# se o estoque cobrir a quantidade (WHERE estoque >= pedido), então duas
+# reservas concorrentes nunca vendem a mesma unidade. Se alguma linha ficar
+# de fora, a transação é desfeita (tudo ou nada) e só então o estoque é lido
+# para dizer o que faltou.
+SQL_BAIXAR_ESTOQUE = """
+    UPDATE produtos SET estoque = estoque - pedido.value, versao = versao + 1
+    FROM json_each(:pedido) AS pedido
+    WHERE produtos.sku = pedido.key AND produtos.estoque >= pedido.value
+    RETURNING sku, estoque
+"""
+SQL_DEVOLVER_ESTOQUE = """
+    UPDATE produtos SET estoque = estoque + pedido.value, versao = versao + 1
+    FROM json_each(:pedido) AS pedido
+    WHERE produtos.sku = pedido.key
+    RETURNING sku, estoque
+"""
+SQL_ESTOQUE_DO_PEDIDO = "SELECT sku, estoque FROM produtos WHERE sku IN (SELECT key FROM json_each(?))"
+SQL_INSERIR_RESERVA = "INSERT INTO reservas (id, itens) VALUES (?, ?)"
+# Sai de "pendente" uma vez só: a segunda confirmação/liberação não casa com nada
+SQL_FINALIZAR_RESERVA = f"""
+    UPDATE reservas SET status = :status, finalizada_em = {AGORA_SQL}
+    WHERE id = :id AND status = '{PENDENTE}'
+    RETURNING itens
+"""
+SQL_OBTER_RESERVA = "SELECT id, itens, status, criada_em, finalizada_em FROM reservas WHERE id = ?"
+
+def pedido_da_requisicao(pedido: PedidoReserva) -> dict:
+    if len(pedido.itens) > MAX_ITENS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_ITENS_LOTE} itens por pedido")
+    return juntar_itens(pedido.itens)
+
+def reserva_recusada(pedido: dict, disponiveis: dict):
+    """Nada foi reservado: 404 se algum SKU não existe, 409 se faltou estoque."""
+    faltas = faltas_do_pedido(pedido, disponiveis)
+    inexistentes = [f["sku"] for f in faltas if f["disponivel"] is None]
+    if inexistentes:
+        raise HTTPException(status_code=404, detail=f"Produto não encontrado: {', '.join(inexistentes)}")
+    raise HTTPException(status_code=409, detail={"mensagem": str(EstoqueInsuficiente(faltas)), "faltas": faltas})
+
+def finalizacao_recusada(atual):
+    if atual is None:
+        raise HTTPException(status_code=404, detail="Reserva não encontrada")
+    raise HTTPException(status_code=409, detail=f"Reserva já {atual['status']}.")
+
+def reservar_pedido(pedido: dict):
+    itens = json.dumps(pedido, ensure_ascii=False)
+    reserva = nova_reserva()
+    conn = pool.conexao()
+    try:
+        with conn:
+            estoques = dict(conn.execute(SQL_BAIXAR_ESTOQUE, {"pedido": itens}).fetchall())
+            if len(estoques) < len(pedido):
+                raise EstoqueInsuficiente([]) # Desfaz as baixas que já tinham passado
+            conn.execute(SQL_INSERIR_RESERVA, (reserva, itens))
+    except EstoqueInsuficiente:
+        reserva_recusada(pedido, dict(conn.execute(SQL_ESTOQUE_DO_PEDIDO, (itens,)).fetchall()))
+    cache_sku.remover(pedido)
+    apos_escrita(conn)
+    return resposta_reserva(reserva, PENDENTE, pedido, estoques)
+
+async def reservar_pedido_async(pedido: dict):
+    itens = json.dumps(pedido, ensure_ascii=False)
+    reserva = nova_reserva()
+    try:
+        async with pool_async.transacao() as conn:
+            estoques = dict(await conn.execute_fetchall(SQL_BAIXAR_ESTOQUE, {"pedido": itens}))
+            if len(estoques) < len(pedido):
+                raise EstoqueInsuficiente([])
+            await conn.execute(SQL_INSERIR_RESERVA, (reserva, itens))
+    except EstoqueInsuficiente:
+        async with pool_async.conexao() as conn:
+            disponiveis = dict(await conn.execute_fetchall(SQL_ESTOQUE_DO_PEDIDO, (itens,)))
+        reserva_recusada(pedido, disponiveis)
+    cache_sku.remover(pedido)
+    await apos_escrita_async()
+    return resposta_reserva(reserva, PENDENTE, pedido, estoques)
+
+def finalizar_reserva(reserva: str, status: str):
+    """Confirma (o estoque fica baixado) ou libera (o estoque volta) uma reserva pendente."""
+    conn = pool.conexao()
+    with conn:
+        finalizada = conn.execute(SQL_FINALIZAR_RESERVA, {"id": reserva, "status": status}).fetchall()
+        if finalizada and status == LIBERADA:
+            estoques = dict(conn.execute(SQL_DEVOLVER_ESTOQUE, {"pedido": finalizada[0]["itens"]}).fetchall())
+    if not finalizada:
+        finalizacao_recusada(conn.execute(SQL_OBTER_RESERVA, (reserva,)).fetchone())
+    pedido = json.loads(finalizada[0]["itens"])
+    if status == CONFIRMADA:
+        return resposta_reserva(reserva, status, pedido)
+    cache_sku.remover(pedido)
+    apos_escrita(conn)
+    return resposta_reserva(reserva, status, pedido, estoques)
+
+async def finalizar_reserva_async(reserva: str, status: str):
+    async with pool_async.transacao() as conn:
+        finalizada = await conn.execute_fetchall(SQL_FINALIZAR_RESERVA, {"id": reserva, "status": status})
+        if finalizada and status == LIBERADA:
+            estoques = dict(await conn.execute_fetchall(SQL_DEVOLVER_ESTOQUE, {"pedido": finalizada[0]["itens"]}))
+    if not finalizada:
+        async with pool_async.conexao() as conn:
+            atual = await conn.execute_fetchall(SQL_OBTER_RESERVA, (reserva,))
+        finalizacao_recusada(atual[0] if atual else None)
+    pedido = json.loads(finalizada[0]["itens"])
+    if status == CONFIRMADA:
+        return resposta_reserva(reserva, status, pedido)
+    cache_sku.remover(pedido)
+    await apos_escrita_async()
+    return resposta_reserva(reserva, status, pedido, estoques)
+
+def reserva_lida(row):
+    if row is None:
+        raise HTTPException(status_code=404, detail="Reserva não encontrada")
+    return {
+        **resposta_reserva(row["id"], row["status"], json.loads(row["itens"])),
+        "criada_em": row["criada_em"],
+        "finalizada_em": row["finalizada_em"],
+    }
+
+def reservar_estoque(sku: str, quantidade: QuantidadeReserva):
+    """Reserva (baixa) estoque de um produto. Sem estoque suficiente: 409 e nada muda."""
+    return reservar_pedido({sku: quantidade.quantidade})
+
+async def reservar_estoque_async(sku: str, quantidade: QuantidadeReserva):
+    """Reserva (baixa) estoque de um produto. Sem estoque suficiente: 409 e nada muda."""
+    return await reservar_pedido_async({sku: quantidade.quantidade})
+
+app.post("/produtos/{sku}/estoque/reservar", status_code=201)(reservar_estoque_async if MODO_ASYNC else reservar_estoque)
+
+def reservar_varios(pedido: PedidoReserva):
+    """Reserva os itens de um pedido de uma vez: ou todos têm estoque e são baixados, ou nenhum é."""
+    return reservar_pedido(pedido_da_requisicao(pedido))
+
+async def reservar_varios_async(pedido: PedidoReserva):
+    """Reserva os itens de um pedido de uma vez: ou todos têm estoque e são baixados, ou nenhum é."""
+    return await reservar_pedido_async(pedido_da_requisicao(pedido))
+
+app.post("/estoque/reservas", status_code=201)(reservar_varios_async if MODO_ASYNC else reservar_varios)
+
+def obter_reserva(reserva: str):
+    return reserva_lida(pool.conexao().execute(SQL_OBTER_RESERVA, (reserva,)).fetchone())
+
+async def obter_reserva_async(reserva: str):
+    async with pool_async.conexao() as conn:
+        linhas = await conn.execute_fetchall(SQL_OBTER_RESERVA, (reserva,))
+    return reserva_lida(linhas[0] if linhas else None)
+
+app.get("/estoque/reservas/{reserva}")(obter_reserva_async if MODO_ASYNC else obter_reserva)
+
+def confirmar_reserva(reserva: str):
+    return finalizar_reserva(reserva, CONFIRMADA)
+
+async def confirmar_reserva_async(reserva: str):
+    return await finalizar_reserva_async(reserva, CONFIRMADA)
+
+app.post("/estoque/reservas/{reserva}/confirmar")(confirmar_reserva_async if MODO_ASYNC else confirmar_reserva)
+
+def liberar_reserva(reserva: str):
+    return finalizar_reserva(reserva, LIBERADA)
+
+async def liberar_reserva_async(reserva: str):
+    return await finalizar_reserva_async(reserva, LIBERADA)
+
+app.post("/estoque/reservas/{reserva}/liberar")(liberar_reserva_async if MODO_ASYNC else liberar_reserva)
+
+if __name__ == "__main__":
+    # python main.py                       -> sobe a API
+    # python main.py reconstruir-resumo    -> recalcula o resumo por categoria e sai
+    import sys
+    if sys.argv[1:] == ["reconstruir-resumo"]:
+        init_db()
+        conn = pool.conexao()
+        with conn:
+            print(f"Resumo reconstruído: {reconstruir_resumo(conn)} categorias")
+        divergencias = verificar_resumo(conn)
+        print("Consistente" if not divergencias else f"Divergências: {divergencias}")
+        pool.fechar()
+    else:
+        import uvicorn
+        uvicorn.run(app)
@@ -0,0 +1,83 @@
+"""
+Teste de carga da API: N clientes concorrentes fazendo requisições por D segundos.
+Serve para comparar NEXUS_MODO=sync (threadpool) com NEXUS_MODO=async.
+
+    NEXUS_MODO=sync  uvicorn main:app --port 8000
+    python teste_carga.py --url http://localhost:8000 --clientes 500 --duracao 30
+
+Mistura de requisições: 70% GET /produtos/{sku}, 20% listagem (20 itens),
+10% /analytics/geral. Imprime vazão e latências (p50/p95/p99) em JSON.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    indice = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[indice]
+
+
+async def cliente(http, skus, fim, latencias, erros):
+    """Um cliente: faz uma requisição atrás da outra até o fim do teste."""
+    while time.perf_counter() < fim:
+        sorteio = random.random()
+        if sorteio < 0.7:
+            caminho = f"/produtos/{random.choice(skus)}"
+        elif sorteio < 0.9:
+            caminho = "/produtos/?limite=20"
+        else:
+            caminho = "/analytics/geral"
+
+        inicio = time.perf_counter()
+        try:
+            resposta = await http.get(caminho)
+            if resposta.status_code >= 500:
+                erros.append(resposta.status_code)
+                continue
+        except httpx.HTTPError as erro:
+            erros.append(type(erro).__name__)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+
+
+async def executar(url: str, clientes: int, duracao: float):
+    limites = httpx.Limits(max_connections=clientes, max_keepalive_connections=clientes)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as http:
+        amostra = (await http.get("/produtos/", params={"limite": 100})).json()["produtos"]
+        skus = [p["sku"] for p in amostra]
+        if not skus:
+            raise SystemExit("Catálogo vazio: cadastre produtos antes do teste")
+
+        latencias, erros = [], []
+        inicio = time.perf_counter()
+        fim = inicio + duracao
+        await asyncio.gather(*(cliente(http, skus, fim, latencias, erros) for _ in range(clientes)))
+        decorrido = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "clientes": clientes,
+        "duracao_s": round(decorrido, 1),
+        "requisicoes": len(latencias),
+        "erros": len(erros),
+        "req_por_s": round(len(latencias) / decorrido, 1),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga da API Nexus")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--duracao", type=float, default=30)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(executar(args.url, args.clientes, args.duracao)), indent=2))
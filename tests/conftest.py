@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# main.py e app.database leem a configuração no import: banco SQLite
+# descartável e um nome de banco Mongo de teste antes de qualquer teste
+os.environ["NEXUS_DB"] = os.path.join(tempfile.mkdtemp(), "nexus_teste.db")
+os.environ.setdefault("DATABASE_NAME", "nexus_teste")
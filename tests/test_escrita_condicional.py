@@ -0,0 +1,47 @@
+"""
+Escrita condicional no SQLite: o ETag do GET por SKU volta no If-Match do
+PUT/DELETE, como qualquer cliente HTTP faria, e um ETag velho dá 412.
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+PRODUTO = {"sku": "TC-ETAG-1", "nome": "Mouse Sem Fio", "categoria": "Periféricos", "preco": 99.9, "estoque": 5}
+
+
+@pytest.fixture
+def cliente():
+    with TestClient(main.app) as cliente:
+        cliente.delete(f"/produtos/{PRODUTO['sku']}")
+        assert cliente.post("/produtos/", json={**PRODUTO, "especificacoes": {"dpi": "1600"}}).status_code == 201
+        yield cliente
+
+
+def test_put_com_etag_do_get(cliente):
+    url = f"/produtos/{PRODUTO['sku']}"
+    etag = cliente.get(url).headers["ETag"]
+
+    r = cliente.put(url, json={**PRODUTO, "preco": 89.9}, headers={"If-Match": etag})
+    assert r.status_code == 200, r.text
+    novo_etag = cliente.get(url).headers["ETag"]
+    assert novo_etag != etag
+
+    # Quem ainda tem o ETag antigo não sobrescreve a alteração
+    r = cliente.put(url, json={**PRODUTO, "preco": 79.9}, headers={"If-Match": etag})
+    assert r.status_code == 412
+    assert cliente.get(url).json()["preco"] == 89.9
+
+    # O ETag também revalida a leitura
+    assert cliente.get(url, headers={"If-None-Match": novo_etag}).status_code == 304
+    assert cliente.delete(url, headers={"If-Match": etag}).status_code == 412
+    assert cliente.delete(url, headers={"If-Match": novo_etag}).status_code == 200
+
+
+def test_put_sem_especificacoes_devolve_as_gravadas(cliente):
+    url = f"/produtos/{PRODUTO['sku']}"
+    r = cliente.put(url, json={**PRODUTO, "estoque": 7})
+    assert r.status_code == 200, r.text
+    assert r.json()["especificacoes"] == {"dpi": "1600"}
+    assert r.json()["estoque"] == 7
+    assert r.json()["versao"] == cliente.get(url).json()["versao"]
@@ -0,0 +1,99 @@
+"""
+Planos de consulta da listagem: o filtro de categoria tem que ser uma busca
+por índice (nunca varredura da coleção/tabela). Quebra se um índice sumir ou
+se o filtro deixar de usar o campo que o índice cobre.
+
+    python -m pytest -q
+
+O lado Mongo precisa de um mongod descartável (NEXUS_TESTE_MONGO_URL ou
+MONGO_URL); sem servidor acessível esses testes são pulados. O explain()
+não existe no mongomock.
+"""
+import os
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import main
+from app.indices import INDICES, garantir_indices, plano_vencedor
+from app.services import montar_filtro, normalizar_categoria, ordem_de
+
+
+# --- SQLITE ---
+
+@pytest.fixture(scope="module")
+def conn_sqlite():
+    main.init_db()
+    return main.pool.conexao()
+
+
+def plano_sqlite(conn, sql, params):
+    return [linha["detail"] for linha in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+@pytest.mark.parametrize("ordenar, indice", [
+    ("recentes", "idx_produtos_categoria"),
+    ("menor_preco", "idx_produtos_categoria_preco"),
+    ("maior_preco", "idx_produtos_categoria_preco"),
+])
+def test_sqlite_categoria_usa_indice(conn_sqlite, ordenar, indice):
+    sql, params = main.montar_consulta_produtos(categorias=["Gamer"], ordenar=ordenar, limite=11)
+    plano = plano_sqlite(conn_sqlite, sql, params)
+    assert any(f"USING INDEX {indice} (categoria=?" in passo for passo in plano), plano
+    assert not any(passo.startswith("SCAN produtos") for passo in plano), plano
+
+
+def test_sqlite_categoria_com_grafias_diferentes_usa_indice(conn_sqlite):
+    # "Eletrônicos" e "eletronicos" gravados: a mesma categoria vira um IN no índice
+    categorias = main.nomes_da_categoria("ELETRÔNICOS", ["Eletrônicos", "eletronicos", "Casa"])
+    assert categorias == ["Eletrônicos", "eletronicos"]
+    sql, params = main.montar_consulta_produtos(categorias=categorias, limite=11)
+    plano = plano_sqlite(conn_sqlite, sql, params)
+    assert any("USING INDEX idx_produtos_categoria (categoria=?" in passo for passo in plano), plano
+    assert not any(passo.startswith("SCAN produtos") for passo in plano), plano
+
+
+# --- MONGO ---
+
+@pytest.fixture(scope="module")
+def colecao_mongo():
+    url = os.getenv("NEXUS_TESTE_MONGO_URL") or os.getenv("MONGO_URL")
+    if not url:
+        pytest.skip("sem mongod (defina NEXUS_TESTE_MONGO_URL)")
+    cliente = MongoClient(url, serverSelectionTimeoutMS=2000)
+    try:
+        cliente.admin.command("ping")
+    except PyMongoError as erro:
+        pytest.skip(f"mongod inacessível: {erro}")
+
+    banco = cliente[f"nexus_teste_planos_{uuid.uuid4().hex[:8]}"]
+    colecao = banco["produtos"]
+    garantir_indices(colecao)
+    colecao.insert_many([
+        {
+            "sku": f"PL-{i:04d}", "nome": f"Produto {i}", "categoria": categoria,
+            "categoria_busca": normalizar_categoria(categoria), "preco": 10.0 + i, "estoque": i % 7,
+        }
+        for i, categoria in enumerate(["Eletrônicos", "Gamer", "Casa", "Livros"] * 50)
+    ])
+    yield colecao
+    cliente.drop_database(banco.name)
+    cliente.close()
+
+
+@pytest.mark.parametrize("categoria, ordenar", [
+    ("Eletrônicos", None),
+    ("ELETRONICOS", "recentes"),
+    ("Gamer", "menor_preco"),
+])
+def test_mongo_categoria_usa_indice(colecao_mongo, categoria, ordenar):
+    filtro = montar_filtro(categoria, 2000, 5000) if ordenar == "menor_preco" else montar_filtro(categoria)
+    plano = plano_vencedor(colecao_mongo, filtro, ordem_de(ordenar) if ordenar else None)
+
+    assert "IXSCAN" in plano["estagios"], plano
+    assert "COLLSCAN" not in plano["estagios"], plano
+    # O índice vencedor começa pelo campo normalizado, não pela categoria como digitada
+    chaves, _ = INDICES[plano["indice"]]
+    assert chaves[0][0] == "categoria_busca", plano
@@ -1,9 +1,12 @@
 import requests
 import re
 import streamlit as st
-import pandas as pd
-import io 
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_URL = "http://localhost:8000"
 
@@ -29,38 +32,221 @@ class ProductValidator:
             return val, True, "Válido"
         except: return 0.0, False, "Inválido"
 
+# --- CLIENTE DA API ---
+class ClienteAPI:
+    """
+    Cliente HTTP da API com conexões keep-alive reaproveitadas (requests.Session),
+    timeout em toda chamada, novas tentativas com backoff e latência por rota.
+
+    As novas tentativas valem para falhas de conexão (em qualquer método) e
+    para 502/503/504 só em métodos idempotentes: um POST que chegou na API
+    não é repetido.
+    """
+
+    TIMEOUT_LEITURA = (2, 5)   # (conectar, responder) em segundos
+    TIMEOUT_ESCRITA = (2, 15)
+    AMOSTRAS_POR_ROTA = 500    # Latências guardadas por rota (as mais recentes)
+
+    def __init__(self, base_url: str, tentativas: int = 3, backoff: float = 0.2, conexoes: int = 16):
+        self.base_url = base_url.rstrip("/")
+        self.conexoes = conexoes
+        self.sessao = requests.Session()
+        repetir = Retry(
+            total=tentativas, backoff_factor=backoff,
+            status_forcelist=(502, 503, 504), allowed_methods=("GET", "PUT", "DELETE"),
+            raise_on_status=False
+        )
+        adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, max_retries=repetir)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+        self._latencias = {} # "GET /produtos/{sku}" -> deque de ms
+        self._erros = {}
+        self._lock = threading.Lock()
+
+    def requisitar(self, metodo: str, rota: str, caminho: dict = None, timeout=None, **kwargs):
+        """
+        Faz a chamada e registra a latência sob a rota sem os valores
+        (ex: "DELETE /produtos/{sku}"). Erros de rede sobem como requests.RequestException.
+        """
+        if timeout is None:
+            timeout = self.TIMEOUT_LEITURA if metodo == "GET" else self.TIMEOUT_ESCRITA
+        chave = f"{metodo} {rota}"
+        url = self.base_url + rota.format(**(caminho or {}))
+        inicio = time.perf_counter()
+        try:
+            res = self.sessao.request(metodo, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            self._registrar(chave, inicio, erro=True)
+            raise
+        self._registrar(chave, inicio, erro=res.status_code >= 500)
+        return res
+
+    def _registrar(self, chave: str, inicio: float, erro: bool):
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self._latencias.setdefault(chave, deque(maxlen=self.AMOSTRAS_POR_ROTA)).append(ms)
+            self._erros[chave] = self._erros.get(chave, 0) + erro
+
+    def estatisticas(self) -> list:
+        """Latência por rota (ms) das últimas AMOSTRAS_POR_ROTA chamadas, para o painel Admin."""
+        with self._lock:
+            amostras = {chave: sorted(valores) for chave, valores in self._latencias.items()}
+            erros = dict(self._erros)
+        return [
+            {
+                "rota": chave,
+                "chamadas": len(valores),
+                "erros": erros.get(chave, 0),
+                "media_ms": round(sum(valores) / len(valores), 1),
+                "p50_ms": round(valores[len(valores) // 2], 1),
+                "p95_ms": round(valores[min(len(valores) - 1, int(len(valores) * 0.95))], 1),
+                "max_ms": round(valores[-1], 1),
+            }
+            for chave, valores in sorted(amostras.items())
+        ]
+
+    # --- Operações em lote (vários SKUs em paralelo, sobre o mesmo pool) ---
+    def em_paralelo(self, funcao, itens: list) -> list:
+        """Aplica `funcao` a cada item com até `conexoes` chamadas simultâneas; mantém a ordem."""
+        if not itens:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.conexoes, len(itens))) as executor:
+            return list(executor.map(funcao, itens))
+
+    def obter_varios(self, skus: list) -> dict:
+        """{sku: produto} dos SKUs que existem."""
+        def obter(sku):
+            res = self.requisitar("GET", "/produtos/{sku}", {"sku": sku})
+            return res.json() if res.status_code == 200 else None
+        return {sku: p for sku, p in zip(skus, self.em_paralelo(obter, skus)) if p}
+
+    def deletar_varios(self, skus: list) -> dict:
+        """{sku: removido?}"""
+        def deletar(sku):
+            return self.requisitar("DELETE", "/produtos/{sku}", {"sku": sku}).status_code in (200, 204)
+        return dict(zip(skus, self.em_paralelo(deletar, skus)))
+
+    def atualizar_varios(self, payloads: dict) -> dict:
+        """{sku: atualizado?} para {sku: payload do PUT}."""
+        def atualizar(item):
+            sku, payload = item
+            return self.requisitar("PUT", "/produtos/{sku}", {"sku": sku}, json=payload).status_code in (200, 204)
+        return dict(zip(payloads, self.em_paralelo(atualizar, list(payloads.items()))))
+
+@st.cache_resource(show_spinner=False)
+def cliente_api() -> ClienteAPI:
+    # Um cliente (e um pool de conexões) por processo do Streamlit, não por rerun
+    return ClienteAPI(API_URL)
+
 # --- API ---
+# Réplica local do catálogo ({sku: produto}) e a revisão até onde ela está em dia.
+# Quando o cache de 5s expira, só as mudanças desde essa revisão são baixadas
+# (GET /produtos/changes) e aplicadas por cima: o custo acompanha o volume de
+# alterações, não o tamanho do catálogo.
+_replica = {"revisao": 0, "produtos": {}}
+_replica_lock = threading.Lock()
+
+def sincronizar_replica():
+    with _replica_lock:
+        while True:
+            res = cliente_api().requisitar("GET", "/produtos/changes", params={"since": _replica["revisao"]})
+            if res.status_code == 410:
+                # A API não conhece a nossa revisão (ex: banco recriado): começa do zero
+                _replica.update(revisao=0, produtos={})
+                continue
+            res.raise_for_status()
+            dados = res.json()
+            # Remoções antes dos alterados: um SKU recriado tem revisão maior que a lápide
+            for removido in dados["removidos"]:
+                _replica["produtos"].pop(removido["sku"], None)
+            for produto in dados["alterados"]:
+                _replica["produtos"][produto["sku"]] = produto
+            _replica["revisao"] = dados["revisao"]
+            if not dados["tem_mais"]:
+                return sorted(_replica["produtos"].values(), key=lambda p: p.get("revisao", 0))
+
 @st.cache_data(ttl=5, show_spinner=False)
 def get_produtos():
+    try: return sincronizar_replica()
+    except requests.RequestException: return []
+
+# Vitrine: uma página por vez, filtrada e ordenada pela API (cursor keyset)
+ORDENACOES_VITRINE = {"Recentes": "recentes", "Menor Preço": "menor_preco", "Maior Preço": "maior_preco", "A-Z": "nome"}
+
+@st.cache_data(ttl=5, show_spinner=False)
+def get_pagina_produtos(categoria=None, min_preco=None, max_preco=None, q=None, ordenar="recentes", cursor=None, limite=24):
+    params = {"categoria": categoria, "min_preco": min_preco, "max_preco": max_preco, "q": q,
+              "ordenar": ordenar, "cursor": cursor, "limite": limite}
+    try:
+        res = cliente_api().requisitar("GET", "/produtos/", params={k: v for k, v in params.items() if v})
+        res.raise_for_status()
+        dados = res.json()
+        return {"produtos": dados.get("produtos", []), "proximo_cursor": dados.get("proximo_cursor")}
+    except requests.RequestException: return {"produtos": [], "proximo_cursor": None}
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_analise():
+    """Resumo por categoria (qtd, estoque, valor) do /analytics/geral: custo por categoria, não por produto."""
+    try:
+        res = cliente_api().requisitar("GET", "/analytics/geral")
+        res.raise_for_status()
+        return res.json()
+    except requests.RequestException: return []
+
+@st.cache_data(ttl=5, show_spinner=False)
+def get_kpis():
+    """Indicadores do Dashboard (totais, por categoria e estoque baixo) calculados pela API."""
+    try:
+        res = cliente_api().requisitar("GET", "/analytics/kpis")
+        res.raise_for_status()
+        return res.json()
+    except requests.RequestException: return None
+
+def get_categorias():
+    """{categoria: qtd_produtos}"""
+    return {c["categoria"]: c["qtd_produtos"] for c in get_analise()}
+
+@st.cache_data(ttl=5, show_spinner=False)
+def get_receita(top=10, categoria=None):
+    """Top N produtos por valor em estoque + "Outros", agregado pela API."""
+    params = {"top": top, **({"categoria": categoria} if categoria else {})}
     try:
-        res = requests.get(f"{API_URL}/produtos/", timeout=2)
-        return res.json().get("produtos", []) if res.status_code == 200 else []
-    except: return []
+        res = cliente_api().requisitar("GET", "/analytics/receita", params=params)
+        res.raise_for_status()
+        return res.json()
+    except requests.RequestException: return None
+
+def limpar_caches():
+    """Depois de uma escrita: a próxima leitura vai à API."""
+    get_produtos.clear(); get_pagina_produtos.clear(); get_analise.clear(); get_kpis.clear(); get_receita.clear()
 
 def criar_produto(payload):
     try:
-        res = requests.post(f"{API_URL}/produtos/", json=payload)
-        if res.status_code in [200, 201]: get_produtos.clear()
+        res = cliente_api().requisitar("POST", "/produtos/", json=payload)
+        if res.status_code in [200, 201]: limpar_caches()
         return res
-    except: return None
+    except requests.RequestException: return None
 
 def deletar_produto(sku):
     try:
-        res = requests.delete(f"{API_URL}/produtos/{sku}")
-        if res.status_code == 200: 
-            get_produtos.clear()
+        res = cliente_api().requisitar("DELETE", "/produtos/{sku}", {"sku": sku})
+        if res.status_code in [200, 204]: 
+            limpar_caches()
             return True
         return False
-    except: return False
+    except requests.RequestException: return False
 
-def atualizar_produto(sku, payload):
+def atualizar_produto(sku, payload, versao=None):
+    # Com a versão lida, o PUT só grava se ninguém mexeu no produto antes (senão 412)
+    headers = {"If-Match": f'"{versao}"'} if versao is not None else None
     try:
-        res = requests.put(f"{API_URL}/produtos/{sku}", json=payload)
-        if res.status_code in [200, 204]: 
-            get_produtos.clear()
-            return True
-        return False
-    except: return False
+        res = cliente_api().requisitar("PUT", "/produtos/{sku}", {"sku": sku}, json=payload, headers=headers)
+        if res.status_code in [200, 204]: limpar_caches()
+        return res
+    except requests.RequestException: return None
+
+def estatisticas_cliente():
+    return cliente_api().estatisticas()
 
 def formatar_moeda(val):
     if not isinstance(val, (int, float)): return "R$ 0,00"
@@ -73,180 +259,25 @@ def gerar_sku_sugestao(nome, categoria):
     part = "".join([w[:3] for w in nome.split()[:2]]).upper()
     return f"{prefix}-{part}-{random.randint(100, 999)}"
 
-# --- EXPORTAÇÃO EXCEL "MASTERPIECE" ---
-def converter_para_excel(data):
-    output = io.BytesIO()
-
-    # =========================================
-    # 1. NORMALIZAÇÃO ABSOLUTA
-    # =========================================
-
-    if isinstance(data, pd.DataFrame):
-        data = data.to_dict(orient="records")
-
-    registros = []
-
-    for item in data:
-        registros.append({
-            "SKU": str(item.get("sku", "SEM-SKU")),
-            "Produto": str(item.get("nome", "Sem Nome")),
-            "Categoria": str(item.get("categoria", "Geral")),
-            "Preço Unitário": float(item.get("preco", 0) or 0),
-            "Estoque": int(item.get("estoque", 0) or 0)
-        })
-
-    df = pd.DataFrame(registros)
-    df["Total"] = df["Preço Unitário"] * df["Estoque"]
-
-    patrimonio = df["Total"].sum()
-    total_itens = df["Estoque"].sum()
-    total_skus = len(df)
-
-    # =========================================
-    # 2. EXPORTAÇÃO PROFISSIONAL
-    # =========================================
-
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        wb = writer.book
-        ws = wb.add_worksheet("Relatório Executivo")
-
-        # Remove grid
-        ws.hide_gridlines(2)
-
-        # =========================
-        # DESIGN SYSTEM
-        # =========================
-
-        azul_escuro = "#0B1F3A"
-        azul = "#1F4E79"
-        cinza_bg = "#F4F6F9"
-        verde = "#16A34A"
-
-        # FORMATS
-        fmt_title = wb.add_format({
-            "bold": True,
-            "font_size": 22,
-            "font_name": "Segoe UI",
-            "font_color": "white",
-            "bg_color": azul_escuro,
-            "align": "left",
-            "valign": "vcenter"
-        })
-
-        fmt_sub = wb.add_format({
-            "font_size": 10,
-            "font_color": "#CBD5E1",
-            "bg_color": azul_escuro
-        })
-
-        fmt_header = wb.add_format({
-            "bold": True,
-            "bg_color": azul,
-            "font_color": "white",
-            "align": "center",
-            "valign": "vcenter",
-            "border": 1
-        })
-
-        fmt_money = wb.add_format({
-            "num_format": "R$ #,##0.00",
-            "align": "right",
-            "border": 1
-        })
-
-        fmt_center = wb.add_format({
-            "align": "center",
-            "border": 1
-        })
-
-        fmt_text = wb.add_format({
-            "align": "left",
-            "border": 1
-        })
-
-        fmt_kpi_label = wb.add_format({
-            "font_size": 9,
-            "font_color": "#64748B"
-        })
-
-        fmt_kpi_val = wb.add_format({
-            "bold": True,
-            "font_size": 14
-        })
-
-        fmt_kpi_money = wb.add_format({
-            "bold": True,
-            "font_size": 14,
-            "font_color": verde,
-            "num_format": "R$ #,##0.00"
-        })
-
-        # =========================
-        # HEADER
-        # =========================
-
-        ws.merge_range("A1:F2", "RELATÓRIO EXECUTIVO DE INVENTÁRIO", fmt_title)
-        ws.merge_range(
-            "A3:F3",
-            f"Gerado em {datetime.now().strftime('%d/%m/%Y às %H:%M')}",
-            fmt_sub
-        )
-
-        ws.set_row(0, 35)
-        ws.set_row(1, 10)
-        ws.set_row(2, 18)
-
-        # =========================
-        # KPIs
-        # =========================
-
-        #ws.write("A5", "PATRIMÔNIO TOTAL", fmt_kpi_label)
-        #ws.write("A6", patrimonio, fmt_kpi_money)
-
-        ws.write("C5", "TOTAL DE ITENS", fmt_kpi_label)
-        ws.write("C6", total_itens, fmt_kpi_val)
-
-        ws.write("E5", "SKUs ATIVOS", fmt_kpi_label)
-        ws.write("E6", total_skus, fmt_kpi_val)
-
-        # =========================
-        # TABELA
-        # =========================
-
-        start_row = 8
-
-        headers = list(df.columns)
-
-        # Cabeçalhos
-        for col, header in enumerate(headers):
-            ws.write(start_row, col, header, fmt_header)
-
-        # Dados
-        for row_num, row in enumerate(df.values, start_row + 1):
-            for col_num, value in enumerate(row):
-                if col_num in [3, 5]:  # Preço e Total
-                    ws.write(row_num, col_num, value, fmt_money)
-                elif col_num == 4:
-                    ws.write(row_num, col_num, value, fmt_center)
-                else:
-                    ws.write(row_num, col_num, value, fmt_text)
-
-        # Total geral
-        total_row = start_row + len(df) + 2
-        ws.write(total_row, 4, "TOTAL GERAL:", fmt_header)
-        ws.write_formula(
-            total_row,
-            5,
-            f"=SUM(F{start_row+2}:F{start_row+1+len(df)})",
-            fmt_money
-        )
-
-        # Ajuste de colunas
-        ws.set_column("A:A", 18)
-        ws.set_column("B:B", 40)
-        ws.set_column("C:C", 20)
-        ws.set_column("D:D", 18)
-        ws.set_column("E:E", 12)
-        ws.set_column("F:F", 18)
-
-    return output.getvalue()
+# --- EXPORTAÇÃO EXCEL ---
+# Último relatório baixado e o ETag (versão do catálogo) dele
+_relatorio = {"etag": None, "conteudo": None}
+_relatorio_lock = threading.Lock()
+
+def baixar_relatorio_inventario():
+    """
+    Bytes do Relatório Executivo (.xlsx) gerado pela API em /relatorios/inventario.xlsx.
+    Chamado só no clique do botão de download (data=callable), não a cada rerun.
+    Revalida com If-None-Match: se o catálogo não mudou, a API responde 304 e
+    os bytes guardados são reaproveitados.
+    """
+    with _relatorio_lock:
+        cabecalhos = {"If-None-Match": _relatorio["etag"]} if _relatorio["etag"] else {}
+        try:
+            res = cliente_api().requisitar("GET", "/relatorios/inventario.xlsx", timeout=(2, 120), headers=cabecalhos)
+            if res.status_code == 304:
+                return _relatorio["conteudo"]
+            res.raise_for_status()
+        except requests.RequestException: return b""
+        _relatorio.update(etag=res.headers.get("ETag"), conteudo=res.content)
+        return res.content